@@ -1,23 +1,161 @@
 # app.py
+import asyncio
+import json
 import os
-from fastapi import FastAPI, HTTPException, Depends, Query
+import time
+from contextlib import asynccontextmanager, nullcontext
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 from config import *
-from token_client import TokenClient
+from archive import LogArchive
+from cache import TopCache
+import export
+import metrics
+from token_client import AsyncTokenClient, TokenClient
 from ps_client import TokenIndexer
+from follower import IndexFollower, StreamFollower
+
+# Клиенты и индексатор создаются в lifespan, фоновой задачей startup(), а не при импорте:
+# uvicorn сразу слушает порт и отвечает на /livez. Пока startup не закончился (в том числе
+# пока RPC недоступен при первом запуске с пустой БД), остальные эндпоинты отдают 503.
+# sync-клиент — для индексатора (потоки, SQLite), async — для RPC-эндпоинтов
+cli = None
+acli = None
+# один индексатор на процесс для всех TOKENS: соединение-писатель + пул read-only соединений
+indexer = None
+follower = None
+startup_error = None
+# async-клиенты остальных индексируемых токенов, создаются при первом запросе с token=
+token_clients = {}
+token_clients_lock = asyncio.Lock()
+# готовые ответы /get_top*, пока не сдвинулся индекс
+top_cache = TopCache(TOP_CACHE_MAX_N)
+
+
+def open_indexer():
+    # Миграции SQLite и реестр токенов. decimals/symbol берутся из реестра (tokens), к RPC
+    # индексатор идёт только за токеном, которого там ещё нет.
+    c = TokenClient(RPC_URLS, TOKEN_ADDRESS, ERC20_ABI, multicall_address=MULTICALL3_ADDRESS)
+    archive = LogArchive(ARCHIVE_DIR) if ARCHIVE_DIR else None
+    return c, TokenIndexer(c, DB_PATH, tokens=TOKENS, storage_url=STORAGE_URL, archive=archive)
+
+
+async def startup():
+    global cli, acli, indexer, follower, startup_error
+    while True:
+        try:
+            c, idx = await run_in_threadpool(open_indexer)
+            break
+        except Exception as e:
+            startup_error = str(e)
+            print(f"[startup] {e}; повтор через {INDEX_INTERVAL}s")
+            await asyncio.sleep(INDEX_INTERVAL)
+    _, decimals, symbol = idx.token_info()
+    cli, acli = c, await AsyncTokenClient(RPC_URLS, TOKEN_ADDRESS, ERC20_ABI, multicall_address=MULTICALL3_ADDRESS,
+                                          decimals=decimals, symbol=symbol).connect()
+    follower = StreamFollower(idx, WS_URL) if WS_URL else IndexFollower(idx)
+    if bool_arg(os.getenv("BACKGROUND_INDEX"), BACKGROUND_INDEX):
+        follower.start()
+    indexer, startup_error = idx, None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    task = asyncio.create_task(startup())
+    yield
+    task.cancel()
+    if follower is not None:
+        follower.stop()
+    if acli is not None:
+        await acli.close()
+    for c in token_clients.values():
+        await c.close()
+    if indexer is not None:
+        indexer.close()
+
+
+app = FastAPI(title="ERC20 helper (Polygon)", lifespan=lifespan)
+
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    # маршрут — шаблон пути (/get_top), а не URL с параметрами: иначе меток будет без счёта
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = route.path if route is not None else "other"
+        metrics.HTTP_REQUESTS.inc(route=path, status=status)
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - t0, route=path)
 
-app = FastAPI(title="ERC20 helper (Polygon)")
-
-cli = TokenClient(RPC_URL, TOKEN_ADDRESS, ERC20_ABI)
 
 def get_indexer():
-    idx = TokenIndexer(cli, DB_PATH)
+    if indexer is None:
+        raise HTTPException(status_code=503, detail=f"сервис запускается: {startup_error or 'открываю индекс'}",
+                            headers={"Retry-After": str(INDEX_INTERVAL)})
+    return indexer
+
+
+async def token_client(token: Optional[str]) -> AsyncTokenClient:
+    # только токены из индекса: иначе любой адрес в token= открывал бы новую сессию
+    idx = get_indexer()
+    if token is None or token.lower() == TOKEN_ADDRESS.lower():
+        return acli
     try:
-        yield idx
-    finally:
-        idx.close()
+        _, decimals, symbol = idx.token_info(token)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    key = token.lower()
+    async with token_clients_lock:
+        if key not in token_clients:
+            c = AsyncTokenClient(RPC_URLS, key, ERC20_ABI, multicall_address=MULTICALL3_ADDRESS,
+                                 decimals=decimals, symbol=symbol)
+            await c.connect()
+            token_clients[key] = c
+        return token_clients[key]
+
+
+def token_info(idx: TokenIndexer, token: Optional[str]):
+    try:
+        return idx.token_info(token)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _json(v) -> bytes:
+    # как JSONResponse, чтобы ответ из кэша не отличался от обычного
+    return json.dumps(v, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    # If-None-Match сравнивается слабо: W/"x" и "x" — одно и то же
+    if not header:
+        return False
+    tags = {t.strip().removeprefix("W/") for t in header.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+def cached_top(request: Request, name: str, idx: TokenIndexer, token: Optional[str], n: int,
+               generation: int, status: dict, rows) -> Response:
+    # rows(n) -> строки топа-n (dict) по возрастанию баланса. Ключ кэша — (эндпоинт, токен) и
+    # (last_scanned_block, поколение индексатора); поколение читается до курсора и строк, так что
+    # строки, посчитанные на пересечении с коммитом, лежат под ключом, который уже не спросят.
+    tid = idx.token_info(token)[0]
+    etag, top = top_cache.get((name, tid), (status["last_scanned_block"], generation), n,
+                              lambda size: [_json(r) for r in rows(size)])
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(b'{"top":' + top + b"," + _json(status)[1:], media_type="application/json",
+                    headers={"ETag": etag})
+
 
 def bool_arg(v: Optional[str], default: bool) -> bool:
     if v is None:
@@ -25,67 +163,214 @@ def bool_arg(v: Optional[str], default: bool) -> bool:
     return str(v).lower() in ("1", "true", "yes", "y", "on")
 
 
+def index_status(idx: TokenIndexer, max_lag: Optional[int], wait: float, token: Optional[str] = None) -> dict:
+    # Запросы не индексируют: индекс ведёт IndexFollower. Если индекс отстаёт больше max_lag —
+    # ждём до wait секунд, пока он догонит, иначе 503.
+    status = idx.index_status(token)
+    if max_lag is None:
+        return status
+    deadline = time.monotonic() + wait
+    while status["lag"] is None or status["lag"] > max_lag:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise HTTPException(
+                status_code=503,
+                detail=f"индекс отстаёт: lag={status['lag']} > max_lag={max_lag}",
+                headers={"Retry-After": str(INDEX_INTERVAL)},
+            )
+        time.sleep(min(0.5, left))
+        status = idx.index_status(token)
+    return status
+
+
+def read_index_balances(addresses, head=None, max_lag=None, at_block=None, token=None):
+    # -> (last_scanned_block, балансы) или (last, None), если индекс пуст/отстаёт сильнее max_lag
+    if at_block is not None:
+        return at_block, indexer.get_balances(addresses, at_block, token)
+    last = indexer.index_status(token)["last_scanned_block"]
+    if last is None or (max_lag is not None and head - last > max_lag):
+        return last, None
+    return last, indexer.get_balances(addresses, token=token)
+
+
+async def index_balances(addresses, source, at_block, token, client):
+    # source=index — всегда из holders; auto — из holders, только если индекс свежий,
+    # иначе None и ответ берётся с RPC. at_block — только из истории индекса.
+    if at_block is not None:
+        if source == "rpc":
+            raise HTTPException(status_code=400, detail="at_block доступен только для source=index|auto")
+        return await run_in_threadpool(read_index_balances, addresses, at_block=at_block, token=token)
+    if source == "rpc":
+        return None
+    if source == "index":
+        last, raws = await run_in_threadpool(read_index_balances, addresses, token=token)
+        if raws is None:
+            raise HTTPException(status_code=503, detail="индекс пуст: нужен bootstrap/index")
+    else:
+        last, raws = await run_in_threadpool(read_index_balances, addresses, await client.head(), INDEX_MAX_LAG,
+                                             token=token)
+        if raws is None:
+            return None
+    return last, raws
+
+
 class BalanceBatchBody(BaseModel):
     addresses: List[str] = Field(..., min_items=1)
     human: Optional[bool] = False
+    source: Literal["index", "rpc", "auto"] = "auto"
+    at_block: Optional[int] = Field(None, ge=0, description="баланс после этого блока, из истории индекса")
+    token: Optional[str] = Field(None, description="адрес токена из TOKENS, по умолчанию TOKEN_ADDRESS")
 
 
 class BootstrapBody(BaseModel):
     api_key: Optional[str] = None
+    token: Optional[str] = None
     start: Optional[int] = START_BLOCK
     offset: Optional[int] = 2000
-    sleep: Optional[float] = 0.25
+    sleep: Optional[float] = None
+    rate: Optional[float] = Field(None, gt=0, description="запросов/сек к Etherscan, по умолчанию ETHERSCAN_RATE")
+    workers: Optional[int] = Field(ETHERSCAN_WORKERS, ge=1, le=32)
 
 
 class IndexBody(BaseModel):
     start: Optional[int] = None
     batch: Optional[int] = BATCH_SIZE
     conf: Optional[int] = CONFIRMATIONS
+    profile: bool = Field(False, description="вернуть время прогона по этапам")
 
 
+class BackfillBody(BaseModel):
+    start: Optional[int] = None
+    end: Optional[int] = None
+    workers: Optional[int] = Field(BACKFILL_WORKERS, ge=1, le=64)
+    shard: Optional[int] = Field(BACKFILL_SHARD, ge=1)
+    batch: Optional[int] = BATCH_SIZE
+    conf: Optional[int] = CONFIRMATIONS
+    profile: bool = Field(False, description="вернуть время прогона по этапам")
+
+
+def profiled(enabled):
+    # профиль по этапам только для этого прогона; печатается и возвращается в ответе
+    return metrics.profile() if enabled else nullcontext()
+
+
+def run_result(idx, p):
+    out = {"ok": True, "last_scanned_block": idx.index_status()["last_scanned_block"]}
+    if p is not None:
+        print(p.format())
+        out["profile"] = p.report()
+    return out
+
+
+# GET /livez — процесс жив и обслуживает event loop; ни RPC, ни БД
+@app.get("/livez")
+async def livez():
+    return {"ok": True}
+
+
+# GET /readyz — startup закончен и индекс читается; RPC не трогает
+@app.get("/readyz")
 @app.get("/health")
-def health():
+def readyz():
+    idx = get_indexer()
     try:
-        _ = cli.get_token_info()
-        return {"ok": True}
+        status = idx.index_status()
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"ok": True, **status, "follower_running": follower.running}
 
 
-# GET /get_balance?address=0x...&human=1
+# GET /get_balance?address=0x...&human=1&source=auto&at_block=43000000
 @app.get("/get_balance")
-def get_balance(
+async def get_balance(
     address: str = Query(..., description="0x-адрес"),
-    human: Optional[str] = Query(None, description="1/true — формат с символом токена"),):
+    human: Optional[str] = Query(None, description="1/true — формат с символом токена"),
+    source: Literal["index", "rpc", "auto"] = Query("auto", description="index — из holders, rpc — balanceOf, auto — индекс, если он свежий"),
+    at_block: Optional[int] = Query(None, ge=0, description="баланс после этого блока, из истории индекса"),
+    token: Optional[str] = Query(None, description="адрес токена из TOKENS, по умолчанию TOKEN_ADDRESS"),):
     try:
-        val = cli.get_balance(address, bool_arg(human, True))
-        return {"balance": val}
+        human = bool_arg(human, True)
+        tc = await token_client(token)
+        addr = tc._to_checksum(address)
+        found = await index_balances([addr], source, at_block, token, tc)
+        if found is not None:
+            block, (raw,) = found
+            return {"balance": tc._fmt(raw) if human else raw, "block": block, "source": "index"}
+        block = await tc.head()
+        val = await tc.get_balance(addr, human)
+        return {"balance": val, "block": block, "source": "rpc"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
-# POST /get_balance_batch  {"addresses":[...], "human":false}
+# POST /get_balance_batch  {"addresses":[...], "human":false, "source":"auto"}
 @app.post("/get_balance_batch")
-def get_balance_batch(body: BalanceBatchBody):
+async def get_balance_batch(body: BalanceBatchBody):
     try:
-        if body.human:
-            out = [cli.get_balance(a, True) for a in body.addresses]
-        else:
-            out = cli.get_balance_batch(body.addresses)
-        return {"balances": out}
+        tc = await token_client(body.token)
+        valid = {}
+        for a in body.addresses:
+            try:
+                valid[a] = tc._to_checksum(a)
+            except ValueError:
+                pass
+        found = await index_balances(list(valid.values()), body.source, body.at_block, body.token, tc) if valid else None
+        if found is not None:
+            block, raws = found
+            by_addr = dict(zip(valid.values(), raws))
+            out = []
+            for a in body.addresses:
+                if a not in valid:
+                    out.append({"error": f"Некорректный адрес: {a}"})
+                else:
+                    raw = by_addr[valid[a]]
+                    out.append(tc._fmt(raw) if body.human else raw)
+            return {"balances": out, "block": block, "source": "index"}
+        block = await tc.head()
+        out = await tc.get_balance_batch(body.addresses, bool(body.human))
+        return {"balances": out, "block": block, "source": "rpc"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.get("/get_token_info")
-def get_token_info():
+async def get_token_info(token: Optional[str] = Query(None, description="адрес токена из TOKENS")):
     try:
-        return cli.get_token_info()
+        return await (await token_client(token)).get_token_info()
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
-# POST /bootstrap  {"api_key":"...", "start": 42812490, "offset":2000, "sleep":0.25}
+@app.get("/cache_stats")
+async def cache_stats():
+    get_indexer()
+    return {**acli.cache_stats(), "top": top_cache.stats(), "rpc": acli.w3.provider.pool.stats()}
+
+
+# GET /metrics — Prometheus
+@app.get("/metrics")
+def get_metrics():
+    # отставание индекса — на момент опроса, по каждому токену; до конца startup — без него
+    idx, head = indexer, None
+    for addr in idx.tokens if idx is not None else ():
+        status = idx.index_status(addr)
+        head = status["head_block"]
+        if status["last_scanned_block"] is not None:
+            metrics.LAST_BLOCK.set(status["last_scanned_block"], token=addr)
+        if status["lag"] is not None:
+            metrics.LAG.set(status["lag"], token=addr)
+    if head is not None:
+        metrics.HEAD_BLOCK.set(head)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# POST /bootstrap  {"api_key":"...", "start": 42812490, "offset":2000, "rate":5, "workers":4}
 @app.post("/bootstrap")
 def bootstrap(body: BootstrapBody, idx: TokenIndexer = Depends(get_indexer)):
     api_key = body.api_key or os.getenv("POLYGONSCAN_API_KEY") or POLYGONSCAN_API_KEY
@@ -95,11 +380,13 @@ def bootstrap(body: BootstrapBody, idx: TokenIndexer = Depends(get_indexer)):
         idx.first_from_polygonscan(
             api_key=api_key,
             start_block=body.start if body.start is not None else START_BLOCK,
-            sleep_s=body.sleep or 0.25,
+            sleep_s=body.sleep,
             offset=body.offset or 2000,
+            rate=body.rate,
+            workers=body.workers or ETHERSCAN_WORKERS,
+            token=body.token,
         )
-        last = idx._get_last_block()
-        return {"ok": True, "last_scanned_block": last}
+        return {"ok": True, "last_scanned_block": idx.index_status(body.token)["last_scanned_block"]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -108,72 +395,211 @@ def bootstrap(body: BootstrapBody, idx: TokenIndexer = Depends(get_indexer)):
 @app.post("/index")
 def index(body: IndexBody, idx: TokenIndexer = Depends(get_indexer)):
     try:
-        idx.index_transfers(
-            start_block=body.start,
-            batch_size=body.batch or BATCH_SIZE,
-            confirmations=body.conf or CONFIRMATIONS,
-        )
-        last = idx._get_last_block()
-        return {"ok": True, "last_scanned_block": last}
+        with profiled(body.profile) as p:
+            idx.index_transfers(
+                start_block=body.start,
+                batch_size=body.batch or BATCH_SIZE,
+                confirmations=body.conf if body.conf is not None else CONFIRMATIONS,
+            )
+        return run_result(idx, p)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# POST /backfill {"start": null, "end": null, "workers": 8, "shard": 50000}
+@app.post("/backfill")
+def backfill(body: BackfillBody, idx: TokenIndexer = Depends(get_indexer)):
+    try:
+        with profiled(body.profile) as p:
+            idx.backfill(
+                start_block=body.start,
+                end_block=body.end,
+                shard_size=body.shard or BACKFILL_SHARD,
+                workers=body.workers or BACKFILL_WORKERS,
+                batch_size=body.batch or BATCH_SIZE,
+                confirmations=body.conf if body.conf is not None else CONFIRMATIONS,
+            )
+        return run_result(idx, p)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-# GET /get_top?n=10&human=1&update=rpc|scan&api_key=...
+# GET /get_top?n=10&max_lag=100&wait=5  |  /get_top?n=100&at_block=43000000
 @app.get("/get_top")
 def get_top(
+    request: Request,
     n: int = Query(10, ge=1),
-    update: str = Query("rpc", pattern="^(rpc|scan)$"),
-    api_key: Optional[str] = Query(None),
+    max_lag: Optional[int] = Query(None, ge=0, description="макс. отставание индекса от головы, блоков"),
+    wait: float = Query(0, ge=0, le=60, description="сколько секунд ждать догонки при max_lag"),
+    at_block: Optional[int] = Query(None, ge=0, description="топ после этого блока, из снимков и истории"),
+    token: Optional[str] = Query(None, description="адрес токена из TOKENS, по умолчанию TOKEN_ADDRESS"),
     idx: TokenIndexer = Depends(get_indexer),
 ):
     try:
-        if update == "scan":
-            key = api_key or os.getenv("POLYGONSCAN_API_KEY") or POLYGONSCAN_API_KEY
-            if not key:
-                raise HTTPException(status_code=400, detail="api_key required for update=scan")
-            rows = idx.get_top(n, api_key=key, parse_type="scan")
-        else:
-            rows = idx.get_top(n, parse_type="RPC")
-
-
+        token_info(idx, token)
+        generation = idx.generation
+        status = index_status(idx, max_lag if at_block is None else None, wait, token)
+        if at_block is None:
+            return cached_top(request, "get_top", idx, token, n, generation, status, lambda size: [
+                {"address": a, "balance": b} for a, b in idx.get_top(size, token=token)])
+        rows = idx.get_top(n, at_block=at_block, token=token)
         out = [{"address": a, "balance": b} for a, b in rows]
+        status["block"] = at_block
 
-        return {"top": out}
+        return {"top": out, **status}
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-# GET /get_top_with_transactions?n=10&human=1&update=rpc|scan&api_key=...
+# GET /get_top_with_transactions?n=10&max_lag=100&wait=5
 @app.get("/get_top_with_transactions")
 def get_top_with_transactions(
+    request: Request,
     n: int = Query(10, ge=1),
-    update: str = Query("rpc", pattern="^(rpc|scan)$"),
-    api_key: Optional[str] = Query(None),
+    max_lag: Optional[int] = Query(None, ge=0, description="макс. отставание индекса от головы, блоков"),
+    wait: float = Query(0, ge=0, le=60, description="сколько секунд ждать догонки при max_lag"),
+    token: Optional[str] = Query(None, description="адрес токена из TOKENS, по умолчанию TOKEN_ADDRESS"),
     idx: TokenIndexer = Depends(get_indexer),
 ):
     try:
-        if update == "scan":
-            key = api_key or os.getenv("POLYGONSCAN_API_KEY") or POLYGONSCAN_API_KEY
-            if not key:
-                raise HTTPException(status_code=400, detail="api_key required for update=scan")
-            rows = idx.get_top_with_transactions(n, parse_type="scan", api_key=key)
-        else:
-            rows = idx.get_top_with_transactions(n, parse_type="RPC")
-
-        dec, sym = cli.decimals, cli.symbol
-        out = [{"address": a, "balance": b, "symbol": sym, "last_tx": ts}
-               for a, b, ts in rows]
-
-        return {"top": out}
+        _, dec, sym = token_info(idx, token)
+        generation = idx.generation
+        status = index_status(idx, max_lag, wait, token)
+        return cached_top(request, "get_top_with_transactions", idx, token, n, generation, status, lambda size: [
+            {"address": a, "balance": b, "symbol": sym, "last_tx": ts}
+            for a, b, ts in idx.get_top_with_transactions(size, token=token)])
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# GET /get_stats?top=10&top=100
+@app.get("/get_stats")
+def get_stats(
+    top: List[int] = Query([10, 100], description="top-N для доли крупнейших держателей, можно несколько"),
+    token: Optional[str] = Query(None, description="адрес токена из TOKENS, по умолчанию TOKEN_ADDRESS"),
+    idx: TokenIndexer = Depends(get_indexer),
+):
+    token_info(idx, token)
+    if any(n < 1 or n > TOP_CACHE_MAX_N for n in top):
+        raise HTTPException(status_code=400, detail=f"top — от 1 до {TOP_CACHE_MAX_N}")
+    try:
+        status = idx.index_status(token)
+        return {**idx.holder_stats(token, list(dict.fromkeys(top))), **status}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# GET /get_transfers?address=0x...&from_block=&to_block=&limit=100&cursor=43000000:12&order=desc
+@app.get("/get_transfers")
+def get_transfers(
+    address: str = Query(..., description="0x-адрес"),
+    from_block: Optional[int] = Query(None, ge=0),
+    to_block: Optional[int] = Query(None, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="next_cursor из предыдущей страницы"),
+    order: Literal["asc", "desc"] = Query("desc"),
+    token: Optional[str] = Query(None, description="адрес токена из TOKENS, по умолчанию TOKEN_ADDRESS"),
+    idx: TokenIndexer = Depends(get_indexer),
+):
+    _, decimals, _ = token_info(idx, token)
+    try:
+        addr = cli._to_checksum(address)
+        after = None
+        if cursor:
+            try:
+                blk, li = cursor.split(":")
+                after = (int(blk), int(li))
+            except ValueError:
+                raise ValueError(f"Некорректный cursor: {cursor}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        rows, nxt = idx.get_transfers(addr, from_block, to_block, limit, after, order, token)
+        out = []
+        for blk, li, txh, frm, to, val, ts in rows:
+            out.append({
+                "block": blk, "log_index": li, "tx_hash": txh, "ts": ts,
+                "from": frm, "to": to,
+                "value": export.decimal_str(val, decimals), "value_raw": str(val),
+                "direction": "self" if frm == to else ("out" if frm == addr else "in"),
+            })
+        return {"address": addr, "transfers": out, "next_cursor": f"{nxt[0]}:{nxt[1]}" if nxt else None,
+                **idx.index_status(token)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def export_response(fmt, name, columns, chunks):
+    # chunks() читает из одного соединения пула и занимает его, пока клиент читает.
+    # Ошибки формата — до начала ответа, чтобы вернуть 400, а не оборванный поток.
+    try:
+        export.check_format(fmt)
+    except (ValueError, RuntimeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def body():
+        yield from export.stream(fmt, columns, chunks())
+
+    return StreamingResponse(body(), media_type=export.MEDIA_TYPES[fmt],
+                             headers={"Content-Disposition": f'attachment; filename="{name}.{fmt}"'})
+
+
+# GET /export/holders?format=csv&min_balance=1000
+@app.get("/export/holders")
+def export_holders(
+    format: Literal["ndjson", "csv", "parquet"] = Query("ndjson"),
+    min_balance: Optional[str] = Query(None, description="не меньше, в единицах токена"),
+    max_balance: Optional[str] = Query(None, description="не больше, в единицах токена"),
+    token: Optional[str] = Query(None, description="адрес токена из TOKENS, по умолчанию TOKEN_ADDRESS"),
+    idx: TokenIndexer = Depends(get_indexer),
+):
+    tid, decimals, _ = token_info(idx, token)
+    try:
+        for v in (min_balance, max_balance):
+            if v is not None:
+                export.parse_amount(v, decimals)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return export_response(format, "holders", export.HOLDER_COLUMNS,
+                           lambda: export.holder_chunks(idx.storage, tid, decimals, min_balance, max_balance))
+
+
+# GET /export/transfers?format=ndjson&from_block=42812490&to_block=43000000
+@app.get("/export/transfers")
+def export_transfers(
+    format: Literal["ndjson", "csv", "parquet"] = Query("ndjson"),
+    from_block: Optional[int] = Query(None, ge=0),
+    to_block: Optional[int] = Query(None, ge=0),
+    token: Optional[str] = Query(None, description="адрес токена из TOKENS, по умолчанию TOKEN_ADDRESS"),
+    idx: TokenIndexer = Depends(get_indexer),
+):
+    tid, decimals, _ = token_info(idx, token)
+
+    def chunks():
+        with idx._reader() as conn:
+            yield from export.transfer_chunks(conn, tid, decimals, from_block, to_block)
+
+    return export_response(format, "transfers", export.TRANSFER_COLUMNS, chunks)
+
+
+# GET /index_status
+@app.get("/index_status")
+def get_index_status(token: Optional[str] = Query(None, description="адрес токена из TOKENS"),
+                     idx: TokenIndexer = Depends(get_indexer)):
+    token_info(idx, token)
+    return {
+        **idx.index_status(token),
+        "follower_running": follower.running,
+        "follower_error": follower.last_error,
+    }
+
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", "8080"))
@@ -0,0 +1,309 @@
+# archive.py
+# Локальный архив Transfer-логов: индексатор с ARCHIVE_DIR дописывает сюда каждое закоммиченное
+# окно — кадр со сжатыми (zstd, без пакета zstandard — zlib) полями логов: токен, from, to,
+# value, блок, logIndex, хэш транзакции и время блока. Файлы-сегменты по ARCHIVE_SEGMENT блоков
+# только дописываются; откат реорга обрезает хвост. rebuild строит из архива новую БД
+# (holders, история, снимки, transfers) со скоростью диска, без RPC и Etherscan.
+#   python archive.py info --archive archive/
+#   python archive.py rebuild --archive archive/ --db rebuilt.db [--to-block 43000000]
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+
+from config import *
+from ps_client import TokenIndexer
+from token_client import TokenClient
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"TRF1"
+ZLIB, ZSTD = 1, 2
+# magic, кодек, токенов, записей, первый блок записей, блок курсора, длина сжатого, длина исходного, crc32
+_HEADER = struct.Struct(">4sBHIQQIII")
+_TOKEN = 21  # адрес + флаг "кадр сдвинул курсор токена"
+
+
+def _compress(raw, codec):
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor(level=ARCHIVE_ZSTD_LEVEL).compress(raw)
+    return zlib.compress(raw, 6)
+
+
+def _decompress(data, codec, size):
+    if codec == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("архив сжат zstd: pip install zstandard")
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=size)
+    return zlib.decompress(data)
+
+
+def encode(tokens, advanced, records):
+    # records: [(токен, from, to, value, block, ts, tx_hash, log_index)] -> таблица токенов и
+    # колонки подряд: у соседних записей те же блоки и адреса, так сжимается лучше, чем построчно
+    index = {a: i for i, a in enumerate(tokens)}
+    n = len(records)
+    return b"".join([
+        *(bytes.fromhex(a[2:]) + bytes([a in advanced]) for a in tokens),
+        struct.pack(f">{n}Q", *(r[4] for r in records)),
+        struct.pack(f">{n}I", *(r[7] for r in records)),
+        struct.pack(f">{n}Q", *(r[5] or 0 for r in records)),
+        struct.pack(f">{n}H", *(index[r[0]] for r in records)),
+        b"".join(bytes.fromhex(r[6][2:]) for r in records),
+        b"".join(bytes.fromhex(r[1][2:]) for r in records),
+        b"".join(bytes.fromhex(r[2][2:]) for r in records),
+        b"".join(int(r[3]).to_bytes(32, "big") for r in records),
+    ])
+
+
+def decode(raw, ntok, n):
+    # -> ([токены], [токены со сдвинутым курсором], {токен: [(from, to, value, block, ts, tx_hash, log_index)]})
+    tokens = ["0x" + raw[i * _TOKEN:i * _TOKEN + 20].hex() for i in range(ntok)]
+    advanced = [a for i, a in enumerate(tokens) if raw[i * _TOKEN + 20]]
+    pos = _TOKEN * ntok
+    blocks = struct.unpack_from(f">{n}Q", raw, pos)
+    pos += 8 * n
+    log_idx = struct.unpack_from(f">{n}I", raw, pos)
+    pos += 4 * n
+    ts = struct.unpack_from(f">{n}Q", raw, pos)
+    pos += 8 * n
+    tok = struct.unpack_from(f">{n}H", raw, pos)
+    pos += 2 * n
+    txs = raw[pos:pos + 32 * n].hex()
+    pos += 32 * n
+    frm = raw[pos:pos + 20 * n].hex()
+    pos += 20 * n
+    to = raw[pos:pos + 20 * n].hex()
+    pos += 20 * n
+    values = raw[pos:pos + 32 * n]
+    by_token = {a: [] for a in tokens}
+    lists = [by_token[a] for a in tokens]
+    for i in range(n):
+        lists[tok[i]].append((
+            "0x" + frm[40 * i:40 * i + 40], "0x" + to[40 * i:40 * i + 40],
+            int.from_bytes(values[32 * i:32 * i + 32], "big"),
+            blocks[i], ts[i] or None, "0x" + txs[64 * i:64 * i + 64], log_idx[i],
+        ))
+    return tokens, advanced, by_token
+
+
+class LogArchive:
+    """Каталог сегментов {первый блок:012d}.seg и tokens.json с decimals/symbol токенов.
+
+    Кадр лежит в сегменте своего блока — курсора сдвинутых им токенов (кадр backfill без сдвига
+    курсора — последнего блока своих записей). Пишет один индексатор под write_lock, кадр
+    дописывается до коммита SQLite: после сбоя между ними окно применится и запишется ещё раз,
+    повтор rebuild отбросит по (блок, logIndex), а кадры дальше курсора индексатор срежет при старте.
+    """
+
+    def __init__(self, path, codec=None, segment=ARCHIVE_SEGMENT):
+        # segment — блоков в файле, один и тот же для каталога
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.codec = codec or (ZSTD if zstandard is not None else ZLIB)
+        self.segment = segment
+        self._file = None  # (сегмент, файл) для дописывания
+        self._repair()
+
+    def set_tokens(self, tokens):
+        # {адрес: (decimals, symbol)} — rebuild не ходит за ними в RPC
+        known = self.tokens()
+        if all(a in known for a in tokens):
+            return
+        known.update((a, {"decimals": d, "symbol": s}) for a, (d, s) in tokens.items())
+        tmp = os.path.join(self.path, "tokens.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(known, f, indent=1)
+        os.replace(tmp, os.path.join(self.path, "tokens.json"))
+
+    def tokens(self):
+        try:
+            with open(os.path.join(self.path, "tokens.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def append(self, block, advanced, records):
+        # block — новый курсор токенов advanced (или None — последний блок записей);
+        # records — применённые переводы окна: [(токен, from, to, value, block, ts, tx_hash, log_index)]
+        if block is None:
+            block = max(r[4] for r in records)
+        tokens = list(dict.fromkeys([*advanced, *(r[0] for r in records)]))
+        raw = encode(tokens, set(advanced), records)
+        data = _compress(raw, self.codec)
+        first = min((r[4] for r in records), default=block)
+        f = self._open(block // self.segment * self.segment)
+        f.write(_HEADER.pack(MAGIC, self.codec, len(tokens), len(records), first, block, len(data), len(raw),
+                             zlib.crc32(data)) + data)
+        f.flush()
+
+    def truncate(self, fork):
+        # откат реорга: кадры с блоком дальше fork уходят; их записи до fork включительно (окно,
+        # начатое до форка) дописываются отдельным кадром с блоком fork
+        self.close()
+        kept, advanced = [], set()
+        for seg in self.segments():
+            if seg + self.segment <= fork + 1:
+                continue
+            path = self._path(seg)
+            with open(path, "rb") as f:
+                data = f.read()
+            frames = list(_frames(data))
+            cut = next((i for i, fr in enumerate(frames) if fr[5] > fork), None)
+            if cut is None:
+                continue
+            tail = []
+            for offset, codec, ntok, n, first, block, size, raw_size in frames[cut:]:
+                body = data[offset:offset + _HEADER.size + size]
+                if block <= fork:
+                    tail.append(body)  # кадр отстающего токена, записанный после
+                elif first <= fork:
+                    tokens, adv, by_token = decode(_decompress(body[_HEADER.size:], codec, raw_size), ntok, n)
+                    kept.extend((a, *t) for a, ts in by_token.items() for t in ts if t[3] <= fork)
+                    advanced.update(adv)
+            with open(path, "r+b") as f:
+                f.truncate(frames[cut][0])
+                f.seek(0, os.SEEK_END)
+                f.write(b"".join(tail))
+            if os.path.getsize(path) == 0:
+                os.remove(path)
+        if kept:
+            kept.sort(key=lambda r: (r[4], r[7]))
+            self.append(fork, sorted(advanced), kept)
+
+    def close(self):
+        if self._file is not None:
+            self._file[1].close()
+            self._file = None
+
+    def _open(self, seg):
+        if self._file is None or self._file[0] != seg:
+            self.close()
+            self._file = (seg, open(self._path(seg), "ab"))
+        return self._file[1]
+
+    def _repair(self):
+        # недописанный при сбое кадр может быть только в хвосте последнего записанного сегмента
+        segs = [self._path(s) for s in self.segments()]
+        if not segs:
+            return
+        path = max(segs, key=os.path.getmtime)
+        with open(path, "rb") as f:
+            data = f.read()
+        end = 0
+        for offset, *_, size, _ in _frames(data):
+            end = offset + _HEADER.size + size
+        if end < len(data):
+            print(f"[archive] {os.path.basename(path)}: недописанный кадр в конце, обрезаю {len(data) - end} байт")
+            with open(path, "r+b") as f:
+                f.truncate(end)
+
+    def segments(self):
+        return sorted(int(name[:-4]) for name in os.listdir(self.path) if name.endswith(".seg"))
+
+    def _path(self, seg):
+        return os.path.join(self.path, f"{seg:012d}.seg")
+
+    def read(self, to_block=None):
+        # -> (блок, [токены со сдвинутым курсором], {токен: [перевод, ...]}) по возрастанию блока
+        # кадра; с to_block — только переводы до него, а курсоры дальше него — на to_block
+        for seg in self.segments():
+            with open(self._path(seg), "rb") as f:
+                data = f.read()
+            for offset, codec, ntok, n, first, block, size, raw_size in sorted(_frames(data), key=lambda fr: fr[5]):
+                if to_block is not None and first > to_block:
+                    continue
+                body = data[offset + _HEADER.size:offset + _HEADER.size + size]
+                _, advanced, by_token = decode(_decompress(body, codec, raw_size), ntok, n)
+                if to_block is not None and block > to_block:
+                    block = to_block
+                    by_token = {a: [t for t in ts if t[3] <= to_block] for a, ts in by_token.items()}
+                yield block, advanced, by_token
+
+    def info(self):
+        frames = records = size = raw = 0
+        first = last = None
+        for seg in self.segments():
+            with open(self._path(seg), "rb") as f:
+                data = f.read()
+            for _, _, _, n, lo, block, sz, raw_size in _frames(data):
+                frames += 1
+                records += n
+                size += _HEADER.size + sz
+                raw += raw_size
+                first = lo if first is None else min(first, lo)
+                last = block if last is None else max(last, block)
+        return {"segments": len(self.segments()), "frames": frames, "transfers": records, "first_block": first,
+                "last_block": last, "bytes": size, "raw_bytes": raw, "tokens": self.tokens()}
+
+
+def _frames(data):
+    # заголовки кадров сегмента: (смещение, кодек, токенов, записей, первый блок, блок, длина, длина
+    # исходного); на битом или недописанном кадре сегмент для чтения кончается
+    offset = 0
+    while offset + _HEADER.size <= len(data):
+        magic, codec, ntok, n, first, block, size, raw_size, crc = _HEADER.unpack_from(data, offset)
+        body = data[offset + _HEADER.size:offset + _HEADER.size + size]
+        if magic != MAGIC or len(body) < size or zlib.crc32(body) != crc:
+            return
+        yield offset, codec, ntok, n, first, block, size, raw_size
+        offset += _HEADER.size + size
+
+
+def rebuild(archive, db_path, storage_url=None, to_block=None, batch=REBUILD_BATCH):
+    # новая БД из архива: в ней нет хэшей блоков, поэтому по умолчанию — до конца архива минус
+    # REORG_DEPTH, последние блоки индексатор перечитает с узла уже с журналом отката
+    if os.path.exists(db_path):
+        raise RuntimeError(f"{db_path} уже существует: rebuild пишет в новую БД")
+    tokens = archive.tokens()
+    if not tokens:
+        raise RuntimeError(f"{archive.path}: нет tokens.json — архив пуст")
+    if to_block is None:
+        last = archive.info()["last_block"]
+        if last is None:
+            raise RuntimeError(f"{archive.path}: в архиве нет кадров")
+        to_block = max(0, last - REORG_DEPTH)
+    main = TOKEN_ADDRESS if TOKEN_ADDRESS in tokens else next(iter(tokens))
+    client = TokenClient(RPC_URLS, main, ERC20_ABI, decimals=tokens[main]["decimals"], symbol=tokens[main]["symbol"])
+    idx = TokenIndexer(client, db_path, tokens=list(tokens), storage_url=storage_url,
+                       known_tokens={a: (t["decimals"], t["symbol"]) for a, t in tokens.items()})
+    try:
+        return idx.replay_archive(archive, to_block, batch)
+    finally:
+        idx.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Архив Transfer-логов")
+    ap.add_argument("command", choices=["info", "rebuild"])
+    ap.add_argument("--archive", default=ARCHIVE_DIR, help="каталог архива; по умолчанию ARCHIVE_DIR")
+    ap.add_argument("--db", help="rebuild: новая БД")
+    ap.add_argument("--storage", default=STORAGE_URL, help="rebuild: postgresql://… — holders в PostgreSQL")
+    ap.add_argument("--to-block", type=int, help="rebuild: последний блок; по умолчанию конец архива - REORG_DEPTH")
+    ap.add_argument("--batch", type=int, default=REBUILD_BATCH, help="rebuild: переводов на одно применение")
+    args = ap.parse_args()
+    if not args.archive:
+        sys.exit("укажи --archive или ARCHIVE_DIR")
+    if not os.path.isdir(args.archive):
+        sys.exit(f"{args.archive}: нет такого каталога")
+
+    archive = LogArchive(args.archive)
+    if args.command == "info":
+        print(json.dumps(archive.info(), indent=1, ensure_ascii=False))
+        return
+    if not args.db:
+        sys.exit("rebuild: укажи --db")
+    t0 = time.perf_counter()
+    total, last = rebuild(archive, args.db, args.storage, args.to_block, args.batch)
+    dt = time.perf_counter() - t0
+    print(f"[rebuild] {args.db}: transfers={total} last_block={last} за {dt:.1f}s ({total / max(dt, 1e-9):.0f}/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# Скорость применения Transfer-ов к SQLite: старый путь (по событию) vs пакетный.
+#   python bench/bench_apply.py --n 1000000
+import argparse
+import os
+import tempfile
+import time
+
+from common import offline_client, pages, synthetic_transfers
+
+from web3 import Web3
+
+from config import ZERO
+from ps_client import TokenIndexer
+
+
+def legacy_schema(conn):
+    # таблицы прежней схемы: events (её сменила transfers) и holders без token_id, балансы TEXT
+    conn.execute("CREATE TABLE IF NOT EXISTS events (event_id TEXT PRIMARY KEY, block_number INTEGER, "
+                 "tx_hash TEXT, log_index INTEGER, ts INTEGER)")
+    conn.execute("DROP TABLE holders")
+    conn.execute("CREATE TABLE holders (address TEXT PRIMARY KEY, balance TEXT NOT NULL, "
+                 "last_tx_block INTEGER, last_tx_ts INTEGER)")
+
+
+def legacy_apply(conn, from_addr, to_addr, value_raw, block_number, ts, tx_hash, log_index):
+    # Копия прежнего TokenIndexer._apply_transfer — точка отсчёта.
+    ev_id = f"{tx_hash}:{log_index}"
+    cur = conn.cursor()
+    if cur.execute("SELECT 1 FROM events WHERE event_id=?", (ev_id,)).fetchone():
+        return
+
+    def add(addr, delta):
+        if addr.lower() == ZERO.lower():
+            return
+        row = cur.execute("SELECT balance FROM holders WHERE address=?", (addr,)).fetchone()
+        new = max(0, (int(row[0]) if row else 0) + delta)
+        if row:
+            cur.execute(
+                "UPDATE holders SET balance=?, last_tx_block=?, last_tx_ts=? WHERE address=?",
+                (str(new), block_number, ts, addr)
+            )
+        else:
+            cur.execute(
+                "INSERT INTO holders(address, balance, last_tx_block, last_tx_ts) VALUES (?, ?, ?, ?)",
+                (addr, str(new), block_number, ts)
+            )
+
+    add(Web3.to_checksum_address(from_addr), -int(value_raw))
+    add(Web3.to_checksum_address(to_addr), int(value_raw))
+    cur.execute(
+        "INSERT INTO events(event_id, block_number, tx_hash, log_index, ts) VALUES (?, ?, ?, ?, ?)",
+        (ev_id, block_number, tx_hash, log_index, ts)
+    )
+
+
+def run(name, transfers, page_size, apply_page, setup=None):
+    with tempfile.TemporaryDirectory() as d:
+        idx = TokenIndexer(offline_client(), os.path.join(d, "bench.db"))
+        if setup is not None:
+            setup(idx.conn)
+        t0 = time.perf_counter()
+        for page in pages(transfers, page_size):
+            apply_page(idx, page)
+            idx.conn.commit()
+        dt = time.perf_counter() - t0
+        holders = idx.conn.execute("SELECT COUNT(*) FROM holders").fetchone()[0]
+        idx.close()
+    print(f"{name:8s} {len(transfers):>9d} events  {dt:8.2f}s  {len(transfers) / dt:>10.0f} events/s  holders={holders}")
+    return dt
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=1_000_000)
+    ap.add_argument("--holders", type=int, default=50_000)
+    ap.add_argument("--page", type=int, default=2000)
+    ap.add_argument("--skip-legacy", action="store_true")
+    args = ap.parse_args()
+
+    transfers = synthetic_transfers(args.n, holders=args.holders)
+
+    before = None
+    if not args.skip_legacy:
+        before = run("legacy", transfers, args.page,
+                     lambda idx, page: [legacy_apply(idx.conn, *t) for t in page], legacy_schema)
+    after = run("batch", transfers, args.page, lambda idx, page: idx._apply_transfers(page))
+    if before:
+        print(f"speedup x{before / after:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# Локальный архив Transfer-логов: запись и чтение (zstd против zlib, байт на перевод), rebuild
+# новой БД из архива (переводов/с и прикидка на --target переводов), сверка holders с балансами,
+# посчитанными напрямую. Затем индексатор с архивом проходит окна, голову с журналом и откат
+# реорга — rebuild по его архиву должен совпасть с его БД.
+#   python bench/bench_archive.py --n 1000000 [--target 50000000]
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from common import offline_client, pages, synthetic_transfers
+
+import archive
+from archive import LogArchive, rebuild
+from config import REBUILD_BATCH, TOKEN_ADDRESS, ZERO
+from ps_client import TokenIndexer
+
+
+def write(path, codec, events, window):
+    arc = LogArchive(path, codec)
+    arc.set_tokens({TOKEN_ADDRESS: (18, "TKN")})
+    t0 = time.perf_counter()
+    for page in pages(events, window):
+        arc.append(page[-1][3], [TOKEN_ADDRESS], [(TOKEN_ADDRESS, *t) for t in page])
+    arc.close()
+    dt = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    n = sum(len(ts) for _, _, by_token in arc.read() for ts in by_token.values())
+    rt = time.perf_counter() - t0
+    assert n == len(events)
+    info = arc.info()
+    print(f"{'zstd' if codec == archive.ZSTD else 'zlib':5s} запись {len(events) / dt:>9.0f}/s  чтение {n / rt:>9.0f}/s  "
+          f"{info['bytes'] / n:5.1f} байт/перевод (без сжатия {info['raw_bytes'] / n:.1f})")
+    return arc
+
+
+def balances(events):
+    bal = {}
+    for frm, to, val, *_ in events:
+        if frm != ZERO:
+            bal[frm] -= val
+        bal[to] = bal.get(to, 0) + val
+    return sorted((a, b) for a, b in bal.items() if b > 0)
+
+
+def dump(idx):
+    holders = sorted(idx._top_rows(10 ** 9, idx.token_id))
+    transfers = idx.conn.execute(
+        "SELECT t.block_number, t.log_index, t.tx_hash, f.address, o.address, t.value FROM transfers t "
+        "JOIN addresses f ON f.id = t.from_id JOIN addresses o ON o.id = t.to_id ORDER BY 1, 2").fetchall()
+    history = idx.conn.execute("SELECT * FROM balance_history ORDER BY 1, 2, 3").fetchall()
+    return holders, transfers, history, idx.storage.holder_stats(idx.token_id), idx._get_last_block()
+
+
+def replay_check(d, n, window, tip, segment=40):
+    # окна, затем голова поблочно с журналом, откат половины головы и другая ветка поверх
+    events = synthetic_transfers(n, holders=max(100, n // 10), seed=5)
+    arc = LogArchive(os.path.join(d, "live"), segment=segment)  # мелкие сегменты: откат идёт через границы
+    idx = TokenIndexer(offline_client(), os.path.join(d, "live.db"), archive=arc)
+    deep, tail = events[:-tip], events[-tip:]
+    for page in pages(deep, window):
+        idx._apply_transfers(page)
+        idx._set_last_block(page[-1][3])
+    blocks = {}
+    for t in tail:
+        blocks.setdefault(t[3], []).append(t)
+    for b, page in blocks.items():
+        idx._apply_transfers(page, journal_block=b)
+        idx._set_last_block(b)
+    fork = list(blocks)[len(blocks) // 2]
+    with idx.write_lock:
+        idx._rollback(fork)
+    rnd = random.Random(7)
+    for b in [b for b in blocks if b > fork]:
+        page = [(f, t, rnd.randrange(1, 10 ** 18), blk, ts, "0x%064x" % rnd.getrandbits(256), li)
+                for f, t, _, blk, ts, _, li in blocks[b]]
+        idx._apply_transfers(page, journal_block=b)
+        idx._set_last_block(b)
+    want = dump(idx)
+    idx.close()
+    arc.close()
+
+    rebuild(LogArchive(os.path.join(d, "live"), segment=segment), os.path.join(d, "replayed.db"), to_block=want[-1])
+    idx = TokenIndexer(offline_client(), os.path.join(d, "replayed.db"))
+    got = dump(idx)
+    idx.close()
+    for name, a, b in zip(("holders", "transfers", "balance_history", "holder_stats", "last_block"), got, want):
+        assert a == b, f"rebuild разошёлся с индексом: {name}"
+    print(f"индекс с архивом ({n} переводов, откат к {fork}) и rebuild по архиву совпали: "
+          f"holders, transfers, история, статистика")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=1_000_000)
+    ap.add_argument("--holders", type=int, default=100_000)
+    ap.add_argument("--window", type=int, default=2000, help="переводов в одном кадре (окне индекса)")
+    ap.add_argument("--batch", type=int, default=REBUILD_BATCH)
+    ap.add_argument("--target", type=int, default=50_000_000, help="прикидка времени rebuild на столько переводов")
+    ap.add_argument("--check", type=int, default=50_000, help="переводов в сверке индекса с rebuild, 0 — без неё")
+    args = ap.parse_args()
+
+    events = synthetic_transfers(args.n, holders=args.holders)
+    with tempfile.TemporaryDirectory() as d:
+        codecs = [archive.ZLIB] + ([archive.ZSTD] if archive.zstandard is not None else [])
+        for codec in codecs:
+            arc = write(os.path.join(d, f"arc{codec}"), codec, events, args.window)
+
+        t0 = time.perf_counter()
+        total, last = rebuild(arc, os.path.join(d, "rebuilt.db"), to_block=events[-1][3], batch=args.batch)
+        dt = time.perf_counter() - t0
+        idx = TokenIndexer(offline_client(), os.path.join(d, "rebuilt.db"))
+        assert total == args.n and last == events[-1][3]
+        assert sorted(idx._top_rows(10 ** 9, idx.token_id)) == balances(events), "holders после rebuild разошлись"
+        idx.close()
+        print(f"rebuild {total} переводов за {dt:.1f}s: {total / dt:.0f}/s, "
+              f"{args.target / 1e6:g}M — ~{args.target / (total / dt) / 60:.0f} мин; holders совпали с балансами")
+
+        if args.check:
+            replay_check(d, args.check, args.window, tip=2000)
+
+
+if __name__ == "__main__":
+    main()
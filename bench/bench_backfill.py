@@ -0,0 +1,55 @@
+# Последовательный index_transfers vs шардированный backfill против локального mock RPC.
+#   python bench/bench_backfill.py --blocks 50000 --latency 50 --workers 8
+import argparse
+import os
+import tempfile
+import time
+
+from common import offline_client  # noqa: F401  (sys.path)
+from mock_rpc import spawn
+
+from config import ERC20_ABI, TOKEN_ADDRESS
+from ps_client import TokenIndexer
+from token_client import TokenClient
+
+
+def run(name, url, fn):
+    with tempfile.TemporaryDirectory() as d:
+        idx = TokenIndexer(TokenClient(url, TOKEN_ADDRESS, ERC20_ABI), os.path.join(d, "bench.db"))
+        t0 = time.perf_counter()
+        fn(idx)
+        dt = time.perf_counter() - t0
+        events = idx.conn.execute("SELECT COUNT(*) FROM transfers").fetchone()[0]
+        idx.close()
+    print(f"{name:10s} {dt:8.2f}s  events={events}  {events / dt:>9.0f} events/s")
+    return dt, events
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--blocks", type=int, default=50_000)
+    ap.add_argument("--latency", type=float, default=50, help="мс на запрос к mock RPC")
+    ap.add_argument("--max-range", type=int, default=1000, help="лимит диапазона eth_getLogs у узла")
+    ap.add_argument("--per-block", type=int, default=2, help="макс. Transfer-ов в блоке")
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--shard", type=int, default=2000)
+    ap.add_argument("--batch", type=int, default=2000)
+    args = ap.parse_args()
+
+    start, head = 1_000_000, 1_000_000 + args.blocks - 1
+    proc, url = spawn(head, args.latency, args.max_range, args.per_block)
+    print(f"mock rpc {url}: blocks={args.blocks} latency={args.latency}ms max_range={args.max_range}")
+    try:
+        serial, ev1 = run("serial", url, lambda idx: idx.index_transfers(
+            start_block=start, batch_size=args.batch, confirmations=0))
+        sharded, ev2 = run("backfill", url, lambda idx: idx.backfill(
+            start_block=start, shard_size=args.shard, workers=args.workers,
+            batch_size=args.batch, confirmations=0))
+    finally:
+        proc.terminate()
+    assert ev1 == ev2, (ev1, ev2)
+    print(f"speedup x{serial / sharded:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# Прежний последовательный bootstrap (страница → запись в SQLite → sleep) против конвейерного
+# first_from_polygonscan на локальном fake Etherscan, воспроизводящем записанные страницы.
+#   python bench/bench_bootstrap.py --blocks 50000 --latency 150 --rate 5
+#   python bench/bench_bootstrap.py --recording rows.json   (записать: fake_etherscan.py --record)
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import requests
+
+from common import offline_client  # noqa: F401  (sys.path)
+from fake_etherscan import spawn as spawn_etherscan, synthetic_rows
+from mock_rpc import Chain, spawn as spawn_rpc
+
+from config import CONFIRMATIONS, ERC20_ABI, TOKEN_ADDRESS
+from ps_client import TokenIndexer, _etherscan_transfer
+from token_client import TokenClient
+
+
+def legacy_bootstrap(idx, base_url, start_block, sleep_s=0.25, offset=2000):
+    # Цикл до конвейера: запросы строго по одному, запись между ними, фиксированный sleep.
+    safe_head = max(0, idx.w3.eth.block_number - CONFIRMATIONS)
+    sess = requests.Session()
+    cur_start = start_block
+    while cur_start <= safe_head:
+        page, last_blk = 1, cur_start
+        while page <= 5:
+            payload = sess.get(base_url, params={
+                "module": "account", "action": "tokentx", "contractaddress": idx.token_addr,
+                "startblock": cur_start, "endblock": safe_head, "sort": "asc",
+                "page": page, "offset": offset, "apikey": "bench", "chainid": 137,
+            }, timeout=30).json()
+            rows = payload["result"] if isinstance(payload["result"], list) else []
+            if not rows:
+                break
+            transfers = [t for t in map(_etherscan_transfer, rows) if t is not None]
+            last_blk = max([last_blk] + [t[3] for t in transfers])
+            idx._store_block_times({t[3]: t[4] for t in transfers})
+            idx._apply_transfers(transfers)
+            idx.conn.commit()
+            if len(rows) < offset:
+                break
+            page += 1
+            time.sleep(sleep_s)
+        cur_start = last_blk + 1 if last_blk >= cur_start else cur_start + 1
+    idx._set_last_block(safe_head)
+
+
+def run(name, rpc_url, fn):
+    with tempfile.TemporaryDirectory() as d:
+        idx = TokenIndexer(TokenClient(rpc_url, TOKEN_ADDRESS, ERC20_ABI), os.path.join(d, "bench.db"))
+        t0 = time.perf_counter()
+        fn(idx)
+        dt = time.perf_counter() - t0
+        events = idx.conn.execute("SELECT COUNT(*) FROM transfers").fetchone()[0]
+        idx.close()
+    print(f"{name:10s} {dt:8.2f}s  events={events}  {events / dt:>9.0f} events/s")
+    return dt, events
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--blocks", type=int, default=50_000)
+    ap.add_argument("--recording", help="JSON-список строк tokentx; иначе синтетика")
+    ap.add_argument("--latency", type=float, default=150, help="мс на запрос к fake Etherscan")
+    ap.add_argument("--rate", type=float, default=5, help="лимит fake Etherscan, запросов/сек")
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--span", type=int, default=5_000)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as d:
+        recording = args.recording
+        if recording is None:
+            start, end = 1_000_000, 1_000_000 + args.blocks - 1
+            recording = os.path.join(d, "rows.json")
+            with open(recording, "w") as f:
+                json.dump(synthetic_rows(Chain(TOKEN_ADDRESS, end), start, end), f)
+        with open(recording) as f:
+            rows = json.load(f)
+        start = min(int(r["blockNumber"]) for r in rows)
+        end = max(int(r["blockNumber"]) for r in rows)
+
+        rpc, rpc_url = spawn_rpc(end + CONFIRMATIONS)
+        es, es_url = spawn_etherscan(recording, args.latency, args.rate)
+        print(f"fake etherscan {es_url}: rows={len(rows)} blocks={start}..{end} "
+              f"latency={args.latency}ms rate={args.rate:g}/s")
+        try:
+            serial, ev1 = run("serial", rpc_url, lambda idx: legacy_bootstrap(idx, es_url, start))
+            time.sleep(1)  # пусть лимит fake Etherscan восстановится
+            piped, ev2 = run("pipelined", rpc_url, lambda idx: idx.first_from_polygonscan(
+                "bench", start_block=start, rate=args.rate, workers=args.workers,
+                span=args.span, base_url=es_url))
+        finally:
+            rpc.terminate()
+            es.terminate()
+    # прежний цикл продолжал заполненное окно с last_blk + 1 и терял хвост блока на границе
+    print(f"speedup x{serial / piped:.1f}; потеряно прежним циклом: {len(rows) - ev1}")
+    assert ev2 == len(rows), (ev2, len(rows))
+
+
+if __name__ == "__main__":
+    main()
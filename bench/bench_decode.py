@@ -0,0 +1,67 @@
+# Декодирование Transfer-логов: прежний путь (форматтер web3 + process_log + to_checksum_address
+# + to_hex) против _raw_transfer по сырому JSON eth_getLogs.
+#   python bench/bench_decode.py --n 200000
+import argparse
+import time
+
+from common import offline_client
+from mock_rpc import Chain
+
+from web3 import Web3
+from web3._utils.method_formatters import log_entry_formatter
+
+from config import TOKEN_ADDRESS
+from ps_client import _raw_transfer
+
+
+def raw_logs(n, holders):
+    chain = Chain(TOKEN_ADDRESS, head=10 ** 9, holders=holders)
+    out, b = [], 1
+    while len(out) < n:
+        out.extend(chain.logs(b, b + 999))
+        b += 1000
+    return out[:n]
+
+
+def legacy(logs, event):
+    out = []
+    for raw in logs:
+        lg = log_entry_formatter(raw)  # то, что раньше возвращал w3.eth.get_logs
+        ev = event.process_log(lg)
+        out.append((
+            Web3.to_checksum_address(ev["args"]["from"]),
+            Web3.to_checksum_address(ev["args"]["to"]),
+            int(ev["args"]["value"]),
+            int(lg["blockNumber"]),
+            0,
+            Web3.to_hex(lg["transactionHash"]),
+            int(lg["logIndex"]),
+        ))
+    return out
+
+
+def fast(logs):
+    return [_raw_transfer(lg, 0) for lg in logs]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=200_000)
+    ap.add_argument("--holders", type=int, default=50_000)
+    args = ap.parse_args()
+
+    logs = raw_logs(args.n, args.holders)
+    event = offline_client().contract.events.Transfer()
+    results, times = {}, {}
+    for name, fn in (("legacy", lambda: legacy(logs, event)), ("raw", lambda: fast(logs))):
+        t0 = time.perf_counter()
+        results[name] = fn()
+        dt = times[name] = time.perf_counter() - t0
+        print(f"{name:7s} {len(logs)} логов  {dt:7.2f}s  {len(logs) / dt:>10.0f} логов/s")
+    a, b = results["legacy"], results["raw"]
+    assert [(x[0].lower(), x[1].lower(), *x[2:]) for x in a] == b
+    print(f"speedup x{times['legacy'] / times['raw']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
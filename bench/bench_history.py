@@ -0,0 +1,70 @@
+# Запросы на прошлый блок: get_top(n, at_block) и get_balances(at_block) по снимкам и
+# balance_history. Индекс строится backfill-ом по mock RPC, затем — случайные блоки из
+# проиндексированного диапазона; в конце сверка at_block=last с текущим состоянием.
+#   python bench/bench_history.py --blocks 100000 --snapshot 10000
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from common import offline_client  # noqa: F401  (sys.path)
+from mock_rpc import spawn
+
+import ps_client
+from config import ERC20_ABI, SNAPSHOT_INTERVAL, TOKEN_ADDRESS
+from ps_client import TokenIndexer
+from token_client import TokenClient
+
+
+def timed(fn, runs):
+    lat = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        lat.append((time.perf_counter() - t0) * 1000)
+    lat.sort()
+    return lat[len(lat) // 2], lat[min(len(lat) - 1, int(0.99 * len(lat)))]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--blocks", type=int, default=100_000)
+    ap.add_argument("--per-block", type=int, default=4, help="макс. Transfer-ов в блоке")
+    ap.add_argument("--snapshot", type=int, default=SNAPSHOT_INTERVAL, help="SNAPSHOT_INTERVAL, блоков")
+    ap.add_argument("--n", type=int, default=100, help="размер топа")
+    ap.add_argument("--addresses", type=int, default=100, help="адресов в запросе балансов")
+    ap.add_argument("--runs", type=int, default=200)
+    args = ap.parse_args()
+    ps_client.SNAPSHOT_INTERVAL = args.snapshot
+
+    start, end = 1_000_000, 1_000_000 + args.blocks - 1
+    proc, url = spawn(end, 0, 2000, args.per_block)
+    try:
+        with tempfile.TemporaryDirectory() as d:
+            idx = TokenIndexer(TokenClient(url, TOKEN_ADDRESS, ERC20_ABI), os.path.join(d, "bench.db"))
+            t0 = time.perf_counter()
+            idx.backfill(start_block=start, end_block=end, shard_size=args.snapshot // 10 or 5000, workers=4)
+            build = time.perf_counter() - t0
+            q = lambda s: idx.conn.execute(s).fetchone()[0]
+            print(f"индекс {build:.1f}s: events={q('SELECT COUNT(*) FROM transfers')} "
+                  f"history={q('SELECT COUNT(*) FROM balance_history')} snapshots={q('SELECT COUNT(*) FROM snapshots')}")
+
+            rnd = random.Random(1)
+            holders = [a for (a,) in idx.conn.execute("SELECT address FROM holders")]
+            top = timed(lambda: idx.get_top(args.n, at_block=rnd.randint(start, end)), args.runs)
+            bal = timed(lambda: idx.get_balances(rnd.sample(holders, args.addresses),
+                                                 at_block=rnd.randint(start, end)), args.runs)
+            print(f"get_top({args.n}, at_block)        p50 {top[0]:7.1f} ms  p99 {top[1]:7.1f} ms")
+            print(f"get_balances({args.addresses}, at_block) p50 {bal[0]:7.1f} ms  p99 {bal[1]:7.1f} ms")
+
+            sample = rnd.sample(holders, args.addresses)
+            assert idx.get_top(args.n, at_block=end) == idx.get_top(args.n)
+            assert idx.get_balances(sample, at_block=end) == idx.get_balances(sample)
+            idx.close()
+    finally:
+        proc.terminate()
+
+
+if __name__ == "__main__":
+    main()
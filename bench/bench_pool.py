@@ -0,0 +1,114 @@
+# Пул RPC-узлов против одного узла на локальных mock-узлах с медленным хвостом, 503 и
+# отстающей головой: латентность баланса (p50/p99), ошибки, дубли и повторы; затем индекс
+# через пул сверяется с индексом по одному здоровому узлу.
+#   python bench/bench_pool.py --calls 1000 --slow-rate 0.02 --slow 300
+import argparse
+import os
+import tempfile
+import time
+
+from common import synthetic_addresses
+from mock_rpc import spawn
+
+import metrics
+from config import ERC20_ABI, TOKEN_ADDRESS
+from ps_client import TokenIndexer
+from token_client import TokenClient
+
+
+def counter(m, **labels):
+    return sum(v for k, v in m._values.items() if all(dict(zip(m.labels, k)).get(a) == str(b)
+                                                      for a, b in labels.items()))
+
+
+def pct(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(p * len(xs)))]
+
+
+def balances(name, urls, addrs):
+    cli = TokenClient(urls, TOKEN_ADDRESS, ERC20_ABI, decimals=18, symbol="TKN")
+    hedged, won, failovers = (counter(metrics.RPC_HEDGES, result="fired"), counter(metrics.RPC_HEDGES, result="won"),
+                              counter(metrics.RPC_FAILOVERS))
+    lat, errors = [], 0
+    for a in addrs:
+        t0 = time.perf_counter()
+        try:
+            cli.get_balance(a, False)
+        except Exception:
+            errors += 1
+        lat.append(time.perf_counter() - t0)
+    hedged = counter(metrics.RPC_HEDGES, result="fired") - hedged
+    won = counter(metrics.RPC_HEDGES, result="won") - won
+    failovers = counter(metrics.RPC_FAILOVERS) - failovers
+    print(f"{name:22s} p50 {pct(lat, 0.5) * 1000:7.1f}ms  p99 {pct(lat, 0.99) * 1000:7.1f}ms  "
+          f"max {max(lat) * 1000:7.1f}ms  errors={errors}  hedged={hedged} won={won}  failovers={failovers}")
+    return pct(lat, 0.99), errors
+
+
+def index(name, urls, start, head, batch):
+    with tempfile.TemporaryDirectory() as d:
+        idx = TokenIndexer(TokenClient(urls, TOKEN_ADDRESS, ERC20_ABI), os.path.join(d, "bench.db"))
+        t0 = time.perf_counter()
+        idx.index_transfers(start_block=start, batch_size=batch, confirmations=0)
+        for _ in range(10):
+            # первой голову могла назвать отстающая нода — догоняем до головы цепочки
+            if idx._get_last_block() >= head:
+                break
+            idx.index_transfers(batch_size=batch, confirmations=0)
+        dt = time.perf_counter() - t0
+        rows = sorted(idx._top_rows(10 ** 9, idx.token_id))
+        last = idx._get_last_block()
+        idx.close()
+    print(f"{name:22s} {dt:7.2f}s  holders={len(rows)}  last={last}")
+    return rows, last
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--calls", type=int, default=1000)
+    ap.add_argument("--latency", type=float, default=5, help="мс на запрос к каждому узлу")
+    ap.add_argument("--slow-rate", type=float, default=0.02, help="доля медленных ответов")
+    ap.add_argument("--slow", type=float, default=300, help="мс медленного ответа")
+    ap.add_argument("--http-fail-rate", type=float, default=0.3, help="доля 503 у сбойного узла")
+    ap.add_argument("--lag", type=int, default=200, help="на сколько блоков отстаёт голова отстающего узла")
+    ap.add_argument("--blocks", type=int, default=2000)
+    ap.add_argument("--batch", type=int, default=1000)
+    args = ap.parse_args()
+
+    start, head = 1_000_000, 1_000_000 + args.blocks - 1
+    nodes = {
+        "slow1": dict(slow_rate=args.slow_rate, slow_ms=args.slow),
+        "slow2": dict(slow_rate=args.slow_rate, slow_ms=args.slow),
+        "slow3": dict(slow_rate=args.slow_rate, slow_ms=args.slow),
+        "flaky": dict(http_fail_rate=args.http_fail_rate),
+        "lagging": dict(lag=args.lag),
+        "healthy": {},
+    }
+    procs, urls = [], {}
+    try:
+        for name, kw in nodes.items():
+            proc, urls[name] = spawn(head, args.latency, per_block=2, **kw)
+            procs.append(proc)
+        print(f"mock rpc x{len(nodes)}: blocks={args.blocks} latency={args.latency}ms "
+              f"slow={args.slow_rate:.0%}x{args.slow:.0f}ms 503={args.http_fail_rate:.0%} lag={args.lag}")
+
+        addrs = synthetic_addresses(args.calls * 4)
+        p99_one, _ = balances("один узел (хвост)", [urls["slow1"]], addrs[:args.calls])
+        p99_pool, _ = balances("пул 3 узла (хвост)", [urls["slow1"], urls["slow2"], urls["slow3"]],
+                               addrs[args.calls:2 * args.calls])
+        _, err_one = balances("один узел (503)", [urls["flaky"]], addrs[2 * args.calls:3 * args.calls])
+        _, err_pool = balances("пул (503 + здоровый)", [urls["flaky"], urls["healthy"]], addrs[3 * args.calls:])
+        print(f"p99 x{p99_one / p99_pool:.1f} лучше, ошибок {err_one} → {err_pool}")
+
+        ref = index("индекс: один узел", [urls["healthy"]], start, head, args.batch)
+        got = index("индекс: пул", [urls["lagging"], urls["flaky"], urls["slow1"]], start, head, args.batch)
+        assert got == ref, "индекс через пул разошёлся с индексом по одному узлу"
+        print("индекс через пул совпал с индексом по одному узлу")
+    finally:
+        for proc in procs:
+            proc.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# holder_stats: сверка инкрементально веденной статистики с полным пересчётом по holders
+# (после пачек, поблочных применений с журналом и отката реорга), цена ведения на записи и
+# время ответа holder_stats() против прохода по holders.
+#   python bench/bench_stats.py --n 500000 [--pg postgresql://…]
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from common import offline_client, pages, synthetic_addresses
+
+from config import ZERO
+from ps_client import TokenIndexer
+from storage import stats_delta
+
+
+def transfers(n, holders, per_block=20, seed=3):
+    # минты на много порядков, дальше переводы случайной доли баланса, часть — целиком (адрес
+    # выпадает из держателей)
+    rnd = random.Random(seed)
+    addrs = synthetic_addresses(holders, seed)
+    bal = {}
+    out = []
+    for i in range(n):
+        blk = 1 + i // per_block
+        if i < holders:
+            frm, to, val = ZERO, addrs[i], rnd.randrange(1, 10 ** rnd.randint(1, 30))
+        else:
+            frm, to = rnd.choice(addrs), rnd.choice(addrs)
+            have = bal.get(frm, 0)
+            val = have if rnd.random() < 0.1 else rnd.randint(0, have)
+        if frm != ZERO:
+            bal[frm] -= val
+        bal[to] = bal.get(to, 0) + val
+        out.append((frm, to, val, blk, 1_700_000_000 + blk * 2, "0x%064x" % i, i % per_block))
+    return out
+
+
+def recomputed(idx):
+    return {k: tuple(v) for k, v in stats_delta((0, b) for _, b in idx.storage.nonzero_balances(idx.token_id)).items()}
+
+
+def check(idx, where):
+    got = idx.storage.holder_stats(idx.token_id)
+    want = recomputed(idx)
+    assert got == want, f"{where}: holder_stats разошлась с пересчётом"
+    return sum(n for n, _ in got.values())
+
+
+def run(name, path, storage_url, events, page_size, tip, keep_stats=True):
+    idx = TokenIndexer(offline_client(), path, storage_url=storage_url)
+    if not keep_stats:
+        idx.storage.update_holder_stats = lambda token_id, changes: None
+    deep, tail = events[:-tip], events[-tip:]
+    t0 = time.perf_counter()
+    for page in pages(deep, page_size):
+        idx._apply_transfers(page)
+        idx._set_last_block(page[-1][3])
+    dt = time.perf_counter() - t0
+    if not keep_stats:
+        print(f"{name:16s} {len(deep):>9d} events  {len(deep) / dt:>9.0f} events/s")
+        idx.close()
+        return
+    holders = check(idx, "после пачек")
+
+    # у головы: поблочно с журналом, затем откат половины блоков
+    blocks = {}
+    for t in tail:
+        blocks.setdefault(t[3], []).append(t)
+    for b, page in blocks.items():
+        idx._apply_transfers(page, journal_block=b)
+        idx._set_last_block(b)
+    check(idx, "после поблочных")
+    fork = list(blocks)[len(blocks) // 2]
+    with idx.write_lock:
+        idx._rollback(fork)
+    check(idx, f"после отката к {fork}")
+
+    repeat = 200
+    t1 = time.perf_counter()
+    for _ in range(repeat):
+        stats = idx.holder_stats(top=(10, 100))
+    fast = (time.perf_counter() - t1) / repeat * 1000
+    t1 = time.perf_counter()
+    balances = sorted((b for _, b in idx.storage.nonzero_balances(idx.token_id)), reverse=True)
+    stats_delta((0, b) for b in balances)
+    top = sum(balances[:100])
+    slow = (time.perf_counter() - t1) * 1000
+    print(f"{name:16s} {len(deep):>9d} events  {len(deep) / dt:>9.0f} events/s  holders={holders}  "
+          f"holder_stats {fast:6.2f} ms   полный проход {slow:8.1f} ms  (x{slow / fast:.0f})  "
+          f"top100={stats['concentration']['top100']:.4f} ({top / sum(balances):.4f})")
+    idx.close()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=500_000)
+    ap.add_argument("--holders", type=int, default=100_000)
+    ap.add_argument("--page", type=int, default=2000)
+    ap.add_argument("--tip", type=int, default=2000, help="переводов в конце, применяемых поблочно с журналом")
+    ap.add_argument("--pg", default=os.getenv("STORAGE_URL"), help="postgresql://… — то же на PostgreSQL")
+    args = ap.parse_args()
+
+    events = transfers(args.n, args.holders)
+    with tempfile.TemporaryDirectory() as d:
+        run("sqlite без stats", os.path.join(d, "base.db"), None, events, args.page, args.tip, keep_stats=False)
+        run("sqlite", os.path.join(d, "sqlite.db"), None, events, args.page, args.tip)
+        if args.pg:
+            run("postgres", os.path.join(d, "pg.db"), args.pg, events, args.page, args.tip)
+    print("holder_stats совпала с полным пересчётом")
+
+
+if __name__ == "__main__":
+    main()
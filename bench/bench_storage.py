@@ -0,0 +1,52 @@
+# Хранилище состояния: SQLite индекса против PostgreSQL (STORAGE_URL). Те же пачки
+# Transfer-ов через _apply_transfers, затем латентность get_top и сверка топа.
+#   python bench/bench_storage.py --n 500000 --pg postgresql://localhost/bench
+# Без --pg берётся переменная STORAGE_URL; база должна быть пустой.
+import argparse
+import os
+import tempfile
+import time
+
+from common import offline_client, pages, synthetic_transfers
+
+from ps_client import TokenIndexer
+
+
+def run(name, path, storage_url, transfers, page_size, n, repeat):
+    idx = TokenIndexer(offline_client(), path, storage_url=storage_url)
+    t0 = time.perf_counter()
+    for page in pages(transfers, page_size):
+        idx._apply_transfers(page)
+        idx._commit()
+    dt = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        top = idx.get_top(n)
+    top_ms = (time.perf_counter() - t0) / repeat * 1000
+    print(f"{name:8s} {len(transfers):>9d} events  {dt:8.2f}s  {len(transfers) / dt:>10.0f} events/s  "
+          f"top-{n} {top_ms:7.2f} ms")
+    idx.close()
+    return top
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=500_000)
+    ap.add_argument("--holders", type=int, default=50_000)
+    ap.add_argument("--page", type=int, default=2000)
+    ap.add_argument("--top", type=int, default=100)
+    ap.add_argument("--repeat", type=int, default=50)
+    ap.add_argument("--pg", default=os.getenv("STORAGE_URL"), help="postgresql://…")
+    args = ap.parse_args()
+    if not args.pg:
+        ap.error("нужен --pg или STORAGE_URL")
+
+    transfers = synthetic_transfers(args.n, holders=args.holders)
+    with tempfile.TemporaryDirectory() as d:
+        local = run("sqlite", os.path.join(d, "sqlite.db"), None, transfers, args.page, args.top, args.repeat)
+        shared = run("postgres", os.path.join(d, "pg.db"), args.pg, transfers, args.page, args.top, args.repeat)
+    assert local == shared, "топ в SQLite и PostgreSQL разошёлся"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# Свежесть индекса: опрос (IndexFollower, раз в INDEX_INTERVAL) против подписки eth_subscribe
+# (StreamFollower) на локальном WebSocket-узле. В потоковом прогоне соединение рвётся и
+# случается реорг; в конце события сверяются с индексом, построенным с нуля через get_logs.
+#   python bench/bench_stream.py --duration 30 --block-time 0.5
+import argparse
+import os
+import tempfile
+import time
+
+from common import offline_client  # noqa: F401  (sys.path)
+from mock_ws import start
+
+from config import ERC20_ABI, INDEX_INTERVAL, TOKEN_ADDRESS
+from follower import IndexFollower, StreamFollower
+from ps_client import TokenIndexer
+from token_client import TokenClient
+
+
+def events(idx):
+    # id в addresses у разных БД свои — сравниваем сами адреса
+    return idx.conn.execute(
+        "SELECT t.block_number, t.log_index, t.tx_hash, fa.address, ta.address, t.value FROM transfers t "
+        "JOIN addresses fa ON fa.id = t.from_id JOIN addresses ta ON ta.id = t.to_id "
+        "ORDER BY t.block_number, t.log_index").fetchall()
+
+
+def run(name, make_follower, ws_node, http_url, d, start_block, duration, chaos):
+    idx = TokenIndexer(TokenClient(http_url, TOKEN_ADDRESS, ERC20_ABI), os.path.join(d, f"{name}.db"))
+    f = make_follower(idx, start_block)
+    reached = {}
+
+    def on_progress(last, head):
+        now = time.monotonic()
+        for n in range(max(reached, default=last - 1) + 1, last + 1):
+            reached[n] = now
+        f.last_block, f.head = last, head
+
+    f._on_progress = on_progress
+    ws_node.pause()  # первичная догонка — без новых блоков, в замер не входит
+    f.start()
+    while f.last_block is None or f.last_block < ws_node.chain.head:
+        time.sleep(0.05)
+    ws_node.resume()
+    calls0 = sum(ws_node.node.calls.values())
+    t0 = time.monotonic()
+    first = ws_node.chain.head + 1
+    if chaos:
+        time.sleep(duration / 3)
+        ws_node.drop()
+        time.sleep(duration / 3)
+        ws_node.reorg(3)
+        time.sleep(duration - 2 * duration / 3)
+    else:
+        time.sleep(duration)
+    ws_node.pause()
+    last_produced = ws_node.chain.head
+    time.sleep(max(1.0, INDEX_INTERVAL if name == "poll" else 1.0))
+    f.stop()
+    calls = sum(ws_node.node.calls.values()) - calls0
+
+    lags = sorted(reached[n] - ws_node.produced[n] for n in range(first, last_produced + 1)
+                  if n in reached and n in ws_node.produced)
+    pct = lambda p: lags[min(len(lags) - 1, int(p * len(lags)))] * 1000 if lags else float("nan")
+    print(f"{name:7s} блоков={len(lags):4d}  свежесть p50 {pct(0.5):7.0f} ms  p99 {pct(0.99):7.0f} ms  "
+          f"rpc-вызовов={calls} ({time.monotonic() - t0:.0f}s)")
+    return idx
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--duration", type=float, default=30)
+    ap.add_argument("--block-time", type=float, default=0.5)
+    ap.add_argument("--latency", type=float, default=30, help="мс на HTTP-запрос к узлу")
+    args = ap.parse_args()
+
+    ws_node, http_url, ws_url = start(head=1_000_000, block_time=args.block_time, latency_ms=args.latency)
+    print(f"ws {ws_url} http {http_url}: блок каждые {args.block_time}s, latency {args.latency}ms")
+    with tempfile.TemporaryDirectory() as d:
+        start_block = ws_node.chain.head - 100
+        poll = run("poll", lambda idx, s: IndexFollower(idx, start_block=s),
+                   ws_node, http_url, d, start_block, args.duration, chaos=False)
+        stream = run("stream", lambda idx, s: StreamFollower(idx, ws_url, start_block=s),
+                     ws_node, http_url, d, start_block, args.duration, chaos=True)
+
+        # сверка: догоняем оба до одной головы и сравниваем с индексом с нуля
+        ref = TokenIndexer(TokenClient(http_url, TOKEN_ADDRESS, ERC20_ABI), os.path.join(d, "ref.db"))
+        for idx in (poll, stream):
+            idx.index_transfers(confirmations=0)
+        ref.index_transfers(start_block=start_block, confirmations=0)
+        assert events(stream) == events(ref), "поток разошёлся с get_logs"
+        assert events(poll) == events(ref)
+        print(f"события совпадают с индексом с нуля: {len(events(ref))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# Несколько токенов в одном индексаторе против отдельного индексатора на каждый токен:
+# сколько eth_getLogs и заголовков уходит на один и тот же диапазон блоков. Общий
+# индексатор читает все адреса одним eth_getLogs на окно, число запросов от количества
+# токенов почти не зависит. В конце — сверка топа каждого токена с отдельным индексом.
+#   python bench/bench_tokens.py --blocks 20000 --tokens 1,10,50
+import argparse
+import os
+import tempfile
+import time
+
+from common import offline_client  # noqa: F401  (sys.path)
+from mock_rpc import Chain, MockNode, serve
+
+from config import CONFIRMATIONS, ERC20_ABI, TOKEN_ADDRESS
+from ps_client import TokenIndexer
+from token_client import TokenClient
+
+
+def run(node, url, path, token, tokens, start):
+    idx = TokenIndexer(TokenClient(url, token, ERC20_ABI), path, tokens=tokens)
+    node.calls.clear()  # decimals/symbol при регистрации токенов не в счёт
+    t0 = time.perf_counter()
+    idx.index_transfers(start_block=start)
+    return idx, time.perf_counter() - t0, dict(node.calls)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--blocks", type=int, default=20_000)
+    ap.add_argument("--tokens", default="1,10,50", help="сколько токенов, через запятую")
+    ap.add_argument("--per-block", type=int, default=2, help="макс. Transfer-ов токена в блоке")
+    ap.add_argument("--latency", type=float, default=0, help="мс на запрос")
+    ap.add_argument("--n", type=int, default=20, help="размер сверяемого топа")
+    args = ap.parse_args()
+
+    start = 1_000_000
+    for count in map(int, args.tokens.split(",")):
+        chain = Chain(TOKEN_ADDRESS, start + args.blocks - 1 + CONFIRMATIONS,
+                      max_per_block=args.per_block, tokens=count - 1)
+        node = MockNode(chain, latency=args.latency / 1000)
+        srv, url = serve(node)
+        with tempfile.TemporaryDirectory() as d:
+            shared, dt, calls = run(node, url, os.path.join(d, "shared.db"), TOKEN_ADDRESS, chain.tokens, start)
+            print(f"tokens={count:3d} общий     {dt:7.2f}s  eth_getLogs={calls.get('eth_getLogs', 0):6d}  "
+                  f"eth_getBlockByNumber={calls.get('eth_getBlockByNumber', 0):6d}")
+            total, logs, headers = 0.0, 0, 0
+            for i, token in enumerate(chain.tokens):
+                idx, dt, calls = run(node, url, os.path.join(d, f"{i}.db"), token, (), start)
+                total += dt
+                logs += calls.get("eth_getLogs", 0)
+                headers += calls.get("eth_getBlockByNumber", 0)
+                assert idx.get_top(args.n) == shared.get_top(args.n, token=token), token
+                idx.close()
+            print(f"tokens={count:3d} отдельные {total:7.2f}s  eth_getLogs={logs:6d}  "
+                  f"eth_getBlockByNumber={headers:6d}")
+            shared.close()
+        srv.shutdown()
+
+
+if __name__ == "__main__":
+    main()
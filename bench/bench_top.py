@@ -0,0 +1,77 @@
+# Латентность top-N: индекс по BLOB-балансу vs прежний ORDER BY LENGTH(balance) по TEXT.
+#   python bench/bench_top.py --holders 10000000
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from common import offline_client
+
+from ps_client import TokenIndexer, _u256
+
+LEGACY_TOP = """
+    SELECT address, balance FROM (
+        SELECT address, balance FROM holders_text
+        WHERE balance != '0'
+        ORDER BY LENGTH(balance) DESC, balance DESC
+        LIMIT ?
+    ) t ORDER BY LENGTH(balance) ASC, balance ASC;
+"""
+
+
+def fill(conn, holders, legacy, chunk=200_000):
+    rnd = random.Random(7)
+    if legacy:
+        conn.execute("CREATE TABLE holders_text (address TEXT PRIMARY KEY, balance TEXT NOT NULL, "
+                     "last_tx_block INTEGER, last_tx_ts INTEGER)")
+    for i in range(0, holders, chunk):
+        rows = []
+        for j in range(i, min(holders, i + chunk)):
+            # ~10% нулевых, остальные — разброс на много порядков
+            bal = 0 if rnd.random() < 0.1 else rnd.randrange(1, 10 ** rnd.randint(1, 30))
+            rows.append(("0x%040x" % j, bal, 1, 1))
+        conn.executemany("INSERT INTO holders VALUES (1, ?, ?, ?, ?)",
+                         ((a, _u256(b), blk, ts) for a, b, blk, ts in rows))
+        if legacy:
+            conn.executemany("INSERT INTO holders_text VALUES (?, ?, ?, ?)",
+                             ((a, str(b), blk, ts) for a, b, blk, ts in rows))
+        conn.commit()
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--holders", type=int, default=10_000_000)
+    ap.add_argument("--ns", default="10,1000,100000")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--skip-legacy", action="store_true")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as d:
+        idx = TokenIndexer(offline_client(), os.path.join(d, "bench.db"))
+        t0 = time.perf_counter()
+        fill(idx.conn, args.holders, not args.skip_legacy)
+        print(f"заполнено {args.holders} держателей за {time.perf_counter() - t0:.1f}s")
+
+        for n in map(int, args.ns.split(",")):
+            new = timed(lambda: idx._top_rows(n, idx.token_id), args.repeat)
+            line = f"top-{n:<7d} index {new * 1000:10.2f} ms"
+            if not args.skip_legacy:
+                old = timed(lambda: idx.conn.execute(LEGACY_TOP, (n,)).fetchall(), args.repeat)
+                line += f"   legacy {old * 1000:10.2f} ms   x{old / new:.0f}"
+            print(line)
+        idx.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Опрос /get_top и /get_top_with_transactions с кэшем ответов и без: среднее время ответа на
+# сервере (http_request_seconds, без накладных TestClient), повтор с If-None-Match (304) и доля
+# попаданий, когда индекс сдвигается каждые --every запросов.
+#   python bench/bench_top_cache.py --holders 1000000 --ns 10,100,1000
+import argparse
+import os
+import tempfile
+
+from common import offline_client
+from bench_top import fill
+
+from fastapi.testclient import TestClient
+
+import app
+import metrics
+
+
+def served(path):
+    _, total, n = metrics.HTTP_SECONDS._values.get((path,), (None, 0.0, 0))
+    return total, n
+
+
+def latency(c, path, params, requests, headers=None, on_request=None):
+    # -> (мс на запрос на сервере, последний ответ)
+    total, n = served(path)
+    for i in range(requests):
+        if on_request is not None:
+            on_request(i)
+        r = c.get(path, params=params, headers=headers)
+    total2, n2 = served(path)
+    return (total2 - total) / (n2 - n) * 1000, r
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--holders", type=int, default=1_000_000)
+    ap.add_argument("--ns", default="10,100,1000")
+    ap.add_argument("--requests", type=int, default=500)
+    ap.add_argument("--every", type=int, default=50, help="запросов на один сдвиг индекса")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as d:
+        idx = app.indexer = app.TokenIndexer(offline_client(), os.path.join(d, "bench.db"))
+        fill(idx.conn, args.holders, False)
+        idx.storage.set_checkpoints([idx.token_id], 1)
+        idx.conn.commit()
+        c = TestClient(app.app)
+        max_n = app.top_cache.max_n
+
+        def advance(i):
+            # новый коммит индексатора: поколение меняется, кэш промахивается
+            if i % args.every == 0:
+                idx.generation += 1
+
+        for path in ("/get_top", "/get_top_with_transactions"):
+            for n in map(int, args.ns.split(",")):
+                params = {"n": n}
+                app.top_cache.max_n = 0
+                off, r0 = latency(c, path, params, args.requests)
+                app.top_cache.max_n = max_n
+                on, r1 = latency(c, path, params, args.requests)
+                assert r0.content == r1.content
+                etag = r1.headers["etag"]
+                not_mod, r2 = latency(c, path, params, args.requests, {"If-None-Match": etag})
+                assert r2.status_code == 304
+                hits = app.top_cache.hits
+                moving, _ = latency(c, path, params, args.requests, on_request=advance)
+                hit_rate = (app.top_cache.hits - hits) / args.requests
+                print(f"{path:28s} n={n:<5d} без кэша {off:7.2f} ms   кэш {on:6.2f} ms (x{off / on:.1f})   "
+                      f"304 {not_mod:6.2f} ms   сдвиг раз в {args.every}: {moving:6.2f} ms, "
+                      f"попаданий {hit_rate:.0%}")
+        app.indexer = None
+        idx.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# Латентность get_transfers для "горячего" адреса: таблица transfers заполняется напрямую,
+# адрес участвует в --hot переводах из --n; страницы с начала, по курсору из глубины истории
+# и по диапазону блоков.
+#   python bench/bench_transfers.py --n 3000000 --hot 1000000
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from common import offline_client
+
+from ps_client import TokenIndexer, _checksum, _u256
+
+
+def fill(conn, n, hot, holders, chunk=200_000):
+    # адрес 1 — горячий; блоки по 4 перевода
+    rnd = random.Random(7)
+    conn.executemany("INSERT INTO addresses(id, address) VALUES (?, ?)",
+                     ((i, "0x%040x" % i) for i in range(1, holders + 1)))
+    share = hot / n
+    for i in range(0, n, chunk):
+        rows = []
+        for j in range(i, min(n, i + chunk)):
+            a, b = rnd.randint(2, holders), rnd.randint(2, holders)
+            if rnd.random() < share:
+                a, b = (1, b) if rnd.random() < 0.5 else (a, 1)
+            rows.append((j // 4, j % 4, rnd.randbytes(32), a, b, _u256(rnd.randrange(10 ** 20)), 1))
+        conn.executemany("INSERT INTO transfers(block_number, log_index, tx_hash, from_id, to_id, value, token_id) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.commit()
+
+
+def timed(fn, runs):
+    lat = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        lat.append((time.perf_counter() - t0) * 1000)
+    lat.sort()
+    return lat[len(lat) // 2], lat[min(len(lat) - 1, int(0.99 * len(lat)))]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=3_000_000)
+    ap.add_argument("--hot", type=int, default=1_000_000, help="переводов горячего адреса")
+    ap.add_argument("--holders", type=int, default=100_000)
+    ap.add_argument("--limit", type=int, default=100)
+    ap.add_argument("--runs", type=int, default=200)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as d:
+        idx = TokenIndexer(offline_client(), os.path.join(d, "bench.db"))
+        t0 = time.perf_counter()
+        fill(idx.conn, args.n, args.hot, args.holders)
+        hot = _checksum("0x%040x" % 1)
+        count = idx.conn.execute("SELECT (SELECT COUNT(*) FROM transfers WHERE token_id = 1 AND from_id = 1) + "
+                                 "(SELECT COUNT(*) FROM transfers WHERE token_id = 1 AND to_id = 1)").fetchone()[0]
+        print(f"transfers={args.n} у горячего адреса={count} заполнение {time.perf_counter() - t0:.1f}s")
+
+        last = args.n // 4
+        rnd = random.Random(1)
+        cases = [
+            ("первая страница desc", lambda: idx.get_transfers(hot, limit=args.limit)),
+            ("первая страница asc", lambda: idx.get_transfers(hot, limit=args.limit, order="asc")),
+            ("курсор в глубине", lambda: idx.get_transfers(hot, limit=args.limit, cursor=(rnd.randrange(last), 0))),
+            ("диапазон блоков", lambda: idx.get_transfers(
+                hot, from_block=(b := rnd.randrange(last)), to_block=b + 10_000, limit=args.limit)),
+        ]
+        for name, fn in cases:
+            p50, p99 = timed(fn, args.runs)
+            print(f"{name:22s} limit={args.limit}  p50 {p50:6.2f} ms  p99 {p99:6.2f} ms")
+
+        # полный обход курсором совпадает с выборкой по индексам
+        got, cur = 0, None
+        while True:
+            rows, cur = idx.get_transfers(hot, from_block=last - 20_000, limit=1000, cursor=cur)
+            got += len(rows)
+            if cur is None:
+                break
+        exp = idx.conn.execute("SELECT COUNT(*) FROM transfers WHERE block_number >= ? AND (from_id = 1 OR to_id = 1)",
+                               (last - 20_000,)).fetchone()[0]
+        assert got == exp, (got, exp)
+        idx.close()
+
+
+if __name__ == "__main__":
+    main()
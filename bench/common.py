@@ -0,0 +1,52 @@
+# Общие хелперы для бенчмарков: оффлайн-клиент и синтетические Transfer-ы.
+import os
+import random
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web3 import Web3
+
+from config import ERC20_ABI, TOKEN_ADDRESS, ZERO
+
+
+def offline_client(decimals=18, symbol="TKN"):
+    # TokenIndexer берёт у клиента только w3/contract/address/decimals/symbol,
+    # для работы с БД сеть не нужна.
+    w3 = Web3()
+    addr = Web3.to_checksum_address(TOKEN_ADDRESS)
+    return SimpleNamespace(
+        w3=w3,
+        contract=w3.eth.contract(address=addr, abi=ERC20_ABI),
+        address=addr,
+        decimals=decimals,
+        symbol=symbol,
+    )
+
+
+def synthetic_addresses(n, seed=1):
+    rnd = random.Random(seed)
+    return ["0x" + rnd.randbytes(20).hex() for _ in range(n)]
+
+
+def synthetic_transfers(n, holders=50_000, per_block=20, start_block=1, seed=1):
+    # Первые переводы — минт из ZERO, дальше случайные переводы между держателями.
+    rnd = random.Random(seed)
+    addrs = synthetic_addresses(holders, seed)
+    out = []
+    for i in range(n):
+        blk = start_block + i // per_block
+        if i < holders:
+            frm, to, val = ZERO, addrs[i], 10 ** 24
+        else:
+            frm, to = rnd.choice(addrs), rnd.choice(addrs)
+            val = rnd.randrange(1, 10 ** 18)
+        txh = "0x%064x" % i
+        out.append((frm, to, val, blk, 1_700_000_000 + blk * 2, txh, i % per_block))
+    return out
+
+
+def pages(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
@@ -0,0 +1,196 @@
+# Локальный "Etherscan" для бенчмарков bootstrap: отдаёт tokentx из записи (JSON-список строк
+# в формате Etherscan) с его пагинацией, лимитом окна page*offset<=10000, задержкой и
+# ограничением частоты (ответ NOTOK "Max calls per sec rate limit reached").
+#   python bench/fake_etherscan.py --port 8546 --recording rows.json --rate 5 --latency 150
+#   python bench/fake_etherscan.py --record rows.json --api-key KEY --start 42812490 --end 42900000
+#   без --recording строки генерируются из синтетической цепочки mock_rpc.Chain
+import argparse
+import bisect
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from mock_rpc import Chain
+
+
+def synthetic_rows(chain, start, end, token=None, log_index=True):
+    # строки tokentx токена (по умолчанию основного); log_index=False — без logIndex, как
+    # обычно и отдаёт Etherscan
+    token = (token or chain.token).lower()
+    rows = []
+    for log in chain.logs(start, end, [token]):
+        blk = int(log["blockNumber"], 16)
+        row = {
+            "blockNumber": str(blk),
+            "timeStamp": str(chain.timestamp(blk)),
+            "hash": log["transactionHash"],
+            "blockHash": log["blockHash"],
+            "from": "0x" + log["topics"][1][-40:],
+            "to": "0x" + log["topics"][2][-40:],
+            "value": str(int(log["data"], 16)),
+            "contractAddress": token,
+            "transactionIndex": str(int(log["transactionIndex"], 16)),
+        }
+        if log_index:
+            row["logIndex"] = str(int(log["logIndex"], 16))
+        rows.append(row)
+    return rows
+
+
+def record(api_key, contract, start, end, path, offset=1000):
+    # Запись настоящих страниц для последующего воспроизведения.
+    from etherscan import EtherscanClient
+    es = EtherscanClient(api_key)
+    rows, cur = [], start
+    while cur <= end:
+        last = cur
+        for page in range(1, 10000 // offset + 1):
+            got = es.tokentx(contract, cur, end, page, offset)
+            rows.extend(got)
+            last = max([last] + [int(r["blockNumber"]) for r in got])
+            if len(got) < offset:
+                cur = end + 1
+                break
+        else:
+            cur = last if last > cur else cur + 1
+    uniq = {(r["hash"], r.get("logIndex")): r for r in rows}
+    with open(path, "w") as f:
+        json.dump(sorted(uniq.values(), key=lambda r: (int(r["blockNumber"]), int(r.get("logIndex") or 0))), f)
+    print(f"записано {len(uniq)} строк в {path}")
+
+
+class FakeEtherscan:
+    def __init__(self, rows, latency=0.0, rate=5.0):
+        self.rows = sorted(rows, key=lambda r: (int(r["blockNumber"]), int(r.get("logIndex") or 0)))
+        self.blocks = [int(r["blockNumber"]) for r in self.rows]
+        self.latency = latency
+        self.rate = rate
+        self.calls = 0
+        self.throttled = 0
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _allow(self):
+        with self._lock:
+            self.calls += 1
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            self.throttled += 1
+            return False
+
+    def respond(self, q):
+        if not self._allow():
+            return {"status": "0", "message": "NOTOK",
+                    "result": f"Max calls per sec rate limit reached ({self.rate:g}/sec)"}
+        if q.get("action") != "tokentx":
+            return {"status": "0", "message": "NOTOK", "result": "Error! Invalid action"}
+        start, end = int(q.get("startblock", 0)), int(q.get("endblock", 10 ** 12))
+        page, offset = int(q.get("page", 1)), int(q.get("offset", 10000))
+        if page * offset > 10000:
+            return {"status": "0", "message": "NOTOK",
+                    "result": "Result window is too large, PageNo x Offset size must be less than or equal to 10000"}
+        lo = bisect.bisect_left(self.blocks, start)
+        hi = bisect.bisect_right(self.blocks, end)
+        i = lo + (page - 1) * offset
+        out = self.rows[i:min(hi, i + offset)]
+        if not out:
+            return {"status": "0", "message": "No transactions found", "result": []}
+        return {"status": "1", "message": "OK", "result": out}
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def do_GET(self):
+            q = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+            if fake.latency:
+                time.sleep(fake.latency)
+            raw = json.dumps(fake.respond(q)).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def serve(fake, host="127.0.0.1", port=0):
+    srv = _Server((host, port), make_handler(fake))
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv, f"http://{host}:{srv.server_address[1]}/v2/api"
+
+
+def spawn(recording, latency_ms=0, rate=5.0):
+    # Отдельный процесс, как и mock_rpc.spawn. Возвращает (proc, url).
+    import subprocess
+    import sys
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    proc = subprocess.Popen([
+        sys.executable, __file__, "--port", str(port), "--recording", recording,
+        "--latency", str(latency_ms), "--rate", str(rate),
+    ], stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return proc, f"http://127.0.0.1:{port}/v2/api"
+
+
+def main():
+    from config import TOKEN_ADDRESS
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8546)
+    ap.add_argument("--recording", help="JSON-список строк tokentx")
+    ap.add_argument("--latency", type=float, default=150, help="мс на запрос")
+    ap.add_argument("--rate", type=float, default=5, help="запросов/сек до ответа лимитом")
+    ap.add_argument("--start", type=int, default=1_000_000)
+    ap.add_argument("--end", type=int, default=1_050_000)
+    ap.add_argument("--record", help="записать настоящие страницы Etherscan в файл и выйти")
+    ap.add_argument("--api-key")
+    args = ap.parse_args()
+    if args.record:
+        record(args.api_key, TOKEN_ADDRESS, args.start, args.end, args.record)
+        return
+    if args.recording:
+        with open(args.recording) as f:
+            rows = json.load(f)
+    else:
+        rows = synthetic_rows(Chain(TOKEN_ADDRESS, args.end), args.start, args.end)
+    fake = FakeEtherscan(rows, latency=args.latency / 1000, rate=args.rate)
+    _, url = serve(fake, port=args.port)
+    print(f"fake etherscan: {url} rows={len(rows)}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    import common  # noqa: F401  (корень репозитория в sys.path)
+    main()
@@ -0,0 +1,114 @@
+# Нагрузочный тест: N одновременных клиентов против async app.py и прежних sync-хендлеров,
+# оба смотрят в локальный mock RPC с задержкой.
+#   python bench/load_test.py --clients 1000 --duration 20 --latency 20
+#   python bench/load_test.py --clients 64 --path "/get_top?n=10" --holders 1000000
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import aiohttp
+
+from common import offline_client, synthetic_addresses
+from mock_rpc import spawn
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(target, cwd, env, ready):
+    # ждём не только порт, но и готовности: app.py поднимает индекс уже после bind
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", target, "--port", str(port), "--log-level", "warning",
+         "--no-access-log", "--backlog", "4096"],
+        cwd=cwd, env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(200):
+        try:
+            with urllib.request.urlopen(url + ready, timeout=1):
+                return proc, url
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{target} не поднялся")
+
+
+async def hammer(url, path, clients, duration):
+    addrs = synthetic_addresses(1000)
+    lat, errors = [], 0
+    stop = time.perf_counter() + duration
+    conn = aiohttp.TCPConnector(limit=clients)
+    async with aiohttp.ClientSession(connector=conn, timeout=aiohttp.ClientTimeout(total=60)) as sess:
+        async def client():
+            nonlocal errors
+            while time.perf_counter() < stop:
+                q = path.format(address=random.choice(addrs))
+                t0 = time.perf_counter()
+                try:
+                    async with sess.get(url + q) as r:
+                        await r.read()
+                        if r.status != 200:
+                            errors += 1
+                            continue
+                except Exception:
+                    errors += 1
+                    continue
+                lat.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(clients)))
+        elapsed = time.perf_counter() - t0
+    lat.sort()
+    pct = lambda p: lat[min(len(lat) - 1, int(p * len(lat)))] * 1000 if lat else float("nan")
+    return len(lat) / elapsed, pct(0.5), pct(0.99), errors
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=int, default=1000)
+    ap.add_argument("--duration", type=float, default=20)
+    ap.add_argument("--latency", type=float, default=20, help="мс на запрос к mock RPC")
+    ap.add_argument("--path", default="/get_balance?address={address}&human=0")
+    ap.add_argument("--holders", type=int, default=0, help="заполнить holders для /get_top")
+    args = ap.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "load.db")
+    if args.holders:
+        from bench_top import fill
+        from ps_client import TokenIndexer
+        idx = TokenIndexer(offline_client(), db_path)
+        fill(idx.conn, args.holders, legacy=False)
+        idx.close()
+    rpc, rpc_url = spawn(head=1000, latency_ms=args.latency)
+    env = dict(os.environ, RPC_URL=rpc_url, BACKGROUND_INDEX="0", DB_PATH=db_path)
+    print(f"mock rpc {rpc_url} latency={args.latency}ms, clients={args.clients}, {args.duration}s, {args.path}")
+    try:
+        for name, target, cwd, ready in (("sync", "sync_app:app", BENCH, "/health"),
+                                         ("async", "app:app", ROOT, "/readyz")):
+            proc, url = start_server(target, cwd, env, ready)
+            try:
+                rps, p50, p99, errors = asyncio.run(hammer(url, args.path, args.clients, args.duration))
+            finally:
+                proc.terminate()
+                proc.wait()
+            print(f"{name:6s} {rps:9.0f} req/s   p50 {p50:8.1f} ms   p99 {p99:8.1f} ms   errors {errors}")
+    finally:
+        rpc.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+# Локальный JSON-RPC "узел" для бенчмарков: синтетическая цепочка с Transfer-логами
+# токена (и --tokens дополнительных), настраиваемая задержка и лимит диапазона eth_getLogs.
+# Для пула узлов: медленный хвост (--slow-rate/--slow), HTTP 503 (--http-fail-rate) и
+# отставание головы (--lag).
+#   python bench/mock_rpc.py --port 8545 --latency 50 --head 43000000
+import argparse
+import hashlib
+import json
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from eth_abi import decode, encode
+
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+SEL_DECIMALS = "313ce567"
+SEL_SYMBOL = "95d89b41"
+SEL_NAME = "06fdde03"
+SEL_TOTAL_SUPPLY = "18160ddd"
+SEL_BALANCE_OF = "70a08231"
+SEL_AGGREGATE3 = "82ad56cb"
+
+
+def _h(*parts):
+    return hashlib.sha256(":".join(map(str, parts)).encode()).digest()
+
+
+def _hex(n):
+    return hex(n)
+
+
+class Chain:
+    def __init__(self, token, head, start_block=0, holders=10_000, max_per_block=4, block_time=2, tokens=0):
+        self.token = token.lower()
+        # дополнительные токены: логи основного от них не меняются, logIndex продолжается после него.
+        # В транзакции по два лога подряд — бывает, что двух разных токенов
+        self.tokens = [self.token] + ["0x" + _h("token", k)[:20].hex() for k in range(1, tokens + 1)]
+        self.head = head
+        self.start_block = start_block
+        self.holders = holders
+        self.max_per_block = max_per_block
+        self.block_time = block_time
+        self.genesis_ts = 1_600_000_000
+        self.reorgs = []  # [(с какого блока, эпоха)] — блоки выше точки форка у каждой эпохи свои
+
+    def reorg(self, depth, new_head=None):
+        # последние depth блоков заменяются другой веткой (другие хэши и переводы)
+        self.reorgs.append((self.head - depth + 1, len(self.reorgs) + 1))
+        if new_head is not None:
+            self.head = new_head
+
+    def _epoch(self, n):
+        epoch = 0
+        for frm, e in self.reorgs:
+            if n >= frm:
+                epoch = e
+        return epoch
+
+    def _key(self, n):
+        epoch = self._epoch(n)
+        return n if not epoch else f"{n}/{epoch}"
+
+    def block_hash(self, n):
+        return "0x" + _h("block", self._key(n)).hex()
+
+    def timestamp(self, n):
+        return self.genesis_ts + n * self.block_time
+
+    def holder(self, i):
+        return "0x" + _h("holder", i % self.holders)[:20].hex()
+
+    def transfers_in(self, n, k=0):
+        if n < self.start_block:
+            return 0
+        key = self._key(n) if not k else f"{self._key(n)}#{k}"
+        return _h("count", key)[0] % (self.max_per_block + 1)
+
+    def block(self, n):
+        return {
+            "number": _hex(n),
+            "hash": self.block_hash(n),
+            "parentHash": self.block_hash(n - 1) if n > 0 else "0x" + "00" * 32,
+            "timestamp": _hex(self.timestamp(n)),
+            "miner": "0x" + "00" * 20,
+            "extraData": "0x",
+            "gasLimit": "0x1c9c380",
+            "gasUsed": "0x0",
+            "transactions": [],
+        }
+
+    def logs(self, frm, to, addresses=None):
+        out = []
+        for n in range(frm, min(to, self.head) + 1):
+            li = 0
+            for k, token in enumerate(self.tokens):
+                first, li = li, li + self.transfers_in(n, k)
+                if addresses is None or token in addresses:
+                    out.extend(self._token_logs(n, token, first, li))
+        return out
+
+    def _token_logs(self, n, token, first, end):
+        out = []
+        for li in range(first, end):
+            seed = _h("tx", self._key(n), li)
+            a = int.from_bytes(seed[:4], "big")
+            b = int.from_bytes(seed[4:8], "big")
+            value = int.from_bytes(seed[8:16], "big")
+            out.append({
+                "address": token,
+                "topics": [
+                    TRANSFER_TOPIC,
+                    "0x" + "00" * 12 + self.holder(a)[2:],
+                    "0x" + "00" * 12 + self.holder(b)[2:],
+                ],
+                "data": "0x%064x" % value,
+                "blockNumber": _hex(n),
+                "blockHash": self.block_hash(n),
+                "transactionHash": "0x" + _h("txh", self._key(n), li // 2).hex(),
+                "transactionIndex": _hex(li // 2),
+                "logIndex": _hex(li),
+                "removed": False,
+            })
+        return out
+
+    def balance_of(self, addr):
+        return int.from_bytes(_h("balance", addr.lower())[:12], "big")
+
+
+class RpcError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class MockNode:
+    def __init__(self, chain, latency=0.0, max_range=2000, fail_rate=0.0, slow_rate=0.0, slow=0.0,
+                 http_fail_rate=0.0, lag=0, reverts=(), multicall=True, batch=True):
+        self.chain = chain
+        self.latency = latency
+        self.max_range = max_range
+        self.fail_rate = fail_rate
+        self.slow_rate = slow_rate  # доля запросов с дополнительной задержкой slow
+        self.slow = slow
+        self.http_fail_rate = http_fail_rate  # доля запросов, на которые узел отвечает 503
+        self.lag = lag  # на сколько блоков голова узла отстаёт от цепочки
+        self.reverts = {a.lower() for a in reverts}  # адреса, на которых balanceOf откатывается
+        self.multicall = multicall  # есть ли Multicall3 (aggregate3)
+        self.batch = batch  # принимает ли узел JSON-RPC batch
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    @property
+    def head(self):
+        return self.chain.head - self.lag
+
+    @staticmethod
+    def _chance(rate, salt):
+        return rate and int.from_bytes(_h(salt, time.perf_counter_ns())[:2], "big") < rate * 65536
+
+    def _count(self, method):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+    def _block_arg(self, v):
+        if v in ("latest", "safe", "finalized", "pending"):
+            return self.head
+        return int(v, 16)
+
+    def _eth_call(self, tx):
+        data = tx.get("data") or tx.get("input") or "0x"
+        sel, args = data[2:10], bytes.fromhex(data[10:])
+        if sel == SEL_DECIMALS:
+            return encode(["uint8"], [18])
+        if sel == SEL_SYMBOL:
+            return encode(["string"], ["MOCK"])
+        if sel == SEL_NAME:
+            return encode(["string"], ["Mock Token"])
+        if sel == SEL_TOTAL_SUPPLY:
+            return encode(["uint256"], [10 ** 27])
+        if sel == SEL_BALANCE_OF:
+            (addr,) = decode(["address"], args)
+            if addr.lower() in self.reverts:
+                raise RpcError(3, "execution reverted")
+            return encode(["uint256"], [self.chain.balance_of(addr)])
+        if sel == SEL_AGGREGATE3 and self.multicall:
+            (calls,) = decode(["(address,bool,bytes)[]"], args)
+            results = []
+            for target, allow_failure, call_data in calls:
+                try:
+                    results.append((True, self._eth_call({"to": target, "data": "0x" + call_data.hex()})))
+                except RpcError:
+                    if not allow_failure:
+                        raise
+                    results.append((False, b""))
+            return encode(["(bool,bytes)[]"], [results])
+        raise RpcError(-32000, "execution reverted")
+
+    def handle(self, method, params):
+        self._count(method)
+        if self._chance(self.fail_rate, "fail"):
+            raise RpcError(-32005, "limit exceeded")
+        if method == "web3_clientVersion":
+            return "mock/1.0"
+        if method == "eth_chainId":
+            return _hex(137)
+        if method == "net_version":
+            return "137"
+        if method == "eth_blockNumber":
+            return _hex(self.head)
+        if method == "eth_getBlockByNumber":
+            n = self._block_arg(params[0])
+            return self.chain.block(n) if n <= self.head else None
+        if method == "eth_getLogs":
+            flt = params[0]
+            frm, to = self._block_arg(flt["fromBlock"]), self._block_arg(flt["toBlock"])
+            if to - frm + 1 > self.max_range:
+                raise RpcError(-32062, "block range is too large")
+            addr = flt.get("address")
+            if isinstance(addr, str):
+                addr = [addr]
+            return self.chain.logs(frm, min(to, self.head), None if addr is None else {a.lower() for a in addr})
+        if method == "eth_call":
+            return "0x" + self._eth_call(params[0]).hex()
+        raise RpcError(-32601, f"method {method} not found")
+
+    def respond(self, req):
+        try:
+            return {"jsonrpc": "2.0", "id": req.get("id"), "result": self.handle(req["method"], req.get("params") or [])}
+        except RpcError as e:
+            return {"jsonrpc": "2.0", "id": req.get("id"), "error": {"code": e.code, "message": str(e)}}
+
+
+def make_handler(node):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            # заголовки и тело уходят отдельными write — без NODELAY ловим Nagle + delayed ACK
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            if node.latency:
+                time.sleep(node.latency)
+            if node._chance(node.slow_rate, "slow"):
+                time.sleep(node.slow)
+            if node._chance(node.http_fail_rate, "http"):
+                node._count("http_503")
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if isinstance(body, list):
+                node._count("batch")
+                out = [node.respond(r) for r in body] if node.batch else {
+                    "jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": "batch requests are not supported"}}
+            else:
+                out = node.respond(body)
+            raw = json.dumps(out).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # клиент закрыл соединение, не дождавшись ответа (проигравший дубль пула) — не ошибка
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def serve(node, host="127.0.0.1", port=0):
+    # Запуск в фоне; возвращает (server, url).
+    srv = _Server((host, port), make_handler(node))
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv, f"http://{host}:{srv.server_address[1]}"
+
+
+def spawn(head, latency_ms=0, max_range=2000, per_block=4, fail_rate=0.0, tokens=0, slow_rate=0.0, slow_ms=0,
+          http_fail_rate=0.0, lag=0):
+    # Узел в отдельном процессе, чтобы он не делил GIL с измеряемым кодом. Возвращает (proc, url).
+    import subprocess
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    proc = subprocess.Popen([
+        sys.executable, __file__, "--port", str(port), "--head", str(head), "--latency", str(latency_ms),
+        "--max-range", str(max_range), "--per-block", str(per_block), "--fail-rate", str(fail_rate),
+        "--tokens", str(tokens), "--slow-rate", str(slow_rate), "--slow", str(slow_ms),
+        "--http-fail-rate", str(http_fail_rate), "--lag", str(lag),
+    ], stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return proc, url
+
+
+def main():
+    from config import TOKEN_ADDRESS
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8545)
+    ap.add_argument("--latency", type=float, default=50, help="мс на запрос")
+    ap.add_argument("--head", type=int, default=43_000_000)
+    ap.add_argument("--max-range", type=int, default=2000)
+    ap.add_argument("--per-block", type=int, default=4, help="макс. Transfer-ов в блоке")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="доля запросов, отвечающих ошибкой лимита")
+    ap.add_argument("--tokens", type=int, default=0, help="дополнительных токенов с Transfer-логами")
+    ap.add_argument("--slow-rate", type=float, default=0.0, help="доля запросов с задержкой --slow")
+    ap.add_argument("--slow", type=float, default=0, help="мс дополнительной задержки")
+    ap.add_argument("--http-fail-rate", type=float, default=0.0, help="доля запросов с ответом 503")
+    ap.add_argument("--lag", type=int, default=0, help="на сколько блоков отстаёт голова узла")
+    args = ap.parse_args()
+    chain = Chain(TOKEN_ADDRESS, args.head, max_per_block=args.per_block, tokens=args.tokens)
+    node = MockNode(chain, latency=args.latency / 1000, max_range=args.max_range, fail_rate=args.fail_rate,
+                    slow_rate=args.slow_rate, slow=args.slow / 1000, http_fail_rate=args.http_fail_rate,
+                    lag=args.lag)
+    _, url = serve(node, port=args.port)
+    print(f"mock rpc: {url}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    import common  # noqa: F401  (корень репозитория в sys.path)
+    main()
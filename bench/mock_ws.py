@@ -0,0 +1,159 @@
+# WebSocket-"узел" поверх той же синтетической цепочки, что и mock_rpc: eth_subscribe
+# newHeads/logs, новый блок каждые block_time секунд, реорги (removed-логи + новая ветка)
+# и обрыв соединений — для проверки потокового индексатора.
+#   python bench/mock_ws.py --port 8547 --block-time 2
+import argparse
+import asyncio
+import itertools
+import json
+import threading
+import time
+
+import websockets
+
+from mock_rpc import Chain, MockNode, serve
+
+
+class WsNode:
+    def __init__(self, node, block_time=2.0):
+        self.node = node
+        self.chain = node.chain
+        self.block_time = block_time
+        self.notifications = 0
+        self.produced = {}  # номер блока -> time.monotonic() его объявления
+        self._subs = {}  # websocket -> {id: (тип, фильтр)}
+        self._ids = itertools.count(1)
+        self._loop = None
+        self._producing = True
+
+    # --- сервер ---
+
+    async def _handler(self, ws):
+        self._subs[ws] = {}
+        try:
+            async for raw in ws:
+                req = json.loads(raw)
+                method, params = req.get("method"), req.get("params") or []
+                if method == "eth_subscribe":
+                    sub_id = hex(next(self._ids))
+                    self._subs[ws][sub_id] = (params[0], params[1] if len(params) > 1 else {})
+                    resp = {"jsonrpc": "2.0", "id": req.get("id"), "result": sub_id}
+                elif method == "eth_unsubscribe":
+                    ok = self._subs[ws].pop(params[0], None) is not None
+                    resp = {"jsonrpc": "2.0", "id": req.get("id"), "result": ok}
+                else:
+                    resp = self.node.respond(req)
+                await ws.send(json.dumps(resp))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self._subs.pop(ws, None)
+
+    def _matches(self, flt, log):
+        addr = flt.get("address")
+        if addr and log["address"].lower() not in ([a.lower() for a in addr] if isinstance(addr, list) else [addr.lower()]):
+            return False
+        topics = flt.get("topics") or []
+        return all(t is None or log["topics"][i] in (t if isinstance(t, list) else [t])
+                   for i, t in enumerate(topics))
+
+    async def _publish(self, kind, item):
+        for ws, subs in list(self._subs.items()):
+            for sub_id, (k, flt) in list(subs.items()):
+                if k != kind or (kind == "logs" and not self._matches(flt, item)):
+                    continue
+                self.notifications += 1
+                try:
+                    await ws.send(json.dumps({"jsonrpc": "2.0", "method": "eth_subscription",
+                                              "params": {"subscription": sub_id, "result": item}}))
+                except websockets.ConnectionClosed:
+                    pass
+
+    async def _announce(self, n):
+        # в реальных узлах порядок сообщений двух подписок не гарантирован — шлём логи первыми
+        self.produced.setdefault(n, time.monotonic())
+        for lg in self.chain.logs(n, n):
+            await self._publish("logs", lg)
+        await self._publish("newHeads", self.chain.block(n))
+
+    async def _produce(self):
+        while True:
+            await asyncio.sleep(self.block_time)
+            if self._producing:
+                self.chain.head += 1
+                await self._announce(self.chain.head)
+
+    async def _reorg(self, depth):
+        head = self.chain.head
+        old = self.chain.logs(head - depth + 1, head)
+        self.chain.reorg(depth)
+        for lg in reversed(old):
+            await self._publish("logs", {**lg, "removed": True})
+        for n in range(head - depth + 1, head + 1):
+            await self._announce(n)
+
+    async def _drop(self):
+        for ws in list(self._subs):
+            await ws.close()
+
+    # --- управление из теста (другой поток) ---
+
+    def reorg(self, depth):
+        asyncio.run_coroutine_threadsafe(self._reorg(depth), self._loop).result()
+
+    def drop(self):
+        asyncio.run_coroutine_threadsafe(self._drop(), self._loop).result()
+
+    def pause(self):
+        self._producing = False
+
+    def resume(self):
+        self._producing = True
+
+    def start(self, host="127.0.0.1", port=0):
+        # Запуск в фоне; возвращает ws-url.
+        ready = threading.Event()
+        box = {}
+
+        async def main():
+            self._loop = asyncio.get_running_loop()
+            async with websockets.serve(self._handler, host, port, max_size=None) as srv:
+                box["port"] = srv.sockets[0].getsockname()[1]
+                ready.set()
+                await self._produce()
+
+        threading.Thread(target=asyncio.run, args=(main(),), daemon=True).start()
+        ready.wait()
+        return f"ws://{host}:{box['port']}"
+
+
+def start(head, block_time=2.0, latency_ms=0, per_block=4):
+    # HTTP mock_rpc и WebSocket-узел над одной цепочкой. Возвращает (ws_node, http_url, ws_url).
+    from config import TOKEN_ADDRESS
+    chain = Chain(TOKEN_ADDRESS, head, max_per_block=per_block)
+    node = MockNode(chain, latency=latency_ms / 1000)
+    _, http_url = serve(node)
+    ws_node = WsNode(node, block_time)
+    return ws_node, http_url, ws_node.start()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8547)
+    ap.add_argument("--head", type=int, default=43_000_000)
+    ap.add_argument("--block-time", type=float, default=2)
+    args = ap.parse_args()
+    from config import TOKEN_ADDRESS
+    node = MockNode(Chain(TOKEN_ADDRESS, args.head))
+    _, http_url = serve(node)
+    ws_url = WsNode(node, args.block_time).start(port=args.port)
+    print(f"mock ws: {ws_url}  http: {http_url}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    import common  # noqa: F401  (корень репозитория в sys.path)
+    main()
@@ -0,0 +1,46 @@
+# Прежние sync-эндпоинты (def + блокирующий TokenClient) — точка отсчёта для load_test.py.
+#   RPC_URL=http://127.0.0.1:8545 uvicorn sync_app:app  (из каталога bench)
+from fastapi import FastAPI, HTTPException, Query
+
+import common  # noqa: F401  (sys.path)
+from config import DB_PATH, ERC20_ABI, RPC_URL, TOKEN_ADDRESS
+from ps_client import TokenIndexer
+from token_client import TokenClient
+
+app = FastAPI(title="sync baseline")
+cli = TokenClient(RPC_URL, TOKEN_ADDRESS, ERC20_ABI)
+
+
+@app.get("/health")
+def health():
+    try:
+        _ = cli.get_token_info()
+        return {"ok": True}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/get_balance")
+def get_balance(address: str = Query(...), human: str = Query(None)):
+    try:
+        return {"balance": cli.get_balance(address, str(human).lower() in ("1", "true"))}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/get_token_info")
+def get_token_info():
+    try:
+        return cli.get_token_info()
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/get_top")
+def get_top(n: int = Query(10, ge=1)):
+    # прежний get_indexer: TokenIndexer (соединение, PRAGMA, CREATE TABLE) на каждый запрос
+    idx = TokenIndexer(cli, DB_PATH)
+    try:
+        return {"top": [{"address": a, "balance": b} for a, b in idx.get_top(n)]}
+    finally:
+        idx.close()
@@ -0,0 +1,119 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+MISS = object()
+
+
+class BlockCache:
+    """LRU-кэш значений, привязанных к номеру блока.
+
+    Запись годится, пока голова цепочки ушла от её блока не дальше max_stale_blocks.
+    """
+
+    def __init__(self, max_size, max_stale_blocks=0):
+        self.max_size = max_size
+        self.max_stale_blocks = max_stale_blocks
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (block, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, head):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and head - entry[0] <= self.max_stale_blocks:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return MISS
+
+    def put(self, key, block, value):
+        with self._lock:
+            old = self._data.get(key)
+            if old is not None and old[0] > block:
+                return
+            self._data[key] = (block, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "max_stale_blocks": self.max_stale_blocks,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+        }
+
+
+class _TopSlot:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = None
+        self.rows = None  # JSON-фрагменты строк по возрастанию баланса
+        self.size = 0  # сколько строк запрашивали у compute
+        self.bodies = {}  # n -> (etag, JSON-массив)
+
+
+class TopCache:
+    """Топ держателей, привязанный к состоянию индекса.
+
+    На ключ (эндпоинт, токен) хранится самый длинный посчитанный топ, меньшие n — его срез.
+    Пока state (last_scanned_block, поколение индексатора) тот же, ответ — поиск в словаре;
+    сменился — топ пересчитывается один раз на всех ждущих.
+    """
+
+    MAX_BODIES = 64  # разных n на ключ
+
+    def __init__(self, max_n):
+        self.max_n = max_n
+        self.hits = 0
+        self.misses = 0
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, state, n, compute):
+        # compute(n) -> JSON-фрагменты строк топа-n по возрастанию баланса (bytes).
+        # -> (etag, JSON-массив топа-n)
+        if n > self.max_n:
+            self.misses += 1
+            return _top_body(compute(n))
+        with self._lock:
+            slot = self._slots.setdefault(key, _TopSlot())
+        with slot.lock:
+            if slot.state != state:
+                slot.state, slot.rows, slot.bodies = state, None, {}
+            out = slot.bodies.get(n)
+            if out is not None:
+                self.hits += 1
+                return out
+            self.misses += 1
+            if slot.rows is None or (n > len(slot.rows) and len(slot.rows) == slot.size):
+                # топ длиннее посчитанного; короче size — значит, держателей меньше
+                slot.size = max(n, slot.size)
+                slot.rows = compute(slot.size)
+            if len(slot.bodies) >= self.MAX_BODIES:
+                slot.bodies.clear()
+            out = slot.bodies[n] = _top_body(slot.rows[-n:])
+            return out
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "keys": len(self._slots),
+            "max_n": self.max_n,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+        }
+
+
+def _top_body(rows):
+    body = b"[" + b",".join(rows) + b"]"
+    # слабый: head_block и lag в ответе могут отличаться при том же топе
+    return f'W/"{hashlib.blake2b(body, digest_size=12).hexdigest()}"', body
@@ -1,14 +1,69 @@
+import os
+
 POLYGONSCAN_API_KEY = "ВАШ ETHERSCAN API КЛЮЧ"
 
 
-RPC_URL = "https://polygon-rpc.com"
-TOKEN_ADDRESS = "0x1a9b54a3075119f1546c52ca0940551a6ce5d2d0"
+RPC_URL = os.getenv("RPC_URL", "https://polygon-rpc.com")
+# пул узлов (RPC_URLS=https://a,https://b): запросы идут на самый здоровый, с переключением и хеджированием
+RPC_URLS = [u.strip() for u in os.getenv("RPC_URLS", RPC_URL).split(",") if u.strip()]
+TOKEN_ADDRESS = "0x1a9b54a3075119f1546c52ca0940551a6ce5d2d0"  # токен по умолчанию: запросы без token=
+# все индексируемые токены (TOKENS=0xa…,0xb…): один проход eth_getLogs на все адреса сразу
+TOKENS = list(dict.fromkeys(a.strip().lower() for a in [TOKEN_ADDRESS, *os.getenv("TOKENS", "").split(",")] if a.strip()))
 START_BLOCK = 42812490
 ZERO = "0x0000000000000000000000000000000000000000"
 BATCH_SIZE = 2000
 CONFIRMATIONS = 20
+REORG_DEPTH = 128  # блоков у головы, которые индексируются с журналом отката
+SNAPSHOT_INTERVAL = 10_000  # блоков между снимками holders для запросов at_block (~5,5 ч на Polygon), 0 — без снимков
+SNAPSHOT_KEEP = 48  # последних снимков на токен (~11 дней на Polygon) хранятся все, старше — прореженные; 0 — все
+SNAPSHOT_THIN = 8  # старше SNAPSHOT_KEEP — первый снимок из каждых SNAPSHOT_THIN интервалов (~44 ч на Polygon)
+WS_URL = os.getenv("WS_URL")  # wss://… — индекс по подписке eth_subscribe вместо опроса
+STREAM_SETTLE = 0.3  # сек ожидания логов самого свежего блока после его заголовка
+FOLLOW_CONFIRMATIONS = 0  # фоновый индекс идёт по самой голове, реорги откатываются журналом
+INDEX_INTERVAL = 5  # сек между проходами фонового индексатора
+BACKGROUND_INDEX = True
 POLYGON_CHAIN_ID = 137
-DB_PATH = "state.db"
+DB_PATH = os.getenv("DB_PATH", "state.db")
+# postgresql://… — токены, курсоры и holders в PostgreSQL (общие для реплик API), иначе в DB_PATH
+STORAGE_URL = os.getenv("STORAGE_URL")
+SQLITE_READ_POOL = 8  # read-only соединений в пуле индексатора
+SQLITE_CACHE_KB = 65_536  # page cache на соединение
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+SQLITE_BUSY_TIMEOUT_MS = 5000
+SQL_CHUNK = 500  # лимит параметров в одном IN (...)
+EXPORT_CHUNK = 10_000  # строк за один fetchmany при выгрузке /export/*
+BLOCK_TS_BATCH = 100  # заголовков блоков в одном JSON-RPC batch
+BACKFILL_SHARD = 50_000  # блоков в шарде backfill
+BACKFILL_WORKERS = 8
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"  # None — без multicall, через JSON-RPC batch
+BALANCE_BATCH_CHUNK = 500  # адресов в одном aggregate3 / batch-запросе
+BALANCE_BATCH_WORKERS = 4  # параллельных чанков
+HTTP_POOL_SIZE = 100  # соединений к RPC у async-клиента
+HTTP_TIMEOUT = 30
+RPC_MAX_INFLIGHT = 32  # одновременных запросов к одному узлу пула
+RPC_HEDGE = True  # медленный запрос дублируется на другой узел, берётся первый ответ
+RPC_HEDGE_MIN_DELAY = 0.05  # сек; дубль — не раньше p95 латентности узла по методу и не раньше этого
+RPC_HEDGE_MIN_SAMPLES = 20  # замеров метода на узле, после которых p95 считается
+RPC_LATENCY_WINDOW = 200  # последних замеров на (узел, метод) для p95
+RPC_MAX_FAILS = 3  # ошибок подряд, после которых узел выводится из пула на RPC_COOLDOWN
+RPC_COOLDOWN = 10  # сек
+RPC_HEAD_WAIT = 5  # сек: сколько переспрашивать головы, если запрошенный блок не видел ни один узел
+BALANCE_CACHE_SIZE = 100_000  # адресов в LRU-кэше balanceOf
+CACHE_MAX_STALE_BLOCKS = 0  # 0 — кэш balanceOf/totalSupply только в пределах того же блока
+TOP_CACHE_MAX_N = 10_000  # /get_top* с n больше — мимо кэша ответов
+ETHERSCAN_URL = os.getenv("ETHERSCAN_URL", "https://api.etherscan.io/v2/api")
+ETHERSCAN_RATE = 5  # запросов/сек на ключ (бесплатный тариф — 5)
+ETHERSCAN_RETRIES = 6  # повторов при ответе лимитом, с экспоненциальной паузой
+ETHERSCAN_WORKERS = 4  # диапазонов bootstrap, загружаемых параллельно
+BOOTSTRAP_SPAN = 200_000  # блоков в одном диапазоне bootstrap
+INDEX_MAX_LAG = CONFIRMATIONS + 10  # source=auto: насколько индекс может отставать от головы, блоков
+HEAD_TTL = 1.0  # сек, сколько считаем номер головы актуальным (блок Polygon ~2 с)
+# каталог локального архива Transfer-логов (archive.py): каждое окно индекса дописывается туда, из архива
+# rebuild строит БД заново без RPC
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR")
+ARCHIVE_SEGMENT = 100_000  # блоков в одном файле архива
+ARCHIVE_ZSTD_LEVEL = 3
+REBUILD_BATCH = 500_000  # переводов в одном применении rebuild (~1 ГБ памяти)
 
 
 ERC20_ABI = [
@@ -0,0 +1,113 @@
+# etherscan.py
+import random
+import threading
+import time
+
+import requests
+
+from config import ETHERSCAN_RATE, ETHERSCAN_RETRIES, ETHERSCAN_URL, POLYGON_CHAIN_ID
+
+
+class RateLimitError(Exception):
+    pass
+
+
+class RateLimiter:
+    """Token bucket: rate запросов/сек в среднем, не больше burst подряд; общий для всех потоков."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, int(rate)))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def drain(self):
+        # сервер уже ответил лимитом — остальные потоки тоже должны притормозить
+        with self._lock:
+            self.tokens = min(self.tokens, 0.0)
+            self.updated = time.monotonic()
+
+
+def _is_rate_limited(resp, payload):
+    if resp.status_code == 429:
+        return True
+    if isinstance(payload, dict) and str(payload.get("status")) == "0":
+        text = f"{payload.get('message')} {payload.get('result')}".lower()
+        return "rate limit" in text or "max calls per sec" in text
+    return False
+
+
+class EtherscanClient:
+    """tokentx-запросы к Etherscan v2 с ограничением частоты и повтором при ответе лимитом."""
+
+    def __init__(self, api_key, base_url=ETHERSCAN_URL, rate=ETHERSCAN_RATE,
+                 retries=ETHERSCAN_RETRIES, chain_id=POLYGON_CHAIN_ID):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.chain_id = chain_id
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.calls = 0
+        self.throttled = 0
+        self._local = threading.local()
+
+    def _session(self):
+        # requests.Session не потокобезопасна — по сессии на поток
+        sess = getattr(self._local, "sess", None)
+        if sess is None:
+            sess = self._local.sess = requests.Session()
+        return sess
+
+    def get(self, params):
+        params = {**params, "chainid": self.chain_id, "apikey": self.api_key}
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire()
+            self.calls += 1
+            resp = self._session().get(self.base_url, params=params, timeout=30)
+            payload = resp.json() if resp.status_code == 200 else None
+            if not _is_rate_limited(resp, payload):
+                resp.raise_for_status()
+                return payload
+            self.throttled += 1
+            self.limiter.drain()
+            retry_after = resp.headers.get("Retry-After")
+            delay = float(retry_after) if retry_after else min(30.0, 0.5 * 2 ** attempt)
+            time.sleep(delay * random.uniform(1.0, 1.25))
+        raise RateLimitError(f"Etherscan: лимит запросов, {self.retries} повторов не помогли")
+
+    def tokentx(self, contract, start_block, end_block, page, offset):
+        # пустой список, если транзакций нет
+        payload = self.get({
+            "module": "account",
+            "action": "tokentx",
+            "contractaddress": contract,
+            "startblock": start_block,
+            "endblock": end_block,
+            "sort": "asc",
+            "page": page,
+            "offset": offset,
+        })
+        status = payload.get("status")
+        message = payload.get("message")
+        result = payload.get("result")
+        if isinstance(result, dict):
+            rows = result.get("transactions") or result.get("events") or result.get("records") or []
+        else:
+            rows = result if isinstance(result, list) else []
+        if status not in ("1", 1) and not rows and not (message or "").lower().startswith("no"):
+            # неверный ключ/параметры: молча закончить нельзя — last_scanned_block уйдёт вперёд
+            raise RuntimeError(f"Etherscan: {message}: {result}")
+        return rows
@@ -0,0 +1,219 @@
+# export.py
+# Потоковая выгрузка индекса: holders и история переводов в NDJSON, CSV или Parquet.
+# Строки читаются из SQLite чанками по EXPORT_CHUNK — в памяти не больше одного чанка,
+# балансы — точными десятичными строками, без float.
+#   python export.py holders --format csv --min-balance 1000 -o holders.csv
+#   python export.py transfers --from-block 42812490 --to-block 43000000 > transfers.ndjson
+import argparse
+import csv
+import io
+import json
+import sys
+from contextlib import nullcontext
+from decimal import Decimal, InvalidOperation, localcontext
+
+from config import *
+from ps_client import _connect, _eip55, _from_u256
+from storage import open_storage
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+HOLDER_COLUMNS = [("address", "str"), ("balance", "str"), ("balance_raw", "str"),
+                  ("last_tx_block", "int"), ("last_tx_ts", "int")]
+TRANSFER_COLUMNS = [("block_number", "int"), ("log_index", "int"), ("ts", "int"), ("tx_hash", "str"),
+                    ("from", "str"), ("to", "str"), ("value", "str"), ("value_raw", "str")]
+
+
+def decimal_str(raw, decimals):
+    # 1234500 при decimals=6 -> "1.2345"
+    if not decimals:
+        return str(raw)
+    s = str(raw).rjust(decimals + 1, "0")
+    whole, frac = s[:-decimals], s[-decimals:].rstrip("0")
+    return f"{whole}.{frac}" if frac else whole
+
+
+def parse_amount(value, decimals):
+    # "1000.5" в единицах токена -> сырое целое; uint256 — до 78 знаков, точности Decimal по умолчанию мало
+    try:
+        with localcontext() as ctx:
+            ctx.prec = 100
+            raw = int(Decimal(str(value)).scaleb(decimals))
+    except InvalidOperation:
+        raise ValueError(f"Некорректная сумма: {value}")
+    if not 0 <= raw < 2 ** 256:
+        raise ValueError(f"Некорректная сумма: {value}")
+    return raw
+
+
+def _chunks(conn, sql, params, chunk):
+    cur = conn.execute(sql, params)
+    try:
+        while True:
+            rows = cur.fetchmany(chunk)
+            if not rows:
+                return
+            yield rows
+    finally:
+        cur.close()  # недочитанный курсор держит транзакцию чтения, а с ней и чекпойнт WAL
+
+
+def holder_chunks(storage, token_id, decimals, min_balance=None, max_balance=None, chunk=EXPORT_CHUNK):
+    # Фильтры — в запросе хранилища: диапазон по индексу балансов.
+    # Checksum — без lru_cache из ps_client: выгрузка миллионов адресов только вытеснит его.
+    min_raw = parse_amount(min_balance, decimals) if min_balance is not None else None
+    max_raw = parse_amount(max_balance, decimals) if max_balance is not None else None
+    for rows in storage.holder_chunks(token_id, min_raw, max_raw, chunk):
+        yield [(_eip55(addr), decimal_str(raw, decimals), str(raw), blk, ts) for addr, raw, blk, ts in rows]
+
+
+def transfer_chunks(conn, token_id, decimals, from_block=None, to_block=None, chunk=EXPORT_CHUNK):
+    # диапазон блоков — по PK transfers; переводы, записанные до схемы v6, — без from/to/value
+    where, params = ["t.token_id = ?"], [token_id]
+    if from_block is not None:
+        where.append("t.block_number >= ?")
+        params.append(from_block)
+    if to_block is not None:
+        where.append("t.block_number <= ?")
+        params.append(to_block)
+    sql = ("SELECT t.block_number, t.log_index, b.ts, t.tx_hash, fa.address, ta.address, t.value "
+           "FROM transfers t LEFT JOIN blocks b ON b.number = t.block_number "
+           "LEFT JOIN addresses fa ON fa.id = t.from_id LEFT JOIN addresses ta ON ta.id = t.to_id")
+    sql += " WHERE " + " AND ".join(where) + " ORDER BY t.block_number, t.log_index"
+    for rows in _chunks(conn, sql, params, chunk):
+        out = []
+        for blk, li, ts, txh, frm, to, val in rows:
+            raw = _from_u256(val) if val is not None else None
+            out.append((blk, li, ts, "0x" + txh.hex(), frm and _eip55(frm), to and _eip55(to),
+                        None if raw is None else decimal_str(raw, decimals), None if raw is None else str(raw)))
+        yield out
+
+
+def _ndjson(columns, chunks):
+    names = [c for c, _ in columns]
+    for rows in chunks:
+        yield "".join(json.dumps(dict(zip(names, r))) + "\n" for r in rows).encode()
+
+
+def _csv(columns, chunks):
+    buf = io.StringIO()
+    w = csv.writer(buf, lineterminator="\n")
+    w.writerow([c for c, _ in columns])
+    for rows in chunks:
+        w.writerows(rows)
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+
+class _Drain:
+    # файл для ParquetWriter: всё записанное отдаётся наружу после каждой группы строк
+    def __init__(self):
+        self.parts = []
+        self.pos = 0
+        self.closed = False
+
+    def write(self, b):
+        self.parts.append(bytes(b))
+        self.pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        out, self.parts = b"".join(self.parts), []
+        return out
+
+
+def _parquet(columns, chunks):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    # uint256 не влезает в decimal128/256 (до 76 знаков) — балансы строками, как и в CSV
+    schema = pa.schema([(c, pa.string() if t == "str" else pa.int64()) for c, t in columns])
+    sink = _Drain()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for rows in chunks:
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array([r[i] for r in rows], type=schema.field(i).type) for i in range(len(columns))],
+                schema=schema))  # группа строк на чанк
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+WRITERS = {"ndjson": _ndjson, "csv": _csv, "parquet": _parquet}
+
+
+def check_format(fmt):
+    if fmt not in WRITERS:
+        raise ValueError(f"неизвестный формат: {fmt}")
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise RuntimeError("для parquet нужен pyarrow: pip install pyarrow")
+
+
+def stream(fmt, columns, chunks):
+    # -> генератор кусков bytes
+    check_format(fmt)
+    return WRITERS[fmt](columns, chunks)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Выгрузка индекса держателей")
+    ap.add_argument("table", choices=["holders", "transfers"])
+    ap.add_argument("--format", choices=list(WRITERS), default="ndjson")
+    ap.add_argument("-o", "--output", help="файл; по умолчанию stdout")
+    ap.add_argument("--db", default=DB_PATH)
+    ap.add_argument("--storage", default=STORAGE_URL, help="postgresql://… — holders из PostgreSQL")
+    ap.add_argument("--token", default=TOKEN_ADDRESS, help="адрес токена; по умолчанию TOKEN_ADDRESS")
+    ap.add_argument("--decimals", type=int, help="decimals токена; по умолчанию — из индекса")
+    ap.add_argument("--min-balance", help="holders: не меньше, в единицах токена")
+    ap.add_argument("--max-balance", help="holders: не больше, в единицах токена")
+    ap.add_argument("--from-block", type=int)
+    ap.add_argument("--to-block", type=int)
+    args = ap.parse_args()
+
+    check_format(args.format)
+    conn = _connect(args.db, readonly=True)
+    storage = open_storage(args.storage, conn, lambda: nullcontext(conn))
+    row = storage.token(args.token.lower())
+    if row is None:
+        sys.exit(f"токен {args.token} не индексируется")
+    token_id, decimals = row[0], row[1] if args.decimals is None else args.decimals
+    if args.table == "holders":
+        columns = HOLDER_COLUMNS
+        chunks = holder_chunks(storage, token_id, decimals, args.min_balance, args.max_balance)
+    else:
+        columns = TRANSFER_COLUMNS
+        chunks = transfer_chunks(conn, token_id, decimals, args.from_block, args.to_block)
+
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for part in stream(args.format, columns, chunks):
+            out.write(part)
+    finally:
+        if args.output:
+            out.close()
+        storage.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
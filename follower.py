@@ -0,0 +1,182 @@
+import asyncio
+import json
+import threading
+import time
+
+import websockets
+
+from config import *
+from storage import NotWriter
+
+
+class IndexFollower:
+    """Фоновый поток: раз в interval секунд догоняет голову цепочки через index_transfers.
+
+    Пишет через общий TokenIndexer процесса, то есть его соединение-писатель.
+    """
+
+    def __init__(self, indexer, interval=INDEX_INTERVAL, start_block=START_BLOCK,
+                 confirmations=FOLLOW_CONFIRMATIONS):
+        self.indexer = indexer
+        self.interval = interval
+        self.start_block = start_block
+        self.confirmations = confirmations
+
+        self.last_block = None
+        self.head = None
+        self.last_error = None
+        self.last_run_at = None
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="index-follower", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _on_progress(self, last_block, head):
+        self.last_block, self.head = last_block, head
+
+    def _run(self):
+        idx = self.indexer
+        idx.on_progress = self._on_progress
+        while not self._stop.is_set():
+            try:
+                idx.index_transfers(start_block=self.start_block, confirmations=self.confirmations)
+                self.last_error = None
+            except NotWriter as e:
+                # хранилище ведёт другая реплика; запись подхватим, когда она отпустит блокировку
+                self.last_error = str(e)
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[follower] ошибка индексации: {e}")
+            self.last_run_at = time.time()
+            self._stop.wait(self.interval)
+
+
+class StreamFollower(IndexFollower):
+    """Потоковый режим: подписки eth_subscribe newHeads + logs(токен, Transfer) по WebSocket.
+
+    Блок применяется, как только пришёл его заголовок (и через settle секунд — его логи);
+    после (пере)подключения пропущенное догоняется через index_transfers/get_logs.
+    """
+
+    def __init__(self, indexer, ws_url, start_block=START_BLOCK, confirmations=FOLLOW_CONFIRMATIONS,
+                 settle=STREAM_SETTLE):
+        super().__init__(indexer, start_block=start_block, confirmations=confirmations)
+        self.ws_url = ws_url
+        self.settle = settle
+        self.reconnects = 0
+        self._heads = {}  # номер -> (заголовок, когда пришёл)
+        self._logs = {}   # blockHash -> {logIndex: лог}
+
+    def _run(self):
+        self.indexer.on_progress = self._on_progress
+        asyncio.run(self._main())
+
+    async def _main(self):
+        delay = 1
+        while not self._stop.is_set():
+            try:
+                await self._session()
+                delay = 1
+            except NotWriter as e:
+                self.last_error = str(e)
+                await asyncio.sleep(self.interval)
+                continue
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[stream] соединение потеряно: {e}")
+            if self._stop.is_set():
+                break
+            self.reconnects += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    async def _session(self):
+        idx = self.indexer
+        async with websockets.connect(self.ws_url, max_size=None, max_queue=None) as ws:
+            await self._subscribe(ws, 1, ["newHeads"])
+            await self._subscribe(ws, 2, ["logs", {"address": list(idx.tokens),
+                                                   "topics": [idx.transfer_sig]}])
+            # подписки уже идут — всё, что придёт во время догонки, копится в буфере
+            catch_up = asyncio.get_running_loop().run_in_executor(None, self._catch_up)
+            while not self._stop.is_set():
+                try:
+                    msg = await asyncio.wait_for(ws.recv(), timeout=self.settle or 0.5)
+                    self._on_message(json.loads(msg))
+                except asyncio.TimeoutError:
+                    pass
+                if catch_up is not None:
+                    if not catch_up.done():
+                        continue
+                    catch_up.result()  # ошибка догонки — переподключение
+                    catch_up = None
+                await self._flush()
+
+    async def _subscribe(self, ws, req_id, params):
+        await ws.send(json.dumps({"jsonrpc": "2.0", "id": req_id, "method": "eth_subscribe", "params": params}))
+        while True:
+            msg = json.loads(await ws.recv())
+            if msg.get("id") == req_id:
+                if "error" in msg:
+                    raise RuntimeError(f"eth_subscribe {params[0]}: {msg['error']}")
+                return msg["result"]
+            self._on_message(msg)
+
+    def _on_message(self, msg):
+        if msg.get("method") != "eth_subscription":
+            return
+        item = msg["params"]["result"]
+        if "logIndex" in item:
+            logs = self._logs.setdefault(item["blockHash"], {})
+            if item.get("removed"):
+                logs.pop(item["logIndex"], None)
+            else:
+                logs[item["logIndex"]] = item
+        else:
+            n = int(item["number"], 16)
+            self._heads[n] = (item, time.monotonic())
+            self.head = max(self.head or 0, n)
+
+    def _catch_up(self):
+        self.indexer.index_transfers(start_block=self.start_block, confirmations=self.confirmations)
+        self.last_error = None
+        self.last_run_at = time.time()
+
+    async def _flush(self):
+        # Готовые блоки — по порядку номеров: не ближе confirmations к голове, а самый свежий —
+        # не раньше settle секунд после заголовка (логи блока идут отдельными сообщениями).
+        # Догонка ходит в RPC и пишет окнами — в пуле потоков, чтобы цикл событий продолжал
+        # читать WebSocket.
+        if not self._heads:
+            return
+        head = max(self._heads)
+        now = time.monotonic()
+        for n in sorted(self._heads):
+            header, arrived = self._heads[n]
+            if n > head - self.confirmations or (n == head and now - arrived < self.settle):
+                break
+            del self._heads[n]
+            if self.last_block is not None and n <= self.last_block:
+                continue  # уже записан догонкой
+            logs = self._logs.pop(header["hash"], {}).values()
+            if not self.indexer.apply_block(header, list(logs)):
+                await asyncio.get_running_loop().run_in_executor(None, self._catch_up)
+            self.last_run_at = time.time()
+        last = self.last_block or 0
+        self._heads = {n: h for n, h in self._heads.items() if n > last}
+        self._logs = {h: logs for h, logs in self._logs.items()
+                      if any(int(lg["blockNumber"], 16) > last for lg in logs.values())}
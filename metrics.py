@@ -0,0 +1,199 @@
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Метрики в текстовом формате Prometheus (GET /metrics) без prometheus_client: счётчики,
+# гистограммы и gauge с метками, общий реестр на процесс. Плюс профиль одного прогона
+# индекса: время по этапам (stage) складывается в активный profile().
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+_registry = []
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}  # значения меток -> значение
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[k]) for k in self.labels)
+
+    def _series(self, suffix, key, value, extra=()):
+        pairs = [*zip(self.labels, key), *extra]
+        lbl = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+        return f"{self.name}{suffix}{{{lbl}}} {_num(value)}" if lbl else f"{self.name}{suffix} {_num(value)}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, v in items:
+            lines.extend(self._lines(key, v))
+        return lines
+
+    def _lines(self, key, v):
+        return [self._series("", key, v)]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            h = self._values.get(key)
+            if h is None:
+                h = self._values[key] = [[0] * len(self.buckets), 0.0, 0]  # по корзинам, сумма, число
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    h[0][i] += 1
+                    break
+            h[1] += value
+            h[2] += 1
+
+    def _lines(self, key, v):
+        counts, total, n = v
+        out, acc = [], 0
+        for b, c in zip(self.buckets, counts):
+            acc += c
+            out.append(self._series("_bucket", key, acc, [("le", _num(b))]))
+        out.append(self._series("_bucket", key, n, [("le", "+Inf")]))
+        out.append(self._series("_sum", key, total))
+        out.append(self._series("_count", key, n))
+        return out
+
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _num(v):
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def render():
+    return "\n".join(line for m in _registry for line in m.render()) + "\n"
+
+
+RPC_REQUESTS = Counter("rpc_requests_total", "JSON-RPC запросы к узлу по методу и исходу (ok, error, exception)",
+                       ("method", "outcome"))
+RPC_SECONDS = Histogram("rpc_request_seconds", "Длительность JSON-RPC запроса; batch — method=batch", ("method",))
+RPC_ENDPOINT_REQUESTS = Counter("rpc_endpoint_requests_total", "Попытки по узлам пула: ok или error (обрыв, лимит)",
+                                ("endpoint", "outcome"))
+RPC_ENDPOINT_LATENCY = Gauge("rpc_endpoint_latency_seconds", "EWMA латентности узла", ("endpoint",))
+RPC_ENDPOINT_ERROR_RATE = Gauge("rpc_endpoint_error_rate", "EWMA доли неудачных попыток узла", ("endpoint",))
+RPC_HEDGES = Counter("rpc_hedged_requests_total", "Дубли медленных запросов: fired — отправлен, won — ответил первым",
+                     ("result",))
+RPC_FAILOVERS = Counter("rpc_failovers_total", "Повторы запроса на другом узле после ошибки")
+GET_LOGS_BLOCKS = Histogram("index_get_logs_window_blocks", "Размер окна eth_getLogs, с которым узел ответил",
+                            buckets=(1, 10, 50, 100, 250, 500, 1000, 2000, 5000, 10000))
+GET_LOGS_HALVINGS = Counter("index_get_logs_halvings_total", "Сколько раз окно eth_getLogs делилось пополам")
+EVENTS_APPLIED = Counter("index_events_applied_total", "Применённые к holders Transfer-ы", ("token",))
+BLOCK_TIMES = Counter("index_block_time_lookups_total", "Откуда взято время блока: memory, db, rpc", ("source",))
+TX_SECONDS = Histogram("sqlite_transaction_seconds", "Транзакция писателя: от начала до конца коммита")
+COMMIT_SECONDS = Histogram("sqlite_commit_seconds", "Коммит писателя (хранилище состояния + SQLite)")
+STAGE_SECONDS = Histogram("index_stage_seconds", "Время этапов индексации", ("stage",))
+LAST_BLOCK = Gauge("index_last_scanned_block", "Курсор индекса токена", ("token",))
+HEAD_BLOCK = Gauge("index_head_block", "Последняя виденная индексатором голова цепочки")
+LAG = Gauge("index_lag_blocks", "head_block - last_scanned_block", ("token",))
+HTTP_REQUESTS = Counter("http_requests_total", "Запросы к API по маршруту и коду ответа", ("route", "status"))
+HTTP_SECONDS = Histogram("http_request_seconds", "Время ответа API по маршруту", ("route",))
+
+
+class Profile:
+    """Время по этапам одного прогона: {stage: [секунды, вызовы]}.
+
+    Этапы воркеров backfill идут параллельно, поэтому их сумма может быть больше wall.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.wall = None
+        self._lock = threading.Lock()
+
+    def add(self, name, dt):
+        with self._lock:
+            s = self.stages.setdefault(name, [0.0, 0])
+            s[0] += dt
+            s[1] += 1
+
+    def report(self):
+        out = {name: {"seconds": round(s, 4), "calls": n}
+               for name, (s, n) in sorted(self.stages.items(), key=lambda kv: -kv[1][0])}
+        return {"wall_seconds": round(self.wall or 0, 4), "stages": out}
+
+    def format(self):
+        lines = [f"[profile] wall {self.wall or 0:.3f}s"]
+        for name, r in self.report()["stages"].items():
+            share = 100 * r["seconds"] / self.wall if self.wall else 0
+            lines.append(f"[profile] {name:14s} {r['seconds']:9.3f}s {share:5.1f}%  calls={r['calls']}")
+        return "\n".join(lines)
+
+
+_profile = None
+
+
+@contextmanager
+def profile():
+    # with profile() as p: idx.index_transfers(...); print(p.format())
+    global _profile
+    p = _profile = Profile()
+    t0 = time.perf_counter()
+    try:
+        yield p
+    finally:
+        p.wall = time.perf_counter() - t0
+        _profile = None
+
+
+@contextmanager
+def stage(name):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        dt = time.perf_counter() - t0
+        STAGE_SECONDS.observe(dt, stage=name)
+        p = _profile
+        if p is not None:
+            p.add(name, dt)
+
+
+def timed(name):
+    # декоратор: весь вызов функции — этап name
+    def wrap(fn):
+        @wraps(fn)
+        def wrapped(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapped
+    return wrap
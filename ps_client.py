@@ -1,302 +1,1492 @@
 from web3 import Web3
+from eth_hash.auto import keccak
 import sqlite3
+import threading
+import queue
 from config import *
 import time
+from contextlib import contextmanager
 from datetime import datetime, timezone
-import requests
+from pathlib import Path
 from web3.exceptions import Web3RPCError
+from functools import lru_cache, wraps
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from etherscan import EtherscanClient
+from storage import ZERO_U256, NotWriter, SQLiteStorage, _from_u256, _u256, open_storage
+
+
+SCHEMA_VERSION = 9
+
+
+# EIP-55 без посимвольного цикла: буква a-f становится заглавной (-0x20 в ASCII), если
+# соответствующий полубайт keccak >= 8. Обе маски — bytes.translate, вычитание — одним int.
+_NIBBLE_HI = bytes(0x20 if chr(i) in "89abcdef" else 0 for i in range(256))
+_HEX_LETTER = bytes(0xFF if chr(i) in "abcdef" else 0 for i in range(256))
+
+
+def _eip55(addr):
+    # 0x… в нижнем регистре -> EIP-55; Web3.to_checksum_address с его проверками в ~3 раза медленнее,
+    # а на выгрузке holders checksum — основная работа (keccak сам по себе ~10 мкс)
+    body = addr[2:].encode()
+    upper = (int.from_bytes(keccak(body).hex()[:40].encode().translate(_NIBBLE_HI), "big")
+             & int.from_bytes(body.translate(_HEX_LETTER), "big"))
+    return "0x" + (int.from_bytes(body, "big") - upper).to_bytes(40, "big").decode()
+
+
+# Адреса в БД — в нижнем регистре; EIP-55 (keccak) считается только на выдаче, с памятью.
+@lru_cache(maxsize=1 << 20)
+def _checksum(addr):
+    return _eip55(addr)
+
+
+def _raw_transfer(lg, ts):
+    # Лог Transfer в JSON-виде узла (hex-строки: eth_getLogs без форматтеров web3, подписка)
+    # -> кортеж перевода. from/to — последние 20 байт topics[1..2], value — data.
+    topics = lg["topics"]
+    if len(topics) != 3:
+        return None  # не ERC-20 Transfer (например, ERC-721 с indexed tokenId)
+    return (
+        "0x" + topics[1][-40:].lower(),
+        "0x" + topics[2][-40:].lower(),
+        int(lg["data"], 16),
+        int(lg["blockNumber"], 16),
+        ts,
+        lg["transactionHash"],
+        int(lg["logIndex"], 16),
+    )
+
+
+def _rpc_error_code(e):
+    resp = getattr(e, "rpc_response", None) or {}
+    return (resp.get("error") or {}).get("code")
+
+
+def _pick(d, keys, default=None):
+    for k in keys:
+        if k in d and d[k] not in (None, "", "null"):
+            return d[k]
+    return default
+
+
+# У строк tokentx обычно нет logIndex. Такой перевод получает log_index из этого диапазона:
+# SCAN_LOG_INDEX | transactionIndex << 16 | номер перевода токена в транзакции (по порядку
+# ответа). С настоящими logIndex он не пересекается, а тот же перевод из eth_getLogs
+# _apply_transfers узнаёт по транзакции, from, to и value.
+SCAN_LOG_INDEX = 1 << 31
+
+
+def _etherscan_transfer(it):
+    # строка tokentx -> (from, to, value, block, ts, tx_hash, log_index) или None; без logIndex —
+    # log_index первого перевода своей транзакции, номер в ней добавляет _number_scan_rows
+    try:
+        blk = int(_pick(it, ["blockNumber", "block_number", "block_num"]))
+
+        txh = _pick(it, ["hash", "tx_hash", "transactionHash"])
+        if txh and not str(txh).startswith("0x"):
+            txh = "0x" + str(txh).lower()
+
+        li_val = _pick(it, ["logIndex", "log_index", "logindex"])
+        if li_val is None:
+            li = SCAN_LOG_INDEX | int(_pick(it, ["transactionIndex", "transaction_index"], 0)) << 16
+        else:
+            li = int(li_val)
+
+        from_a = _pick(it, ["from", "from_address"])
+        to_a = _pick(it, ["to", "to_address"])
+        val = int(_pick(it, ["value", "token_value", "amount", "raw_amount"], "0"))
+        ts = int(_pick(it, ["timeStamp", "timestamp", "block_timestamp"], "0"))
+    except Exception as e:
+        print(f"[bootstrap] skip item due to: {e}")
+        return None
+    if not (txh and from_a and to_a):
+        return None
+    return from_a, to_a, val, blk, ts, txh, li
+
+
+def _number_scan_rows(transfers):
+    # переводы одной транзакции без logIndex (пакетная рассылка, своп через роутер) различаются
+    # номером в ней; transfers — без повторов строк
+    n = {}
+    out = []
+    for t in transfers:
+        if t[6] >= SCAN_LOG_INDEX:
+            i = n.get((t[3], t[6]), 0)
+            n[t[3], t[6]] = i + 1
+            t = (*t[:6], t[6] + i)
+        out.append(t)
+    return out
+
+
+def _connect(db_path, readonly=False):
+    # Соединения живут всё время процесса и ходят между потоками: писатель — под write_lock,
+    # читатели — по одному потоку за раз через пул.
+    if readonly:
+        conn = sqlite3.connect(Path(db_path).resolve().as_uri() + "?mode=ro", uri=True,
+                               check_same_thread=False)
+    else:
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")  # в WAL не теряет целостность, только последний коммит при сбое ОС
+    conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS};")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB};")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE};")
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    return conn
+
+
+def _writes(fn):
+    # все записи — через одно соединение-писатель, по одной операции за раз и только у
+    # писателя хранилища; при ошибке незакоммиченная часть окна откатывается и в SQLite,
+    # и в хранилище состояния
+    @wraps(fn)
+    def wrapped(self, *args, **kwargs):
+        with self.write_lock:
+            if not self.storage.claim_writer():
+                raise NotWriter("состояние в хранилище ведёт другой индексатор")
+            self._tx_start = time.perf_counter()
+            try:
+                return fn(self, *args, **kwargs)
+            except BaseException:
+                self._abort()
+                raise
+    return wrapped
 
 
 class TokenIndexer:
-    def __init__(self, client, db_path):
+    """Индекс держателей токенов в SQLite.
+
+    Один экземпляр на процесс: записи (index_transfers, backfill, bootstrap) идут через одно
+    соединение-писатель под write_lock, чтения (top, балансы, статус) — через пул read-only
+    соединений и не ждут писателя.
+
+    Токен клиента — токен по умолчанию; tokens — ещё адреса, которые индексируются тем же
+    проходом в общие таблицы (token_id). У каждого токена свой курсор (tokens.last_block).
+
+    Токены, курсоры и holders — в self.storage (storage.py): по умолчанию в этой же БД,
+    с storage_url=postgresql://… — в PostgreSQL, общем для реплик API.
+    """
+
+    def __init__(self, client, db_path, read_pool=SQLITE_READ_POOL, tokens=(), storage_url=None, archive=None,
+                 known_tokens=None):
         self.client = client
         self.w3 = client.w3
         self.token = client.contract
         self.token_addr = client.address
-        self.decimals = client.decimals
-        self.symbol = client.symbol
 
-        self.conn = sqlite3.connect(db_path)
-        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.db_path = db_path
+        self.write_lock = threading.RLock()
+        self._tx_start = time.perf_counter()  # начало текущей транзакции писателя (sqlite_transaction_seconds)
+        # +1 на каждый коммит нового диапазона блоков или отката: вместе с last_scanned_block — ключ
+        # кэша ответов API (после реорга курсор может вернуться на тот же блок с другими holders)
+        self.generation = 0
+        self._advanced = False
+        self._snapshots_due = []  # [(block, token_id)] — снимаются после коммита окна
+        # archive.LogArchive: применённые переводы окна и сдвинутые курсоры дописываются туда при коммите
+        self.archive = None
+        self._archived = []  # [(токен, from, to, value, block, ts, tx_hash, log_index)]
+        self._archive_cursor = None  # (block, [токены])
+        self._known_tokens = known_tokens or {}  # адрес -> (decimals, symbol) без RPC (rebuild из архива)
+        self.conn = _connect(db_path)
         self._create_tables()
+        self._readers = queue.LifoQueue()
+        self._read_slots = threading.BoundedSemaphore(read_pool)
+        self.storage = open_storage(storage_url, self.conn, self._reader)
+        if not isinstance(self.storage, SQLiteStorage) and self.conn.execute(
+                "SELECT 1 FROM tokens WHERE last_block IS NOT NULL").fetchone():
+            # история и переводы этой БД согласованы с её holders, а не с внешним хранилищем
+            raise RuntimeError(f"{db_path} уже ведёт индекс с состоянием в SQLite: для storage_url нужна новая БД")
+        self.tokens = self._register_tokens([self.token_addr, *tokens])  # адрес -> (id, decimals, symbol)
+        self.token_id, self.decimals, self.symbol = self.tokens[self.token_addr.lower()]
+        self._token_ids = [t[0] for t in self.tokens.values()]
+        self._token_by_addr = {a: t[0] for a, t in self.tokens.items()}
+        self._addr_by_token = {t: a for a, t in self._token_by_addr.items()}
+        if archive is not None:
+            archive.set_tokens({a: t[1:] for a, t in self.tokens.items()})
+            last = self._get_last_block()
+            if last is not None:
+                archive.truncate(last)  # кадры окна, записанные перед сбоем до коммита
+            self.archive = archive
 
-        self.transfer_event = self.token.events.Transfer()
-        self.transfer_sig = self.w3.keccak(text="Transfer(address,address,uint256)")
+        self.transfer_sig = self.w3.keccak(text="Transfer(address,address,uint256)").to_0x_hex()
         self._block_ts_cache = {}
+        self._worker = threading.local()  # состояние воркеров backfill (окно get_logs)
+        self.on_progress = None  # callable(last_scanned_block, head) после каждого коммита окна
 
 
     def _create_tables(self):
+        self._migrate()
         cur = self.conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        self._create_block_tables(cur)
+        self._create_state_tables(cur)
+        self._create_history_tables(cur)
+        self._create_transfer_tables(cur)
+        self._set_meta("schema_version", SCHEMA_VERSION)
+        self.conn.commit()
+
+    @staticmethod
+    def _create_block_tables(cur):
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS blocks (
+                number INTEGER PRIMARY KEY,
+                ts INTEGER NOT NULL,
+                hash TEXT,            -- только у блоков, проиндексированных ближе REORG_DEPTH к голове
+                parent_hash TEXT
+            );
+        """)
+
+    def _create_state_tables(self, cur):
+        # Токены и их текущее состояние. Блоки, meta и словарь addresses — общие для всех токенов.
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS tokens (
+                id INTEGER PRIMARY KEY,
+                address TEXT NOT NULL UNIQUE,    -- 0x… в нижнем регистре
+                symbol TEXT,
+                decimals INTEGER NOT NULL,
+                last_block INTEGER               -- переводы токена применены по этот блок; NULL — ещё нет
+            );
+        """)
         cur.execute("""
             CREATE TABLE IF NOT EXISTS holders (
-                address TEXT PRIMARY KEY,
-                balance TEXT NOT NULL,
+                token_id INTEGER NOT NULL,
+                address TEXT NOT NULL,       -- 0x… в нижнем регистре
+                balance BLOB NOT NULL,       -- uint256, 32 байта big-endian
                 last_tx_block INTEGER,
-                last_tx_ts INTEGER
+                last_tx_ts INTEGER,
+                PRIMARY KEY (token_id, address)
             );
         """)
+        cur.execute("CREATE INDEX IF NOT EXISTS holders_balance_idx ON holders(token_id, balance);")
         cur.execute("""
-            CREATE TABLE IF NOT EXISTS meta (
-                key TEXT PRIMARY KEY,
-                value TEXT
+            CREATE TABLE IF NOT EXISTS holder_stats (
+                token_id INTEGER NOT NULL,     -- ненулевые балансы holders по десятичному порядку:
+                bucket INTEGER NOT NULL,       -- 10**bucket <= balance < 10**(bucket+1)
+                holders INTEGER NOT NULL,
+                balance BLOB NOT NULL,         -- сумма, uint256
+                PRIMARY KEY (token_id, bucket)
             );
         """)
         cur.execute("""
-            CREATE TABLE IF NOT EXISTS events (
-                event_id TEXT PRIMARY KEY,   -- f"{txHash}:{logIndex}"
-                block_number INTEGER,
-                tx_hash TEXT,
-                log_index INTEGER,
-                ts INTEGER
+            CREATE TABLE IF NOT EXISTS backfill_shards (
+                token_id INTEGER NOT NULL,         -- пройденные и записанные шарды backfill
+                start_block INTEGER NOT NULL,
+                end_block INTEGER NOT NULL,
+                PRIMARY KEY (token_id, start_block)
+            );
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS journal (
+                block_number INTEGER NOT NULL,   -- журнал отката: состояние адреса до этого блока
+                token_id INTEGER NOT NULL,
+                address TEXT NOT NULL,
+                balance BLOB,                    -- NULL — адреса в holders не было
+                last_tx_block INTEGER,
+                last_tx_ts INTEGER,
+                PRIMARY KEY (block_number, token_id, address)
             );
         """)
-        self.conn.commit()
 
-    def _get_last_block(self):
-        row = self.conn.execute("SELECT value FROM meta WHERE key='last_scanned_block'").fetchone()
-        return int(row[0]) if row else None
+    def _create_transfer_tables(self, cur):
+        # Переводы целиком: адреса — id из словаря addresses, value и tx_hash — BLOB.
+        # PK (token_id, block_number, log_index) — и порядок, и защита от повторного применения
+        # (_drop_applied); у строк Etherscan без logIndex log_index из диапазона SCAN_LOG_INDEX
+        # и с чужими токенами не сравнивается. Индексы по from_id/to_id несут PK, поэтому выборка
+        # по адресу и диапазону блоков с keyset-пагинацией идёт только по индексу.
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS addresses (
+                id INTEGER PRIMARY KEY,
+                address TEXT NOT NULL UNIQUE     -- 0x… в нижнем регистре
+            );
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS transfers (
+                block_number INTEGER NOT NULL,
+                log_index INTEGER NOT NULL,
+                tx_hash BLOB NOT NULL,
+                from_id INTEGER,                 -- NULL — перевод записан до схемы v6
+                to_id INTEGER,
+                value BLOB,                      -- uint256, 32 байта big-endian
+                token_id INTEGER NOT NULL,
+                PRIMARY KEY (token_id, block_number, log_index)
+            ) WITHOUT ROWID;
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS transfers_from_idx ON transfers(token_id, from_id, block_number);")
+        cur.execute("CREATE INDEX IF NOT EXISTS transfers_to_idx ON transfers(token_id, to_id, block_number);")
+
+    def _create_history_tables(self, cur):
+        # Баланс адреса после каждого блока, где он менялся: баланс на блоке X — одна выборка
+        # по индексу адреса. Для top-N на блоке X — снимки holders раз в SNAPSHOT_INTERVAL
+        # блоков плюс изменения после снимка (диапазон PK). PK по блоку — запись дописывает в конец.
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS balance_history (
+                token_id INTEGER NOT NULL,
+                block_number INTEGER NOT NULL,
+                address TEXT NOT NULL,
+                balance BLOB NOT NULL,        -- после блока block_number
+                PRIMARY KEY (token_id, block_number, address)
+            ) WITHOUT ROWID;
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS balance_history_addr_idx "
+                    "ON balance_history(token_id, address, block_number);")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                token_id INTEGER NOT NULL,
+                block_number INTEGER NOT NULL,
+                holders INTEGER NOT NULL,
+                PRIMARY KEY (token_id, block_number)
+            );
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS snapshot_balances (
+                token_id INTEGER NOT NULL,
+                block_number INTEGER NOT NULL,   -- только ненулевые балансы
+                balance BLOB NOT NULL,
+                address TEXT NOT NULL,
+                PRIMARY KEY (token_id, block_number, balance, address)
+            ) WITHOUT ROWID;
+        """)
+
+    def _migrate(self):
+        cur = self.conn.cursor()
+        has_holders = cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='holders'").fetchone()
+        if not has_holders:
+            return  # новая БД — сразу создаётся актуальная схема
+        has_meta = cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='meta'").fetchone()
+        version = int(self._get_meta("schema_version") or 1) if has_meta else 1
+
+        for v in range(version + 1, SCHEMA_VERSION + 1):
+            print(f"[db] миграция схемы v{v - 1} → v{v}")
+            cur.execute("BEGIN")
+            try:
+                getattr(self, f"_migrate_v{v}")(cur)
+                cur.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);")
+                self._set_meta("schema_version", v)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def _migrate_v2(self, cur):
+        # balance TEXT → BLOB(32) + индекс для top-N
+        self.conn.create_function("u256", 1, _u256, deterministic=True)
+        cur.execute("ALTER TABLE holders RENAME TO holders_v1;")
+        cur.execute("""
+            CREATE TABLE holders (
+                address TEXT PRIMARY KEY,
+                balance BLOB NOT NULL,
+                last_tx_block INTEGER,
+                last_tx_ts INTEGER
+            );
+        """)
+        cur.execute("""
+            INSERT INTO holders(address, balance, last_tx_block, last_tx_ts)
+            SELECT address, u256(balance), last_tx_block, last_tx_ts FROM holders_v1;
+        """)
+        cur.execute("DROP TABLE holders_v1;")
+        cur.execute("CREATE INDEX holders_balance_idx ON holders(balance);")
+
+    def _migrate_v3(self, cur):
+        # хэши блоков для обнаружения реоргов; journal создаёт _create_tables. В БД v1 таблицы
+        # blocks ещё нет, а миграции дальше (v6) в неё уже пишут
+        if self._columns(cur, "blocks"):
+            cur.execute("ALTER TABLE blocks ADD COLUMN hash TEXT;")
+            cur.execute("ALTER TABLE blocks ADD COLUMN parent_hash TEXT;")
+        else:
+            self._create_block_tables(cur)
+
+    def _migrate_v4(self, cur):
+        # адреса — в нижнем регистре: EIP-55 больше не считается при записи
+        cur.execute("UPDATE holders SET address = lower(address) WHERE address != lower(address);")
+        has_journal = cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='journal'").fetchone()
+        if has_journal:
+            cur.execute("UPDATE journal SET address = lower(address) WHERE address != lower(address);")
+
+    # Миграции v5 и v6 создают таблицы уже в актуальном виде (с token_id): единственный
+    # токен БД до v7 получает в _migrate_v7 id 1.
+
+    def _migrate_v5(self, cur):
+        # история балансов начинается с текущего состояния: запросы at_block — не раньше него
+        self._create_history_tables(cur)
+        last = self._get_meta("last_scanned_block")
+        if last is None:
+            return
+        cur.execute("INSERT OR IGNORE INTO balance_history(token_id, block_number, address, balance) "
+                    "SELECT 1, ?, address, balance FROM holders", (int(last),))
+        self._set_meta("history_from", last)
+        n = cur.execute("INSERT OR REPLACE INTO snapshot_balances(token_id, block_number, balance, address) "
+                        "SELECT 1, ?, balance, address FROM holders WHERE balance > ?",
+                        (int(last), ZERO_U256)).rowcount
+        cur.execute("INSERT OR REPLACE INTO snapshots(token_id, block_number, holders) VALUES (1, ?, ?)",
+                    (int(last), n))
+
+    def _migrate_v6(self, cur):
+        # events -> transfers: from/to/value в events не было, такие переводы остаются без
+        # участников (в /get_transfers их нет, дубли по-прежнему отсекаются)
+        self._create_transfer_tables(cur)
+        has_events = cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='events'").fetchone()
+        if not has_events:
+            return
+        self.conn.create_function("unhex0x", 1, lambda h: bytes.fromhex(h[2:]) if h else None,
+                                  deterministic=True)
+        cur.execute("INSERT OR IGNORE INTO blocks(number, ts) "
+                    "SELECT block_number, MAX(ts) FROM events WHERE ts IS NOT NULL GROUP BY block_number;")
+        cur.execute("INSERT OR IGNORE INTO transfers(block_number, log_index, tx_hash, token_id) "
+                    "SELECT block_number, log_index, unhex0x(tx_hash), 1 FROM events;")
+        cur.execute("DROP TABLE events;")
+        last = self._get_meta("last_scanned_block")
+        if last is not None:
+            self._set_meta("transfers_from", int(last) + 1)
+
+    def _migrate_v7(self, cur):
+        # Несколько токенов в одной БД: токен прежней схемы — id 1, его курсор переезжает из
+        # meta.last_scanned_block в tokens.last_block, у таблиц состояния token_id — первым в ключе.
+        self._create_state_tables(cur)
+        last = self._get_meta("last_scanned_block")
+        cur.execute("INSERT OR IGNORE INTO tokens(id, address, symbol, decimals, last_block) VALUES (1, ?, ?, ?, ?)",
+                    (self.token_addr.lower(), self.client.symbol, self.client.decimals,
+                     None if last is None else int(last)))
+        cur.execute("DELETE FROM meta WHERE key = 'last_scanned_block';")
+        for table, create in (("holders", self._create_state_tables), ("journal", self._create_state_tables),
+                              ("backfill_shards", self._create_state_tables),
+                              ("balance_history", self._create_history_tables),
+                              ("snapshots", self._create_history_tables),
+                              ("snapshot_balances", self._create_history_tables)):
+            self._add_token_id(cur, table, create)
+        if self._columns(cur, "transfers") and "token_id" not in self._columns(cur, "transfers"):
+            # transfers — самая большая таблица: колонка добавляется без перезаписи строк
+            cur.execute("DROP INDEX transfers_from_idx;")
+            cur.execute("DROP INDEX transfers_to_idx;")
+            cur.execute("ALTER TABLE transfers ADD COLUMN token_id INTEGER NOT NULL DEFAULT 1;")
+            self._create_transfer_tables(cur)
+
+    def _migrate_v8(self, cur):
+        # holder_stats считается один раз по holders, дальше ведётся вместе с ними
+        self._create_state_tables(cur)
+        storage = SQLiteStorage(self.conn, None)
+        for (tid,) in cur.execute("SELECT DISTINCT token_id FROM holders").fetchall():
+            storage.rebuild_holder_stats(tid)
+
+    def _migrate_v9(self, cur):
+        # PK transfers -> (token_id, block_number, log_index): повторы отсекаются в пределах
+        # токена. Переводы bootstrap, записанные прежде с transactionIndex вместо logIndex,
+        # остаются как есть
+        pk = [r[1] for r in sorted(cur.execute("PRAGMA table_info(transfers)"), key=lambda r: r[5]) if r[5]]
+        if not pk or pk[0] == "token_id":
+            return
+        cols = self._columns(cur, "transfers")
+        cur.execute("DROP INDEX IF EXISTS transfers_from_idx;")
+        cur.execute("DROP INDEX IF EXISTS transfers_to_idx;")
+        cur.execute("ALTER TABLE transfers RENAME TO transfers_v8;")
+        self._create_transfer_tables(cur)
+        cur.execute(f"INSERT INTO transfers({', '.join(cols)}) SELECT {', '.join(cols)} FROM transfers_v8;")
+        cur.execute("DROP TABLE transfers_v8;")
+
+    @staticmethod
+    def _columns(cur, table):
+        return [r[1] for r in cur.execute(f"PRAGMA table_info({table})")]
+
+    def _add_token_id(self, cur, table, create):
+        # таблица прежней схемы -> актуальная (create) с token_id = 1
+        cols = self._columns(cur, table)
+        if not cols or "token_id" in cols:
+            return
+        for (name,) in cur.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name=? "
+                                   "AND sql IS NOT NULL", (table,)).fetchall():
+            cur.execute(f"DROP INDEX {name};")
+        cur.execute(f"ALTER TABLE {table} RENAME TO {table}_v6;")
+        create(cur)
+        cur.execute(f"INSERT INTO {table}(token_id, {', '.join(cols)}) SELECT 1, {', '.join(cols)} FROM {table}_v6;")
+        cur.execute(f"DROP TABLE {table}_v6;")
+
+    def _register_tokens(self, addrs):
+        # адреса -> {адрес: (id, decimals, symbol)}; decimals/symbol нового токена — с RPC, один раз,
+        # дальше — из реестра: перезапуск с заполненной БД к узлу не обращается
+        out = {}
+        for a in dict.fromkeys(a.lower() for a in addrs):
+            row = self.storage.token(a)
+            if row is None:
+                if a == self.token_addr.lower():
+                    decimals, symbol = self.client.decimals, self.client.symbol
+                elif a in self._known_tokens:
+                    decimals, symbol = self._known_tokens[a]
+                else:
+                    c = self.w3.eth.contract(address=Web3.to_checksum_address(a), abi=ERC20_ABI)
+                    decimals, symbol = c.functions.decimals().call(), c.functions.symbol().call()
+                row = (self.storage.add_token(a, symbol, decimals), decimals, symbol)
+            out[a] = row
+        self._commit()
+        return out
+
+    @contextmanager
+    def _reader(self):
+        if self.db_path == ":memory:":  # отдельные соединения in-memory БД не видят
+            with self.write_lock:
+                yield self.conn
+            return
+        with self._read_slots:
+            try:
+                conn = self._readers.get_nowait()
+            except queue.Empty:
+                conn = _connect(self.db_path, readonly=True)
+            try:
+                yield conn
+            finally:
+                self._readers.put(conn)
 
-    def _set_last_block(self, block):
+    def _get_meta(self, key, conn=None):
+        row = (conn or self.conn).execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
         self.conn.execute(
-            "INSERT INTO meta(key,value) VALUES('last_scanned_block', ?) "
+            "INSERT INTO meta(key,value) VALUES(?, ?) "
             "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
-            (str(block),)
+            (key, str(value))
         )
-        self.conn.commit()
 
+    def _commit(self):
+        # Сначала хранилище состояния, потом SQLite: если процесс упадёт между ними, курсор
+        # хранилища уйдёт вперёд и окно не применится к holders дважды — потеряются только
+        # история и переводы этого окна. Для SQLiteStorage это один и тот же коммит. Кадр архива
+        # пишется раньше обоих: лишний кадр после сбоя срежет truncate при следующем старте.
+        t0 = time.perf_counter()
+        if self.archive is not None and (self._archived or self._archive_cursor):
+            block, tids = self._archive_cursor or (None, [])
+            with metrics.stage("archive"):
+                self.archive.append(block, [self._addr_by_token[t] for t in tids], self._archived)
+            self._archived, self._archive_cursor = [], None
+        with metrics.stage("commit"):
+            self.storage.commit()
+            self.conn.commit()
+        if self._advanced:
+            self.generation += 1
+            self._advanced = False
+        now = time.perf_counter()
+        metrics.COMMIT_SECONDS.observe(now - t0)
+        metrics.TX_SECONDS.observe(now - self._tx_start)
+        self._tx_start = now
 
-    def _block_time(self, block_number):
-        ts = self._block_ts_cache.get(block_number)
-        if ts is not None:
-            return ts
-        blk = self.w3.eth.get_block(block_number)
-        ts = int(blk.timestamp)
-        self._block_ts_cache[block_number] = ts
-        return ts
-
-    def _apply_transfer(self, from_addr, to_addr, value_raw, block_number, ts, tx_hash, log_index):
-        ev_id = f"{tx_hash}:{log_index}"
-        cur = self.conn.cursor()
+    def _abort(self):
+        self.storage.rollback()
+        self.conn.rollback()
+        self._advanced = False
+        self._snapshots_due = []
+        self._archived, self._archive_cursor = [], None
+        self._block_ts_cache.clear()  # времена блоков из отменённой транзакции
+
+    def _get_last_block(self):
+        # докуда индекс прошёл цепочку — самый продвинутый из курсоров токенов
+        return max((c for c in self._cursors().values() if c is not None), default=None)
+
+    def _cursors(self):
+        # {token_id: last_block} индексируемых токенов
+        return self.storage.checkpoints(self._token_ids)
+
+    def _next_blocks(self, start_block=None):
+        # {token_id: первый ещё не применённый блок}; токен без курсора начинает со start_block
+        return {t: c + 1 if c is not None else start_block for t, c in self._cursors().items()
+                if c is not None or start_block is not None}
+
+    def _set_last_block(self, block, token_ids=None):
+        # курсоры token_ids (по умолчанию — всех токенов) -> block; снимок holders токена —
+        # раз в SNAPSHOT_INTERVAL блоков, отдельной транзакцией после коммита окна
+        token_ids = self._token_ids if token_ids is None else list(token_ids)
+        self.storage.set_checkpoints(token_ids, block)
+        self._advanced = True
+        if self.archive is not None:
+            self._archive_cursor = (block, token_ids)
+        if SNAPSHOT_INTERVAL:
+            # снимок, который прореживание сразу бы удалило, не пишется: backfill и rebuild
+            # далеко от головы иначе копировали бы holders каждые SNAPSHOT_INTERVAL блоков
+            head = self.storage.get_meta("head_block")
+            floor = int(head) - SNAPSHOT_INTERVAL * SNAPSHOT_KEEP if SNAPSHOT_KEEP and head is not None else None
+            for t in token_ids:
+                snap = self.conn.execute("SELECT MAX(block_number) FROM snapshots WHERE token_id=?",
+                                         (t,)).fetchone()[0]
+                if snap is not None and block - snap < SNAPSHOT_INTERVAL:
+                    continue
+                if snap is None or floor is None or block > floor or self._thin_bucket(block) != self._thin_bucket(snap):
+                    self._snapshots_due.append((block, t))
+        self._commit()
+        if self._snapshots_due:
+            # holders не менялись с коммита (write_lock) — это всё ещё состояние на block
+            due, self._snapshots_due = self._snapshots_due, []
+            for b, t in due:
+                self._snapshot(b, t)
+                self._prune_snapshots(t)
+            self._commit()
 
-        if cur.execute("SELECT 1 FROM events WHERE event_id=?", (ev_id,)).fetchone():
+    @staticmethod
+    def _thin_bucket(block):
+        # старше SNAPSHOT_KEEP остаётся первый снимок из каждых SNAPSHOT_INTERVAL * SNAPSHOT_THIN блоков
+        return block // (SNAPSHOT_INTERVAL * max(1, SNAPSHOT_THIN))
+
+    def _prune_snapshots(self, token_id):
+        # хранятся SNAPSHOT_KEEP последних снимков, старше — прореженные (_thin_bucket): at_block
+        # в прошлом дочитывает историю не больше чем за два таких промежутка
+        if not SNAPSHOT_KEEP:
             return
+        kept = set()
+        for (b,) in self.conn.execute("SELECT block_number FROM snapshots WHERE token_id = ? AND block_number < "
+                                      "(SELECT MIN(block_number) FROM (SELECT block_number FROM snapshots "
+                                      "WHERE token_id = ? ORDER BY block_number DESC LIMIT ?)) "
+                                      "ORDER BY block_number", (token_id, token_id, SNAPSHOT_KEEP)).fetchall():
+            if self._thin_bucket(b) not in kept:
+                kept.add(self._thin_bucket(b))
+                continue
+            self.conn.execute("DELETE FROM snapshot_balances WHERE token_id = ? AND block_number = ?", (token_id, b))
+            self.conn.execute("DELETE FROM snapshots WHERE token_id = ? AND block_number = ?", (token_id, b))
 
-        def add(addr, delta):
-            if addr.lower() == ZERO.lower():
-                return
-            row = cur.execute("SELECT balance FROM holders WHERE address=?", (addr,)).fetchone()
-            old = int(row[0]) if row else 0
-            new = old + delta
-            if new < 0:
-                new = 0
-            if row:
-                cur.execute(
-                    "UPDATE holders SET balance=?, last_tx_block=?, last_tx_ts=? WHERE address=?",
-                    (str(new), block_number, ts, addr)
-                )
+    @metrics.timed("snapshot")
+    def _snapshot(self, block, token_id):
+        # ненулевые балансы holders токена на блоке block (состояние после его last_block);
+        # holders в той же SQLite — копия одним INSERT ... SELECT, без разбора балансов в Python
+        if isinstance(self.storage, SQLiteStorage):
+            cur = self.conn.execute(
+                "INSERT OR REPLACE INTO snapshot_balances(token_id, block_number, balance, address) "
+                "SELECT token_id, ?, balance, address FROM holders WHERE token_id = ? AND balance > ?",
+                (block, token_id, ZERO_U256))
+        else:
+            cur = self.conn.executemany(
+                "INSERT OR REPLACE INTO snapshot_balances(token_id, block_number, balance, address) "
+                "VALUES (?, ?, ?, ?)",
+                ((token_id, block, _u256(b), a) for a, b in self.storage.nonzero_balances(token_id)))
+        self.conn.execute("INSERT OR REPLACE INTO snapshots(token_id, block_number, holders) VALUES (?, ?, ?)",
+                          (token_id, block, cur.rowcount))
+
+
+    def _block_time(self, block_number):
+        return self._block_times([block_number])[block_number]
+
+    def _block_times(self, block_numbers):
+        # память → таблица blocks → пакетный eth_getBlockByNumber; новые пишутся в blocks
+        # без коммита, вместе с пачкой переводов.
+        out = {}
+        missing = []
+        for b in set(block_numbers):
+            ts = self._block_ts_cache.get(b)
+            if ts is None:
+                missing.append(b)
             else:
-                cur.execute(
-                    "INSERT INTO holders(address, balance, last_tx_block, last_tx_ts) VALUES (?, ?, ?, ?)",
-                    (addr, str(new), block_number, ts)
-                )
+                out[b] = ts
+        metrics.BLOCK_TIMES.inc(len(out), source="memory")
+        with metrics.stage("block_times_db"):
+            for i in range(0, len(missing), SQL_CHUNK):
+                chunk = missing[i:i + SQL_CHUNK]
+                q = f"SELECT number, ts FROM blocks WHERE number IN ({','.join('?' * len(chunk))})"
+                out.update(self.conn.execute(q, chunk))
+        fetched = self._fetch_block_times([b for b in missing if b not in out])
+        metrics.BLOCK_TIMES.inc(len(missing) - len(fetched), source="db")
+        metrics.BLOCK_TIMES.inc(len(fetched), source="rpc")
+        self._store_block_times(fetched)
+        out.update(fetched)
+        if len(self._block_ts_cache) > 100_000:
+            self._block_ts_cache.clear()
+        self._block_ts_cache.update(out)
+        return out
+
+    def _fetch_block_times(self, block_numbers):
+        return {b: h[0] for b, h in self._fetch_block_headers(block_numbers).items()}
+
+    @metrics.timed("block_headers")
+    def _fetch_block_headers(self, block_numbers):
+        # -> {номер: (ts, hash, parent_hash)}
+        out = {}
+        for i in range(0, len(block_numbers), BLOCK_TS_BATCH):
+            chunk = block_numbers[i:i + BLOCK_TS_BATCH]
+            try:
+                with self.w3.batch_requests() as batch:
+                    for b in chunk:
+                        batch.add(self.w3.eth.get_block(b))
+                    blocks = batch.execute()
+            except Exception as e:
+                # часть публичных RPC не принимает batch — по одному
+                print(f"[blocks] batch не прошёл ({e}), запрашиваю {len(chunk)} блоков по одному")
+                blocks = [self.w3.eth.get_block(b) for b in chunk]
+            for b, blk in zip(chunk, blocks):
+                out[b] = (int(blk["timestamp"]), Web3.to_hex(blk["hash"]), Web3.to_hex(blk["parentHash"]))
+        return out
 
-        add(Web3.to_checksum_address(from_addr), -int(value_raw))
-        add(Web3.to_checksum_address(to_addr),   int(value_raw))
+    def _store_block_times(self, times):
+        if times:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO blocks(number, ts) VALUES (?, ?)", times.items()
+            )
 
-        cur.execute(
-            "INSERT INTO events(event_id, block_number, tx_hash, log_index, ts) VALUES (?, ?, ?, ?, ?)",
-            (ev_id, block_number, tx_hash, log_index, ts)
+    def _store_block_headers(self, headers):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO blocks(number, ts, hash, parent_hash) VALUES (?, ?, ?, ?)",
+            ((b, ts, h, ph) for b, (ts, h, ph) in headers.items())
         )
+        self._block_ts_cache.update((b, h[0]) for b, h in headers.items())
 
+    @metrics.timed("apply")
+    def _apply_transfers(self, transfers, journal_block=None, token_id=None):
+        # transfers: [(from, to, value, block, ts, tx_hash, log_index), ...] одного токена
+        # (по умолчанию — self.token_id) в порядке блоков. Коммит — на стороне вызывающего,
+        # вместе с _set_last_block. С journal_block (все переводы из одного блока) прежнее
+        # состояние адресов пишется в journal для отката.
+        if not transfers:
+            return 0
+        tid = self.token_id if token_id is None else token_id
+        cur = self.conn.cursor()
 
-    def first_from_polygonscan(self, api_key, start_block = START_BLOCK, sleep_s=0.25, offset=2000):
-        assert 1 <= offset <= 2000, "ставим offset <= 2000, чтобы уложиться в лимит page*offset<=10000"
+        batch = {}
+        for t in transfers:
+            batch.setdefault((t[3], t[6]), t)
+        self._drop_applied(cur, tid, batch)
+        if not batch:
+            return 0
 
-        base_url = "https://api.etherscan.io/v2/api"
-        chain_params = {"chainid": 137}
-        head = self.w3.eth.block_number
-        safe_head = max(0, head - CONFIRMATIONS)
-        print(f"[bootstrap] token={self.token_addr} safe_head={safe_head}")
+        # адреса в нижнем регистре и int(value) — один раз на перевод, дальше всё по (block, log_index)
+        zero = ZERO.lower()
+        rows = [(f.lower(), t.lower(), int(v), blk, ts, txh, li)
+                for (blk, li), (f, t, v, _, ts, txh, _) in sorted(batch.items())]
+        seen = dict.fromkeys(a for r in rows for a in (r[0], r[1]))
+        addrs = [a for a in seen if a != zero]
+        if journal_block is not None:
+            prev = self.storage.holder_state(tid, addrs, with_tx=True)
+            old = {a: p[0] for a, p in prev.items()}
+            cur.executemany(
+                "INSERT OR IGNORE INTO journal(block_number, token_id, address, balance, last_tx_block, last_tx_ts) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                ((journal_block, tid, a, *((_u256(prev[a][0]), *prev[a][1:]) if a in prev else (None, None, None)))
+                 for a in addrs)
+            )
+        else:
+            old = self.storage.holder_state(tid, addrs)
 
-        sess = requests.Session()
+        # текущий баланс идёт по переводам окна, чтобы история была поблочной, а не по окнам.
+        # Ноль — на каждом шаге, как при применении по одному переводу: иначе итог зависел бы
+        # от того, как переводы легли в окна
+        bal = {a: old.get(a, 0) for a in addrs}
+        last_tx = {}  # address -> (last_tx_block, last_tx_ts); rows по возрастанию блока — последний и есть
+        history = {}  # (block, address) -> баланс после блока
+        for from_addr, to_addr, val, block_number, ts, _, _ in rows:
+            for addr, delta in ((from_addr, -val), (to_addr, val)):
+                if addr == zero:
+                    continue
+                v = bal[addr] + delta
+                bal[addr] = v = v if v > 0 else 0
+                history[block_number, addr] = v
+                last_tx[addr] = (block_number, ts)
 
-        def _pick(d, keys, default=None):
-            for k in keys:
-                if k in d and d[k] not in (None, "", "null"):
-                    return d[k]
-            return default
+        self.storage.apply_balances(tid, [(a, bal[a], *last_tx[a]) for a in addrs])
+        self.storage.update_holder_stats(tid, [(old.get(a, 0), bal[a]) for a in addrs])
+        cur.executemany(
+            "INSERT OR REPLACE INTO balance_history(token_id, block_number, address, balance) VALUES (?, ?, ?, ?)",
+            ((tid, b, a, _u256(v)) for (b, a), v in sorted(history.items()))
+        )
+        ids = self._address_ids(cur, seen)
+        cur.executemany(
+            "INSERT INTO transfers(block_number, log_index, tx_hash, from_id, to_id, value, token_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((blk, li, bytes.fromhex(txh[2:]), ids[f], ids[t], _u256(v), tid) for f, t, v, blk, _, txh, li in rows)
+        )
+        if self.archive is not None:
+            addr = self._addr_by_token[tid]
+            self._archived.extend((addr, *r) for r in rows)
+        metrics.EVENTS_APPLIED.inc(len(batch), token=self._addr_by_token[tid])
+        return len(batch)
 
-        total = 0
-        cur_start = max(0, int(start_block))
+    @staticmethod
+    def _drop_applied(cur, tid, batch):
+        # убирает из batch {(block, log_index): перевод} уже записанные переводы токена tid.
+        # Тот же (block, log_index) — повтор, если совпала и транзакция. Строка Etherscan без
+        # logIndex (SCAN_LOG_INDEX) и лог узла — один перевод, если совпали транзакция, from,
+        # to и value; одинаковые переводы в транзакции сопоставляются по одному.
+        blocks = list({k[0] for k in batch})
+        stored = {}
+        other = {}  # (block, из Etherscan без logIndex?, tx_hash, from, to, value) -> сколько
+        for i in range(0, len(blocks), SQL_CHUNK):
+            chunk = blocks[i:i + SQL_CHUNK]
+            for blk, li, txh, f, t, v in cur.execute(
+                    "SELECT t.block_number, t.log_index, t.tx_hash, fa.address, ta.address, t.value "
+                    "FROM transfers t LEFT JOIN addresses fa ON fa.id = t.from_id "
+                    "LEFT JOIN addresses ta ON ta.id = t.to_id "
+                    f"WHERE t.token_id = ? AND t.block_number IN ({','.join('?' * len(chunk))})", (tid, *chunk)):
+                stored[blk, li] = txh
+                if f is not None:
+                    key = (blk, li >= SCAN_LOG_INDEX, txh, f, t, _from_u256(v))
+                    other[key] = other.get(key, 0) + 1
+        if not stored:
+            return
+        for (blk, li), t in list(batch.items()):
+            txh = bytes.fromhex(t[5][2:])
+            if (blk, li) in stored:
+                if stored[blk, li] != txh:
+                    raise ValueError(f"перевод {blk}:{li} уже записан с транзакцией 0x{stored[blk, li].hex()}, "
+                                     f"а не {t[5]}")
+                del batch[blk, li]
+                continue
+            key = (blk, li < SCAN_LOG_INDEX, txh, t[0].lower(), t[1].lower(), int(t[2]))
+            if other.get(key):
+                other[key] -= 1
+                del batch[blk, li]
 
-        while True:
-            if cur_start > safe_head:
-                break
+    def _address_ids(self, cur, addrs):
+        # адрес -> id из словаря addresses; новые адреса добавляются
+        addrs = list(addrs)
+        ids = {}
+        for i in range(0, len(addrs), SQL_CHUNK):
+            chunk = addrs[i:i + SQL_CHUNK]
+            q = f"SELECT address, id FROM addresses WHERE address IN ({','.join('?' * len(chunk))})"
+            ids.update(cur.execute(q, chunk))
+        new = [a for a in addrs if a not in ids]
+        if new:
+            # писатель один (write_lock) — id новых адресов идут подряд за последним, одним executemany
+            start = cur.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM addresses").fetchone()[0]
+            ids.update(zip(new, range(start, start + len(new))))
+            cur.executemany("INSERT INTO addresses(id, address) VALUES (?, ?)", ((ids[a], a) for a in new))
+        return ids
 
-            page = 1
-            last_blk_in_window = cur_start
-            while page <= 5:  # 5 * 2000 = 10000 → не пробиваем лимит окна
-                params = {
-                    "module": "account",
-                    "action": "tokentx",
-                    "contractaddress": self.token_addr,
-                    "startblock": cur_start,
-                    "endblock": safe_head,
-                    "sort": "asc",
-                    "page": page,
-                    "offset": offset,
-                    "apikey": api_key,
-                }
-                params.update(chain_params)
-
-                resp = sess.get(base_url, params=params, timeout=30)
-                resp.raise_for_status()
-                payload = resp.json()
-
-                status = payload.get("status")
-                message = payload.get("message")
-                result = payload.get("result")
-
-                if isinstance(result, dict):
-                    rows = result.get("transactions") or result.get("events") or result.get("records") or []
-                else:
-                    rows = result if isinstance(result, list) else []
 
-                if status == "0" and (message or "").lower().startswith("no"):
-                    print(f"[bootstrap] window empty (page={page}), stop window")
-                    break
+    @_writes
+    def first_from_polygonscan(self, api_key, start_block=START_BLOCK, sleep_s=None, offset=2000,
+                               rate=None, workers=ETHERSCAN_WORKERS, span=BOOTSTRAP_SPAN,
+                               base_url=ETHERSCAN_URL, token=None):
+        # Конвейер: [start_block, safe_head] режется на диапазоны по span блоков, пул воркеров
+        # тянет их страницы из Etherscan (общий token bucket на rate запросов/сек вместо
+        # фиксированного sleep), а этот поток параллельно применяет уже готовые диапазоны
+        # строго по порядку. sleep_s оставлен для совместимости: rate = 1 / sleep_s.
+        # tokentx отдаёт один контракт, поэтому bootstrap — по одному токену (token).
+        assert 1 <= offset <= 2000, "ставим offset <= 2000, чтобы уложиться в лимит page*offset<=10000"
+        if rate is None:
+            rate = 1.0 / sleep_s if sleep_s else ETHERSCAN_RATE
+        es = EtherscanClient(api_key, base_url=base_url, rate=rate)
+        tid = self.token_info(token)[0]
+        token_addr = self.token_addr if token is None else token.lower()
 
-                if status == "0" and "window" in (message or "").lower():
-                    print(f"[bootstrap] window limit hit on page={page}, shift window")
-                    break
+        head = self.w3.eth.block_number
+        safe_head = max(0, head - CONFIRMATIONS)
+        self.storage.set_meta("head_block", head)
+        self._commit()
+        ranges = list(self._shards(max(0, int(start_block)), safe_head, span))
+        print(f"[bootstrap] token={token_addr} safe_head={safe_head} ranges={len(ranges)} "
+              f"workers={workers} rate={rate:g}/s")
 
-                if status not in ("1", 1) and not rows:
-                    print(f"[bootstrap] warn status={status} message={message}, rows={len(rows)}")
+        todo = iter(ranges)
+        pending = deque()
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bootstrap")
 
-                if not rows:
-                    print(f"[bootstrap] empty rows (page={page}), stop window")
-                    break
+        def submit_next():
+            r = next(todo, None)
+            if r is not None:
+                pending.append((r, pool.submit(self._fetch_etherscan_range, es, token_addr, r[0], r[1], offset)))
 
-                applied = 0
-                for it in rows:
-                    try:
-                        blk = int(_pick(it, ["blockNumber", "block_number", "block_num"]))
-                        if blk > safe_head:
-                            continue
-                        last_blk_in_window = max(last_blk_in_window, blk)
-
-                        txh = _pick(it, ["hash", "tx_hash", "transactionHash"])
-                        if txh and not str(txh).startswith("0x"):
-                            txh = "0x" + str(txh).lower()
-
-                        li_val = _pick(it, ["logIndex", "log_index", "logindex"])
-                        if li_val is None:
-                            li_val = _pick(it, ["transactionIndex", "transaction_index"], 0)
-                        li = int(li_val)
-
-                        from_a = _pick(it, ["from", "from_address"])
-                        to_a = _pick(it, ["to", "to_address"])
-                        val = int(_pick(it, ["value", "token_value", "amount", "raw_amount"], "0"))
-                        ts = int(_pick(it, ["timeStamp", "timestamp", "block_timestamp"], "0"))
-
-                        if not (txh and from_a and to_a):
-                            continue
-
-                        self._apply_transfer(from_a, to_a, val, blk, ts, txh, li)
-                        applied += 1
-                        total += 1
-                    except Exception as e:
-                        print(f"[bootstrap] skip item due to: {e}")
+        # курсор только растёт: bootstrap с start_block позади индекса дописывает пропущенное
+        # (повторы отсеет _apply_transfers), но не отматывает курсор назад
+        cursor = self.storage.checkpoints([tid]).get(tid)
+        total = 0
+        try:
+            for _ in range(workers * 2):
+                submit_next()
+            while pending:
+                (s, e), fut = pending.popleft()
+                transfers = fut.result()
+                submit_next()
 
-                self.conn.commit()
-                print(f"[bootstrap] page={page} rows={len(rows)} applied={applied} total={total}")
+                self._store_block_times({t[3]: t[4] for t in transfers if t[4]})
+                applied = self._apply_transfers(transfers, token_id=tid)
+                total += applied
+                if cursor is None or e > cursor:
+                    cursor = e
+                    self._set_last_block(e, [tid])
+                else:
+                    self._commit()
+                self._progress(self._get_last_block(), head)
+                print(f"[bootstrap] [{s}..{e}] rows={len(transfers)} applied={applied} total={total}")
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+        print(f"[bootstrap] done: calls={es.calls} throttled={es.throttled} total={total}")
+        return total
 
+    def _fetch_etherscan_range(self, es, token_addr, start, end, offset):
+        # Выполняется в пуле, без SQLite. Etherscan отдаёт не больше 10000 строк на окно
+        # (page*offset), поэтому заполненное окно продолжается с его последнего блока
+        # включительно, а уже полученные строки этого блока отбрасываются: у строк без logIndex
+        # номер в транзакции считается по ответу, повтор дал бы им другие log_index.
+        transfers = []
+        cur = start
+        while cur <= end:
+            last_blk = cur
+            for page in range(1, 10000 // offset + 1):
+                with metrics.stage("etherscan"):
+                    rows = es.tokentx(token_addr, cur, end, page, offset)
+                for it in rows:
+                    t = _etherscan_transfer(it)
+                    if t is not None and t[3] <= end:
+                        transfers.append(t)
+                        last_blk = max(last_blk, t[3])
                 if len(rows) < offset:
-                    break
+                    return _number_scan_rows(transfers)
+            if last_blk > cur:
+                cur = last_blk
+                transfers = [t for t in transfers if t[3] < cur]
+            else:
+                print(f"[bootstrap] warn: в блоке {cur} больше {10000} переводов, часть пропущена")
+                cur += 1
+        return _number_scan_rows(transfers)
 
-                page += 1
-                time.sleep(sleep_s)
+    def _get_logs_window(self, current, upper, span, addresses=None):
+        # Одно окно [current, current+span-1] ∩ [.., upper] по адресам addresses (по умолчанию —
+        # все токены); при ошибке диапазона/лимита окно делится пополам.
+        # Возвращает (logs, to_block, span, с которым получилось).
+        try_span = max(1, min(span, upper - current + 1))
+        while True:
+            to_block = current + try_span - 1
+            try:
+                # сырой eth_getLogs: форматтеры web3 (HexBytes, AttributeDict) на каждом логе
+                # стоят дороже самого декодирования
+                with metrics.stage("get_logs"):
+                    resp = self.w3.provider.make_request("eth_getLogs", [{
+                        "fromBlock": hex(current),
+                        "toBlock": hex(to_block),
+                        "address": list(self.tokens) if addresses is None else addresses,
+                        "topics": [self.transfer_sig],
+                    }])
+                if "error" in resp:
+                    raise Web3RPCError(str(resp["error"].get("message")), rpc_response=resp)
+                metrics.GET_LOGS_BLOCKS.observe(try_span)
+                return resp["result"], to_block, try_span
+            except Exception as e:
+                msg = str(e).lower()
+                if ("range is too large" in msg or
+                        "block range" in msg or
+                        "timeout" in msg or
+                        "limit" in msg or
+                        _rpc_error_code(e) in (-32062, -32005)):
+                    if try_span <= 1:
+                        raise
+                    try_span = max(1, try_span // 2)
+                    metrics.GET_LOGS_HALVINGS.inc()
+                    time.sleep(0.1)
+                    continue
+                else:
+                    raise
 
-            if last_blk_in_window >= cur_start:
-                cur_start = last_blk_in_window + 1
-            else:
-                cur_start += 1
+    @metrics.timed("decode")
+    def _decode_logs(self, logs, times):
+        # -> {token_id: [перевод, ...]}; логи чужих контрактов пропускаются
+        out = {}
+        for lg in logs:
+            tid = self._token_by_addr.get(lg["address"].lower())
+            t = _raw_transfer(lg, times[int(lg["blockNumber"], 16)])
+            if tid is not None and t is not None:
+                out.setdefault(tid, []).append(t)
+        return out
 
-        self._set_last_block(safe_head)
+    def _token_logs(self, current, upper, span, nxt):
+        # Окно сразу для всех токенов, чей курсор позади его конца: адреса — списком в одном
+        # eth_getLogs, так что вызовов на диапазон блоков столько же, сколько с одним токеном.
+        # Логи блоков, которые токен уже прошёл (nxt — первый непройденный), отбрасываются.
+        # -> (logs, to_block, [token_id, ...] прошедших окно)
+        end = min(upper, current + span - 1)
+        tids = [t for t, b in nxt.items() if b <= end]
+        addrs = [a for a, t in self._token_by_addr.items() if t in tids]
+        logs, to_block, _ = self._get_logs_window(current, upper, span, addrs)
+        logs = [lg for lg in logs
+                if int(lg["blockNumber"], 16) >= nxt.get(self._token_by_addr.get(lg["address"].lower()), to_block + 1)]
+        return logs, to_block, [t for t in tids if nxt[t] <= to_block]
 
+    @_writes
     def index_transfers(self, start_block=None, batch_size=BATCH_SIZE, confirmations=CONFIRMATIONS):
+        # Блоки глубже REORG_DEPTH от головы применяются окнами как есть. Ближе к голове
+        # (confirmations < REORG_DEPTH) — по одному блоку с хэшами и журналом отката: если
+        # узел сменил ветку, изменения осиротевших блоков откатываются и блоки читаются заново.
+        # Окна идут от самого отстающего токена: добавленный позже токен догоняет остальных
+        # один, дальше все читаются вместе.
         head = self.w3.eth.block_number
         safe_head = max(0, head - confirmations)
+        final = max(0, head - REORG_DEPTH)
+        self.storage.set_meta("head_block", head)
 
-        last = self._get_last_block()
-        if last is None:
-            if start_block is None:
-                raise RuntimeError("БД пустая, укажи стартовый блок.")
-            current = start_block
-        else:
-            current = last + 1
+        self._check_reorg(self._get_last_block())
+        nxt = self._next_blocks(start_block)
+        if not nxt:
+            raise RuntimeError("БД пустая, укажи стартовый блок.")
+        current = min(nxt.values())
 
         if current > safe_head:
+            self._prune_journal(final)
+            self._commit()
+            self._progress(self._get_last_block(), head)
             print("[index] актуально: новых подтверждённых блоков нет")
             return
 
-        print(f"[index] {current} → {safe_head} (batch={batch_size})")
+        print(f"[index] {current} → {safe_head} (batch={batch_size}, tokens={len(nxt)})")
 
+        retries = 0
         while current <= safe_head:
-            try_span = min(batch_size, safe_head - current + 1)
-
-            while True:
-                to_block = current + try_span - 1
-                try:
-                    logs = self.w3.eth.get_logs({
-                        "fromBlock": current,
-                        "toBlock": to_block,
-                        "address": self.token_addr,
-                        "topics": [self.transfer_sig],
-                    })
-                    break
-                except Exception as e:
-                    msg = str(e).lower()
-                    if ("range is too large" in msg or
-                            "block range" in msg or
-                            "timeout" in msg or
-                            "limit" in msg or
-                            isinstance(e, Web3RPCError) and getattr(e, "code", None) in (-32062, -32005)):
-                        if try_span <= 1:
-                            raise
-                        try_span = max(1, try_span // 2)
-                        time.sleep(0.1)
-                        continue
-                    else:
-                        raise
+            if current <= final:
+                logs, to_block, tids = self._token_logs(current, min(safe_head, final), batch_size, nxt)
+                times = self._block_times([int(lg["blockNumber"], 16) for lg in logs])
+                for tid, transfers in self._decode_logs(logs, times).items():
+                    self._apply_transfers(transfers, token_id=tid)
+                self._set_last_block(to_block, tids)
+            else:
+                window = self._index_tip(current, safe_head, batch_size, nxt)
+                if window is None:
+                    # ветка сменилась, пока читали окно
+                    retries += 1
+                    if retries > 3:
+                        raise RuntimeError("цепочка у головы не стабилизировалась за 3 попытки")
+                    self._check_reorg(self._get_last_block())
+                    nxt = self._next_blocks(start_block)
+                    current = min(nxt.values())
+                    continue
+                to_block, tids = window
+            nxt.update((t, to_block + 1) for t in tids)
+            self._progress(self._get_last_block(), head)
+            pct = 100.0 * (to_block - current + 1) / max(1, (safe_head - current + 1))
+            print(f"⬆ [{current}..{to_block}] готово {pct:.1f}%")
+            current = min(nxt.values())
 
-            if logs:
-                for lg in logs:
-                    ev = self.transfer_event.process_log(lg)
-                    _from = Web3.to_checksum_address(ev["args"]["from"])
-                    _to = Web3.to_checksum_address(ev["args"]["to"])
-                    _val = int(ev["args"]["value"])
+        self._prune_journal(final)
+        self._commit()
+        print(f"[index] last_scanned_block={safe_head}")
 
+    def _index_tip(self, current, upper, batch_size, nxt):
+        # Окно у головы: заголовки всех блоков (и пустых — иначе реорг в них не заметить),
+        # проверка цепочки parentHash и того, что логи пришли с той же ветки. Применение —
+        # поблочно, с журналом. None — ветка поменялась, окно не записано.
+        logs, to_block, tids = self._token_logs(current, upper, batch_size, nxt)
+        headers = self._fetch_block_headers(list(range(current, to_block + 1)))
+        prev = self._block_hash(current - 1)
+        for b in range(current, to_block + 1):
+            _, h, parent = headers[b]
+            if prev is not None and parent != prev:
+                print(f"[reorg] блок {b}: parentHash {parent} != {prev}")
+                return None
+            prev = h
+        for lg in logs:
+            if lg["blockHash"] != headers[int(lg["blockNumber"], 16)][1]:
+                print(f"[reorg] лог блока {int(lg['blockNumber'], 16)} с другой ветки")
+                return None
+        by_block = {}
+        for tid, transfers in self._decode_logs(logs, {b: h[0] for b, h in headers.items()}).items():
+            for t in transfers:
+                by_block.setdefault((t[3], tid), []).append(t)
 
-                    blk = int(lg["blockNumber"])
-                    ts = self._block_time(blk)
-                    txh = Web3.to_hex(lg["transactionHash"])
-                    li = int(lg["logIndex"])
+        self._store_block_headers(headers)
+        for b, tid in sorted(by_block):
+            self._apply_transfers(by_block[b, tid], journal_block=b, token_id=tid)
+        self._set_last_block(to_block, tids)
+        return to_block, tids
 
-                    self._apply_transfer(_from, _to, _val, blk, ts, txh, li)
+    @_writes
+    def apply_block(self, header, logs):
+        # Блок из подписки (newHeads + logs с этим blockHash): применяется с журналом, только
+        # если продолжает записанную цепочку у всех токенов. False — разрыв, другая ветка или
+        # отстающий токен: нужна догонка через index_transfers (она же откатит реорг).
+        n = int(header["number"], 16)
+        if any(c != n - 1 for c in self._cursors().values()):
+            return False
+        last = n - 1
+        prev = self._block_hash(last)
+        if prev is not None and header["parentHash"] != prev:
+            print(f"[reorg] блок {n}: parentHash {header['parentHash']} != {prev}")
+            return False
+        ts = int(header["timestamp"], 16)
+        self._store_block_headers({n: (ts, header["hash"], header["parentHash"])})
+        for tid, transfers in self._decode_logs(logs, {n: ts}).items():
+            transfers.sort(key=lambda t: t[6])
+            self._apply_transfers(transfers, journal_block=n, token_id=tid)
+        head = max(n, int(self.storage.get_meta("head_block") or 0))
+        self.storage.set_meta("head_block", head)
+        self._prune_journal(head - REORG_DEPTH)
+        self._set_last_block(n)
+        self._progress(n, head)
+        return True
 
-                self.conn.commit()
+    def _block_hash(self, number):
+        row = self.conn.execute("SELECT hash FROM blocks WHERE number=?", (number,)).fetchone()
+        return row[0] if row else None
 
-            self._set_last_block(to_block)
-            pct = 100.0 * (to_block - current + 1) / max(1, (safe_head - current + 1))
-            print(f"⬆ [{current}..{to_block}] готово {pct:.1f}%")
-            current = to_block + 1
+    def _check_reorg(self, last):
+        # Сверяет хэш last_scanned_block с узлом; при расхождении ищет сверху вниз последний
+        # общий блок среди записанных с журналом и откатывается к нему. -> новый last.
+        floor = int(self._get_meta("journal_floor") or 0)
+        ours = self._block_hash(last) if last is not None and last > floor else None
+        if ours is None:
+            return last  # last применён без журнала или уже окончателен — сверять нечего
+        if self._fetch_block_headers([last])[last][1] == ours:
+            return last
+        ours = self.conn.execute(
+            "SELECT number, hash FROM blocks WHERE number >= ? AND number <= ? AND hash IS NOT NULL "
+            "ORDER BY number DESC", (floor, last)
+        ).fetchall()
+        for i in range(0, len(ours), 16):  # реорги обычно мелкие — сверяем сверху пачками
+            chunk = ours[i:i + 16]
+            theirs = self._fetch_block_headers([b for b, _ in chunk])
+            for b, h in chunk:
+                if theirs[b][1] == h:
+                    print(f"[reorg] точка форка {b}, откат {last - b} блоков")
+                    self._rollback(b)
+                    return b
+        raise RuntimeError(
+            f"реорг глубже журнала (блоки {floor + 1}..{last}): нужен переиндекс с блока <= {floor}")
 
-        print(f"[index] last_scanned_block={safe_head}")
+    def _rollback(self, fork):
+        # holders → состояние после блока fork: для каждого (токен, адрес) берётся запись журнала
+        # из самого раннего осиротевшего блока, где он менялся. Курсоры токенов дальше fork — на fork.
+        cur = self.conn.cursor()
+        restore = {}
+        for tid, a, bal, blk, ts in cur.execute(
+                "SELECT token_id, address, balance, last_tx_block, last_tx_ts FROM journal "
+                "WHERE block_number > ? ORDER BY block_number", (fork,)):
+            restore.setdefault((tid, a), (bal, blk, ts))
+        for tid in {t for t, _ in restore}:
+            addrs = [a for t, a in restore if t == tid]
+            now = self.storage.holder_state(tid, addrs)
+            self.storage.update_holder_stats(tid, [(now.get(a, 0), _from_u256(restore[tid, a][0] or ZERO_U256))
+                                                   for a in addrs])
+            self.storage.delete_holders(tid, [a for (t, a), (bal, _, _) in restore.items() if t == tid and bal is None])
+            self.storage.apply_balances(tid, [(a, _from_u256(bal), blk, ts) for (t, a), (bal, blk, ts)
+                                              in restore.items() if t == tid and bal is not None])
+        cur.execute("DELETE FROM journal WHERE block_number > ?", (fork,))
+        for tid in set(self._token_ids) | {t for t, _ in restore}:
+            # у истории, снимков и transfers ключ начинается с token_id — удаление диапазоном по токену
+            cur.execute("DELETE FROM balance_history WHERE token_id = ? AND block_number > ?", (tid, fork))
+            cur.execute("DELETE FROM snapshot_balances WHERE token_id = ? AND block_number > ?", (tid, fork))
+            cur.execute("DELETE FROM snapshots WHERE token_id = ? AND block_number > ?", (tid, fork))
+            cur.execute("DELETE FROM transfers WHERE token_id = ? AND block_number > ?", (tid, fork))
+        cur.execute("DELETE FROM blocks WHERE number > ?", (fork,))
+        self.storage.rewind_checkpoints(fork)
+        self._advanced = True
+        if self.archive is not None:
+            self.archive.truncate(fork)
+        for b in [b for b in self._block_ts_cache if b > fork]:
+            del self._block_ts_cache[b]
+        self._commit()
+
+    def _prune_journal(self, final):
+        # блоки глубже REORG_DEPTH считаются окончательными — журнал по ним больше не нужен
+        floor = int(self._get_meta("journal_floor") or 0)
+        if final > floor:
+            self.conn.execute("DELETE FROM journal WHERE block_number <= ?", (final,))
+            self._set_meta("journal_floor", final)
+
+    @_writes
+    def backfill(self, start_block=None, end_block=None, shard_size=BACKFILL_SHARD,
+                 workers=BACKFILL_WORKERS, batch_size=BATCH_SIZE, confirmations=CONFIRMATIONS):
+        # Исторический прогон: диапазон режется на шарды (границы кратны shard_size), пул
+        # воркеров параллельно тянет логи и заголовки, а запись идёт здесь, одним писателем,
+        # строго по порядку шардов. Готовые шарды отмечаются в backfill_shards по токенам —
+        # прерванный прогон продолжается без повторной загрузки, а шард читается одним
+        # eth_getLogs на все токены, которым он ещё нужен.
+        head = self.w3.eth.block_number
+        self.storage.set_meta("head_block", head)
+        cursors = self._cursors()
+        if start_block is None:
+            start_block = min(START_BLOCK if c is None else c + 1 for c in cursors.values())
+        if end_block is None:
+            end_block = max(0, head - confirmations)
+
+        shards = []
+        for sh in self._shards(start_block, end_block, shard_size):
+            tids = [t for t in self._token_ids if not self._shard_done(t, *sh)]
+            if tids:
+                shards.append((sh, tids))
+        self._commit()
+        if not shards:
+            print("[backfill] нечего делать: все шарды уже пройдены")
+            return
+        print(f"[backfill] {shards[0][0][0]} → {shards[-1][0][1]} shards={len(shards)} workers={workers} "
+              f"tokens={len(self._token_ids)}")
+
+        todo = iter(shards)
+        pending = deque()
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backfill")
+
+        def submit_next():
+            item = next(todo, None)
+            if item is not None:
+                (s, e), tids = item
+                addrs = [a for a, t in self._token_by_addr.items() if t in tids]
+                pending.append((item, pool.submit(self._fetch_shard, s, e, batch_size, addrs)))
+
+        try:
+            for _ in range(workers * 2):  # ограничиваем число шардов в памяти
+                submit_next()
+            done = 0
+            while pending:
+                ((s, e), tids), fut = pending.popleft()
+                by_token, times = fut.result()
+                submit_next()
+
+                self._store_block_times(times)
+                for tid in tids:
+                    self._apply_transfers(by_token.get(tid, []), token_id=tid)
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO backfill_shards(token_id, start_block, end_block) VALUES (?, ?, ?)",
+                    ((t, s, e) for t in tids))
+                # курсор токена двигается, только если шард продолжает его без разрыва, — и сразу
+                # за пройденные прежде шарды, которые этот разрыв закрыл
+                ends = {}
+                for t in tids:
+                    if cursors[t] is None or s <= cursors[t] + 1 <= e:
+                        ends.setdefault(self._shards_end(t, e), []).append(t)
+                for end, advance in sorted(ends.items()):
+                    self._set_last_block(end, advance)
+                    cursors.update((t, end) for t in advance)
+                if not ends:
+                    self._commit()
+                self._progress(self._get_last_block(), head)
+                done += 1
+                events = sum(len(v) for v in by_token.values())
+                print(f"⬆ [backfill {s}..{e}] events={events} шард {done}/{len(shards)}")
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+        print(f"[backfill] last_scanned_block={self._get_last_block()}")
 
+    @staticmethod
+    def _shards(start_block, end_block, shard_size):
+        s = start_block
+        while s <= end_block:
+            e = min(end_block, (s // shard_size + 1) * shard_size - 1)
+            yield s, e
+            s = e + 1
 
-    def get_top(self, n, api_key=None, parse_type = 'RPC'):
+    def _shards_end(self, token_id, block):
+        # конец цепочки пройденных шардов токена, непрерывно продолжающей block
+        while True:
+            end = self.conn.execute(
+                "SELECT MAX(end_block) FROM backfill_shards WHERE token_id = ? AND start_block <= ? AND end_block > ?",
+                (token_id, block + 1, block)
+            ).fetchone()[0]
+            if end is None:
+                return block
+            block = end
+
+    def _shard_done(self, token_id, s, e):
+        return self.conn.execute(
+            "SELECT 1 FROM backfill_shards WHERE token_id = ? AND start_block <= ? AND end_block >= ?",
+            (token_id, s, e)
+        ).fetchone() is not None
+
+    def _fetch_shard(self, shard_from, shard_to, batch_size, addresses):
+        # Выполняется в пуле: только RPC и декодирование, без SQLite. У каждого воркера своё
+        # окно: если узел заставил его уменьшить, следующие запросы этого потока сразу идут
+        # с уменьшенным окном, а не повторяют заведомо отклоняемый диапазон.
+        logs = []
+        current = shard_from
+        span = getattr(self._worker, "span", batch_size)
+        while current <= shard_to:
+            window, to_block, used = self._get_logs_window(current, shard_to, span, addresses)
+            logs.extend(window)
+            if used < min(span, shard_to - current + 1):
+                span = self._worker.span = used
+            current = to_block + 1
+        times = self._fetch_block_times(sorted({int(lg["blockNumber"], 16) for lg in logs}))
+        return self._decode_logs(logs, times), times
+
+    @_writes
+    def replay_archive(self, archive, to_block=None, batch=REBUILD_BATCH):
+        # Rebuild из локального архива (archive.py) в новую БД: кадры читаются по порядку, переводы
+        # копятся по токенам и применяются пачками от batch переводов — без журнала, как глубокие
+        # окна index_transfers. Курсор токена — последний блок, до которого его довёл кадр.
+        # -> (применено переводов, last_scanned_block)
         last = self._get_last_block()
+        if last is not None:
+            raise RuntimeError(f"индекс уже дошёл до блока {last}: rebuild — только в новую БД и пустое хранилище")
+        # БД новая: вторичные индексы строятся в конце одной сортировкой, а не вставкой на каждую
+        # строку; прерванный rebuild всё равно начинать заново, поэтому и без fsync
+        for name in ("transfers_from_idx", "transfers_to_idx", "balance_history_addr_idx", "holders_balance_idx"):
+            self.conn.execute(f"DROP INDEX IF EXISTS {name}")
+        self.conn.execute("PRAGMA synchronous=OFF;")
+        # голова для политики снимков — конец архива: дальше SNAPSHOT_KEEP от него пишутся только прореженные
+        end = to_block if to_block is not None else archive.info()["last_block"]
+        if end is not None:
+            self.storage.set_meta("head_block", end)
+        pending, cursors, times = {}, {}, {}
+        total = size = 0
+
+        def flush():
+            nonlocal total, size
+            if not size and not cursors:
+                return
+            self._store_block_times(times)
+            for addr, transfers in pending.items():
+                transfers.sort(key=lambda t: (t[3], t[6]))
+                total += self._apply_transfers(transfers, token_id=self._token_by_addr[addr])
+            by_block = {}
+            for addr, b in cursors.items():
+                by_block.setdefault(b, []).append(self._token_by_addr[addr])
+            for b, tids in sorted(by_block.items()):
+                self._set_last_block(b, tids)
+            self._commit()
+            print(f"⬆ [rebuild] до блока {max(cursors.values(), default=None)} transfers={total}")
+            pending.clear()
+            cursors.clear()
+            times.clear()
+            size = 0
+
+        for block, advanced, by_token in archive.read(to_block):
+            for addr, transfers in by_token.items():
+                pending.setdefault(addr, []).extend(transfers)
+                times.update((t[3], t[4]) for t in transfers if t[4])
+                size += len(transfers)
+            cursors.update((a, block) for a in advanced)
+            if size >= batch:
+                flush()
+        flush()
+        with metrics.stage("rebuild_indexes"):
+            cur = self.conn.cursor()
+            self._create_state_tables(cur)
+            self._create_transfer_tables(cur)
+            self._create_history_tables(cur)
+            self._commit()
+        self.conn.execute("PRAGMA synchronous=NORMAL;")
+        return total, self._get_last_block()
+
+    def _progress(self, last_block, head):
+        if self.on_progress is not None:
+            self.on_progress(last_block, head)
+
+    def token_info(self, token=None):
+        # адрес токена (в любом регистре) -> (id, decimals, symbol); None — токен по умолчанию
+        t = self.tokens.get(self.token_addr.lower() if token is None else token.lower())
+        if t is None:
+            raise ValueError(f"токен {token} не индексируется")
+        return t
+
+    def index_status(self, token=None):
+        # только чтение: сколько блоков индекс токена отстаёт от последней виденной головы
+        tid = self.token_info(token)[0]
+        last = self.storage.checkpoint(tid)
+        head = self.storage.get_meta("head_block", shared=True)
+        head = int(head) if head is not None else None
+        lag = head - last if head is not None and last is not None else None
+        return {"last_scanned_block": last, "head_block": head, "lag": lag}
+
+    def _top_rows(self, n, token_id, with_ts=False):
+        rows = self.storage.top(token_id, n, with_ts)
+        rows.reverse()  # как и раньше, по возрастанию баланса
+        return rows
+
+    def _check_at_block(self, conn, at_block, token_id):
+        last = self.storage.checkpoint(token_id)
+        if last is None or at_block > last:
+            raise ValueError(f"блок {at_block} ещё не проиндексирован (last_scanned_block={last})")
+        since = self._get_meta("history_from", conn)
+        if since is not None and at_block < int(since):
+            raise ValueError(f"история балансов есть только с блока {since}")
+
+    def _top_rows_at(self, n, at_block, token_id):
+        # Ближайший снимок <= at_block: из него n старших адресов, не менявшихся после снимка
+        # (остальные неизменившиеся не больше их). Менявшиеся могут попасть в топ, только если
+        # в какой-то момент после снимка были не меньше n-го из них — такие выбираются по
+        # покрывающему индексу и проверяются по последней записи. Без снимка — вся история.
+        with self._reader() as conn:
+            self._check_at_block(conn, at_block, token_id)
+            snap = conn.execute("SELECT MAX(block_number) FROM snapshots WHERE token_id = ? AND block_number <= ?",
+                                (token_id, at_block)).fetchone()[0]
+            snap = -1 if snap is None else snap
+            rows = conn.execute(
+                "SELECT address, balance FROM snapshot_balances s WHERE token_id = ? AND block_number = ? "
+                "AND NOT EXISTS (SELECT 1 FROM balance_history h WHERE h.token_id = s.token_id "
+                "AND h.address = s.address AND h.block_number > ? AND h.block_number <= ?) "
+                "ORDER BY balance DESC LIMIT ?",
+                (token_id, snap, snap, at_block, n)).fetchall()
+            floor = rows[-1][1] if len(rows) == n else _u256(1)
+            for (a,) in conn.execute(
+                    "SELECT DISTINCT address FROM balance_history WHERE token_id = ? AND block_number > ? "
+                    "AND block_number <= ? AND balance >= ?", (token_id, snap, at_block, floor)).fetchall():
+                b = self._balance_at(conn, token_id, a, at_block)
+                if b >= floor:
+                    rows.append((a, b))
+        rows.sort(key=lambda r: r[1], reverse=True)
+        rows = rows[:n]
+        rows.reverse()
+        return rows
+
+    @staticmethod
+    def _balance_at(conn, token_id, address, at_block):
+        # без INDEXED BY планировщик берёт PK: token_id= и ORDER BY block_number совпадают с ним
+        row = conn.execute(
+            "SELECT balance FROM balance_history INDEXED BY balance_history_addr_idx "
+            "WHERE token_id = ? AND address = ? AND block_number <= ? "
+            "ORDER BY block_number DESC LIMIT 1", (token_id, address, at_block)).fetchone()
+        return row[0] if row else ZERO_U256
+
+    def get_balances(self, addresses, at_block=None, token=None):
+        # сырые балансы из holders в порядке addresses; не встречавшиеся адреса — 0.
+        # at_block — баланс после этого блока, из balance_history
+        tid = self.token_info(token)[0]
+        addresses = [a.lower() for a in addresses]
+        uniq = list(dict.fromkeys(addresses))
+        if at_block is not None:
+            with self._reader() as conn:
+                self._check_at_block(conn, at_block, tid)
+                found = {a: _from_u256(self._balance_at(conn, tid, a, at_block)) for a in uniq}
+            return [found[a] for a in addresses]
+        found = self.storage.balances(tid, uniq)
+        return [found.get(a, 0) for a in addresses]
+
+    def get_transfers(self, address, from_block=None, to_block=None, limit=100, cursor=None, order="desc",
+                      token=None):
+        # Входящие и исходящие переводы адреса в порядке (block_number, log_index), keyset-пагинация:
+        # cursor — (block_number, log_index) последнего отданного перевода. Выборки по from_id и
+        # по to_id читают из индекса не больше limit строк каждая, как бы ни была длинна история.
+        # -> ([(block, log_index, tx_hash, from, to, value, ts), ...], cursor следующей страницы | None)
+        tid = self.token_info(token)[0]
+        desc = order == "desc"
+        cmp, direction = ("<", "DESC") if desc else (">", "ASC")
+        where, params = [], []
+        if from_block is not None:
+            where.append("block_number >= ?")
+            params.append(from_block)
+        if to_block is not None:
+            where.append("block_number <= ?")
+            params.append(to_block)
+        if cursor is not None:
+            where.append(f"(block_number, log_index) {cmp} (?, ?)")
+            params.extend(cursor)
+        cond = "".join(f" AND {w}" for w in where)
+        with self._reader() as conn:
+            row = conn.execute("SELECT id FROM addresses WHERE address = ?", (address.lower(),)).fetchone()
+            if row is None:
+                return [], None
+            found = {}
+            for col in ("from_id", "to_id"):
+                for r in conn.execute(
+                        f"SELECT block_number, log_index, tx_hash, from_id, to_id, value FROM transfers "
+                        f"WHERE token_id = ? AND {col} = ?{cond} "
+                        f"ORDER BY block_number {direction}, log_index {direction} LIMIT ?",
+                        (tid, row[0], *params, limit)):
+                    found[r[0], r[1]] = r  # перевод самому себе попадёт в обе выборки
+            rows = [found[k] for k in sorted(found, reverse=desc)[:limit]]
+            ids = list({i for r in rows for i in r[3:5]})
+            names = dict(conn.execute(
+                f"SELECT id, address FROM addresses WHERE id IN ({','.join('?' * len(ids))})", ids))
+            blocks = list({r[0] for r in rows})
+            times = dict(conn.execute(
+                f"SELECT number, ts FROM blocks WHERE number IN ({','.join('?' * len(blocks))})", blocks))
+        out = [(blk, li, "0x" + txh.hex(), _checksum(names[f]), _checksum(names[t]), _from_u256(v), times.get(blk))
+               for blk, li, txh, f, t, v in rows]
+        return out, (rows[-1][0], rows[-1][1]) if len(rows) == limit else None
+
+    def get_top(self, n, api_key=None, parse_type=None, at_block=None, token=None):
+        tid, decimals, _ = self.token_info(token)
+        if at_block is not None:
+            rows = self._top_rows_at(n, at_block, tid)
+            return [(_checksum(addr), _from_u256(bal) / float(10 ** decimals)) for addr, bal in rows]
+        last = self.storage.checkpoint(tid)
         if parse_type == 'RPC':
             self.index_transfers()
         elif parse_type == 'scan':
@@ -305,24 +1495,15 @@ class TokenIndexer:
                     "Необходимо сделать первичный вызов bootstrap или rpc вызов")
             if not api_key:
                 raise RuntimeError("нужен api_key")
-            self.first_from_polygonscan(api_key=api_key, start_block=last + 1)
-
-        rows = self.conn.execute("""
-            SELECT address, balance
-            FROM (
-                SELECT address, balance
-                FROM holders
-                WHERE balance != '0'
-                ORDER BY LENGTH(balance) DESC, balance DESC
-                LIMIT ?
-            ) t
-            ORDER BY LENGTH(balance) ASC, balance ASC;
-        """, (n,)).fetchall()
-        return [(addr, int(bal) / float(10 ** self.decimals)) for addr, bal in rows]
-
-
-    def get_top_with_transactions(self, n, parse_type='RPC',  api_key=None):
-        last = self._get_last_block()
+            self.first_from_polygonscan(api_key=api_key, start_block=last + 1, token=token)
+
+        rows = self._top_rows(n, tid)
+        return [(_checksum(addr), bal / float(10 ** decimals)) for addr, bal in rows]
+
+
+    def get_top_with_transactions(self, n, parse_type=None, api_key=None, token=None):
+        tid, decimals, _ = self.token_info(token)
+        last = self.storage.checkpoint(tid)
         if parse_type == 'RPC':
             self.index_transfers(start_block=last)
         elif parse_type == 'scan':
@@ -331,24 +1512,40 @@ class TokenIndexer:
                     "Необходимо сделать первичный вызов bootstrap или rpc вызов")
             if not api_key:
                 raise RuntimeError("нужен api_key")
-            self.first_from_polygonscan(api_key=api_key, start_block=last + 1)
-        rows = self.conn.execute("""
-            SELECT address, balance, last_tx_ts
-            FROM (
-                SELECT address, balance, last_tx_ts
-                FROM holders
-                WHERE balance != '0'
-                ORDER BY LENGTH(balance) DESC, balance DESC
-                LIMIT ?
-            ) t
-            ORDER BY LENGTH(balance) ASC, balance ASC;
-        """, (n,)).fetchall()
+            self.first_from_polygonscan(api_key=api_key, start_block=last + 1, token=token)
+        rows = self._top_rows(n, tid, with_ts=True)
         out = []
         for addr, bal, ts in rows:
             ts_iso = datetime.fromtimestamp(int(ts), tz=timezone.utc).isoformat()
-            out.append((addr, int(bal) / float(10 ** self.decimals), ts_iso))
+            out.append((_checksum(addr), bal / float(10 ** decimals), ts_iso))
         return out
 
+    def holder_stats(self, token=None, top=(10, 100)):
+        # Держатели по десятичному порядку баланса и доля top-N в сумме балансов. Корзины —
+        # из holder_stats (не больше 78 строк), top-N — n строк по индексу баланса: время ответа
+        # от числа держателей не зависит.
+        tid, decimals, _ = self.token_info(token)
+        shares = {n: sum(b for _, b in self.storage.top(tid, n)) for n in top}
+        stats = self.storage.holder_stats(tid)
+        total = sum(b for _, b in stats.values())
+        unit = 10 ** decimals
+        buckets = [{"magnitude": k - decimals, "min": 10.0 ** (k - decimals), "max": 10.0 ** (k + 1 - decimals),
+                    "holders": n, "balance": b / unit, "share": b / total}
+                   for k, (n, b) in sorted(stats.items())]
+        return {
+            "holders": sum(n for n, _ in stats.values()),
+            "balance": total / unit,
+            "buckets": buckets,
+            "concentration": {f"top{n}": min(1.0, s / total) if total else None for n, s in shares.items()},
+        }
+
     def close(self):
-        self.conn.close()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        with self.write_lock:
+            self.storage.close()
+            self.conn.close()
 
@@ -0,0 +1,476 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+from web3 import AsyncWeb3, Web3
+
+import metrics
+from config import (RPC_COOLDOWN, RPC_HEAD_WAIT, RPC_HEDGE, RPC_HEDGE_MIN_DELAY, RPC_HEDGE_MIN_SAMPLES,
+                    RPC_LATENCY_WINDOW, RPC_MAX_FAILS, RPC_MAX_INFLIGHT)
+
+# Пул JSON-RPC узлов. Каждый запрос уходит на узел с лучшим счётом (латентность × доля ошибок ×
+# загрузка); при обрыве, таймауте или ответе лимитом — на следующий. Если узел не ответил за p95
+# своей латентности по этому методу, запрос дублируется на другой узел и берётся первый ответ.
+# Все наши методы — чтения, так что дубль безопасен.
+
+HEDGE_METHODS = {"eth_getLogs", "eth_call", "eth_getBlockByNumber", "batch"}
+# Голову спрашиваем у всех свободных узлов сразу: ответ — первый, остальные в фоне обновляют
+# head своих узлов, без этого запросы у головы доставались бы одному узлу.
+BROADCAST_METHODS = {"eth_blockNumber"}
+_RATE_LIMIT = ("rate limit", "too many requests", "limit exceeded", "exceeded its compute units")
+_EWMA = 0.2
+
+
+def _block_param(v):
+    return int(v, 16) if isinstance(v, str) and v.startswith("0x") else None
+
+
+def min_block(method, params):
+    # блок, который узел должен уже знать, чтобы ответ был полным: отстающий узел на eth_getLogs
+    # за своей головой молча отдаёт пустой список
+    if method == "eth_getLogs":
+        return _block_param(params[0].get("toBlock"))
+    if method == "eth_getBlockByNumber":
+        return _block_param(params[0])
+    if method == "eth_call" and len(params) > 1:
+        return _block_param(params[1])
+    return None
+
+
+def _retryable(method, resp):
+    # ответ, с которым стоит спросить другой узел: лимит запросов или блок, которого узел ещё не видел
+    if not isinstance(resp, dict):
+        return False
+    err = resp.get("error")
+    if err is not None:
+        msg = str(err.get("message", "")).lower() if isinstance(err, dict) else str(err).lower()
+        return (isinstance(err, dict) and err.get("code") == 429) or any(s in msg for s in _RATE_LIMIT)
+    return method == "eth_getBlockByNumber" and resp.get("result") is None
+
+
+def _seen_block(method, resp):
+    # блок, до которого узел точно дошёл, по его ответу
+    result = resp.get("result") if isinstance(resp, dict) else None
+    if method == "eth_blockNumber" and isinstance(result, str):
+        return int(result, 16)
+    if method == "eth_getBlockByNumber" and isinstance(result, dict) and "number" in result:
+        return int(result["number"], 16)
+    return None
+
+
+def _batch_retryable(batch_requests, resp):
+    if not isinstance(resp, list):
+        return _retryable("batch", resp)
+    return any(_retryable(m, r) for (m, _), r in zip(batch_requests, resp))
+
+
+class BehindHead(Exception):
+    # ни один узел пула не видел запрошенный блок и за RPC_HEAD_WAIT не догнал его
+    def __init__(self, block):
+        super().__init__(f"ни один узел пула ещё не видел блок {block}")
+        self.block = block
+
+
+class Endpoint:
+    # статистика одного узла; общая для sync и async провайдеров процесса
+    def __init__(self, url, label, max_inflight):
+        self.url = url
+        self.label = label
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.latency = None  # EWMA, сек
+        self.error_rate = 0.0  # EWMA доли неудачных запросов
+        self.fails = 0  # неудач подряд
+        self.down_until = 0.0
+        self.head = None
+        self._samples = {}  # метод -> последние латентности удачных запросов
+
+    def score(self):
+        # меньше — лучше; узел без замеров пробуется первым
+        lat = self.latency or 0.0
+        return (lat + 0.001) * (1 + 10 * self.error_rate) * (1 + self.inflight / self.max_inflight)
+
+    def p95(self, method):
+        s = self._samples.get(method)
+        if s is None or len(s) < RPC_HEDGE_MIN_SAMPLES:
+            return None
+        return sorted(s)[int(0.95 * (len(s) - 1))]
+
+    def stats(self):
+        return {"url": self.label, "latency_ms": round(self.latency * 1000, 1) if self.latency else None,
+                "error_rate": round(self.error_rate, 4), "inflight": self.inflight, "head": self.head,
+                "down": self.down_until > time.monotonic()}
+
+
+class RPCPool:
+    def __init__(self, urls, max_inflight=RPC_MAX_INFLIGHT, hedge=RPC_HEDGE):
+        labels = [urlsplit(u).netloc or u for u in urls]  # без пути: в нём бывает API-ключ
+        self.endpoints = [Endpoint(u, lb if labels.count(lb) == 1 else f"{lb}#{i}", max_inflight)
+                          for i, (u, lb) in enumerate(zip(urls, labels))]
+        self.hedge = hedge and len(self.endpoints) > 1
+        self._cond = threading.Condition()
+        self._executor = None
+        self._background = set()  # async-попытки, досчитывающиеся после ответа
+
+    # выбор узла
+
+    def _serving(self, block, exclude):
+        # Узлы вне exclude, которым можно отдать запрос к block: только те, чья голова уже дошла
+        # до block. Отстающий узел на eth_getLogs за своей головой без ошибки отвечает пустым
+        # списком. Узел с неизвестной головой может оказаться таким же, он годится, лишь пока
+        # пул не знает ни одной головы.
+        eps = [e for e in self.endpoints if e not in exclude]
+        if block is None or len(self.endpoints) == 1 or all(e.head is None for e in self.endpoints):
+            return eps
+        return [e for e in eps if e.head is not None and e.head >= block]
+
+    @staticmethod
+    def _pick(eps):
+        now = time.monotonic()
+        free = [e for e in eps if e.inflight < e.max_inflight]
+        if not free:
+            return None
+        up = [e for e in free if e.down_until <= now] or free
+        return min(up, key=Endpoint.score)
+
+    def acquire(self, block=None, exclude=(), block_wait=True):
+        # -> Endpoint с занятым слотом; None — вне exclude нет узла, видевшего block, или все
+        # такие заняты (block_wait=False)
+        with self._cond:
+            while True:
+                eps = self._serving(block, exclude)
+                if not eps:
+                    return None
+                ep = self._pick(eps)
+                if ep is not None:
+                    ep.inflight += 1
+                    return ep
+                if not block_wait:
+                    return None
+                self._cond.wait()
+
+    async def acquire_async(self, block=None, exclude=(), block_wait=True):
+        while True:
+            ep = self.acquire(block, exclude, block_wait=False)
+            if ep is not None or not block_wait or not self._serving(block, exclude):
+                return ep
+            await asyncio.sleep(0.005)
+
+    def release(self, ep):
+        with self._cond:
+            ep.inflight -= 1
+            self._cond.notify_all()
+
+    # учёт
+
+    def record(self, ep, method, dt, ok, resp=None):
+        with self._cond:
+            ep.latency = dt if ep.latency is None else ep.latency + _EWMA * (dt - ep.latency)
+            ep.error_rate += _EWMA * ((0.0 if ok else 1.0) - ep.error_rate)
+            if ok:
+                ep.fails = 0
+                ep.down_until = 0.0
+                ep._samples.setdefault(method, deque(maxlen=RPC_LATENCY_WINDOW)).append(dt)
+                head = _seen_block(method, resp)
+                if head is not None and (ep.head is None or head >= ep.head or method == "eth_blockNumber"):
+                    ep.head = head
+            else:
+                ep.fails += 1
+                if ep.fails >= RPC_MAX_FAILS and ep.down_until <= time.monotonic():
+                    ep.down_until = time.monotonic() + RPC_COOLDOWN
+                    print(f"[rpc] {ep.label}: {ep.fails} ошибок подряд, вне пула на {RPC_COOLDOWN}s")
+        metrics.RPC_ENDPOINT_REQUESTS.inc(endpoint=ep.label, outcome="ok" if ok else "error")
+        metrics.RPC_ENDPOINT_LATENCY.set(ep.latency, endpoint=ep.label)
+        metrics.RPC_ENDPOINT_ERROR_RATE.set(ep.error_rate, endpoint=ep.label)
+
+    def deadline(self, ep, method):
+        if not self.hedge or method not in HEDGE_METHODS:
+            return None
+        p95 = ep.p95(method)
+        return None if p95 is None else max(RPC_HEDGE_MIN_DELAY, p95)
+
+    def stats(self):
+        return [e.stats() for e in self.endpoints]
+
+    def _best_head(self, resp):
+        # на eth_blockNumber отвечаем лучшей известной головой: первым часто отвечает как раз
+        # отстающий узел, и индекс топтался бы у его головы
+        head = _seen_block("eth_blockNumber", resp)
+        best = max((e.head for e in self.endpoints if e.head is not None), default=None)
+        return resp if head is None or best is None or head >= best else {**resp, "result": hex(best)}
+
+    # sync
+
+    def _attempt(self, ep, method, send, retryable):
+        # -> (удачно, ответ или исключение); слот узла освобождается
+        t0 = time.perf_counter()
+        try:
+            resp = send(ep)
+        except Exception as e:
+            self.record(ep, method, time.perf_counter() - t0, False)
+            return False, e
+        finally:
+            self.release(ep)
+        ok = not retryable(resp)
+        self.record(ep, method, time.perf_counter() - t0, ok, resp)
+        return ok, resp
+
+    def _submit(self, *args):
+        if self._executor is None:
+            with self._cond:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=sum(e.max_inflight for e in self.endpoints), thread_name_prefix="rpc-hedge")
+        return self._executor.submit(self._attempt, *args)
+
+    def _acquire_all(self):
+        eps = []
+        while (ep := self.acquire(None, eps, block_wait=False)) is not None:
+            eps.append(ep)
+        return eps
+
+    def _first_ok(self, futures):
+        pending, last = set(futures), None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                ok, out = f.result()
+                if ok:
+                    return f, out  # остальные досчитаются в фоне и освободят слоты сами
+                last = out
+        return None, last
+
+    def _broadcast(self, method, send, retryable):
+        eps = self._acquire_all()
+        if len(eps) < 2:
+            for ep in eps:
+                self.release(ep)
+            return None
+        f, out = self._first_ok([self._submit(ep, method, send, retryable) for ep in eps])
+        return f is not None, out
+
+    def _hedged(self, ep, method, send, retryable, deadline, block, tried):
+        first = self._submit(ep, method, send, retryable)
+        done, _ = wait([first], timeout=deadline)
+        if done:
+            return first.result()
+        other = self.acquire(block, tried, block_wait=False)
+        if other is None:
+            return first.result()
+        tried.append(other)
+        metrics.RPC_HEDGES.inc(result="fired")
+        second = self._submit(other, method, send, retryable)
+        f, out = self._first_ok([first, second])
+        if f is second:
+            metrics.RPC_HEDGES.inc(result="won")
+        return f is not None, out
+
+    def call(self, method, send, block=None, retryable=None, refresh=None):
+        # send(endpoint) -> ответ узла. Узлы перебираются, пока один не ответит без ошибки
+        # лимита/транспорта; если не ответил ни один — последняя ошибка (исключение или ответ).
+        # Если block не видел ни один узел, refresh() переспрашивает головы, пока кто-то не догонит.
+        retryable = retryable or (lambda r: _retryable(method, r))
+        if method in BROADCAST_METHODS and len(self.endpoints) > 1:
+            res = self._broadcast(method, send, retryable)
+            if res is not None and res[0]:
+                return self._best_head(res[1])
+        tried, last, since = [], None, None
+        while True:
+            ep = self.acquire(block, tried)
+            if ep is None:
+                if tried:
+                    break
+                since = since or time.monotonic()
+                if refresh is None or time.monotonic() - since > RPC_HEAD_WAIT:
+                    raise BehindHead(block)
+                refresh()
+                if not self._serving(block, ()):
+                    time.sleep(0.1)
+                continue
+            if tried:
+                metrics.RPC_FAILOVERS.inc()
+            tried.append(ep)
+            deadline = self.deadline(ep, method)
+            if deadline is None:
+                ok, out = self._attempt(ep, method, send, retryable)
+            else:
+                ok, out = self._hedged(ep, method, send, retryable, deadline, block, tried)
+            if ok:
+                return out
+            last = out
+        if isinstance(last, BaseException):
+            raise last
+        return last
+
+    # async
+
+    async def _attempt_async(self, ep, method, send, retryable):
+        t0 = time.perf_counter()
+        try:
+            resp = await send(ep)
+        except Exception as e:
+            self.record(ep, method, time.perf_counter() - t0, False)
+            return False, e
+        finally:
+            self.release(ep)
+        ok = not retryable(resp)
+        self.record(ep, method, time.perf_counter() - t0, ok, resp)
+        return ok, resp
+
+    async def _broadcast_async(self, method, send, retryable):
+        eps = self._acquire_all()
+        if len(eps) < 2:
+            for ep in eps:
+                self.release(ep)
+            return None
+        pending, last = {asyncio.ensure_future(self._attempt_async(ep, method, send, retryable)) for ep in eps}, None
+        self._background |= pending
+        for f in pending:
+            f.add_done_callback(self._background.discard)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for f in done:
+                ok, out = f.result()
+                if ok:
+                    return True, out
+                last = out
+        return False, last
+
+    async def _hedged_async(self, ep, method, send, retryable, deadline, block, tried):
+        first = asyncio.ensure_future(self._attempt_async(ep, method, send, retryable))
+        done, _ = await asyncio.wait({first}, timeout=deadline)
+        if done:
+            return first.result()
+        other = await self.acquire_async(block, tried, block_wait=False)
+        if other is None:
+            return await first
+        tried.append(other)
+        metrics.RPC_HEDGES.inc(result="fired")
+        second = asyncio.ensure_future(self._attempt_async(other, method, send, retryable))
+        pending, last = {first, second}, None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for f in done:
+                    ok, out = f.result()
+                    if ok:
+                        if f is second:
+                            metrics.RPC_HEDGES.inc(result="won")
+                        return ok, out
+                    last = out
+        finally:
+            for f in pending:
+                f.cancel()  # слот проигравшего освобождается в его finally
+        return False, last
+
+    async def call_async(self, method, send, block=None, retryable=None, refresh=None):
+        retryable = retryable or (lambda r: _retryable(method, r))
+        if method in BROADCAST_METHODS and len(self.endpoints) > 1:
+            res = await self._broadcast_async(method, send, retryable)
+            if res is not None and res[0]:
+                return self._best_head(res[1])
+        tried, last, since = [], None, None
+        while True:
+            ep = await self.acquire_async(block, tried)
+            if ep is None:
+                if tried:
+                    break
+                since = since or time.monotonic()
+                if refresh is None or time.monotonic() - since > RPC_HEAD_WAIT:
+                    raise BehindHead(block)
+                await refresh()
+                if not self._serving(block, ()):
+                    await asyncio.sleep(0.1)
+                continue
+            if tried:
+                metrics.RPC_FAILOVERS.inc()
+            tried.append(ep)
+            deadline = self.deadline(ep, method)
+            if deadline is None:
+                ok, out = await self._attempt_async(ep, method, send, retryable)
+            else:
+                ok, out = await self._hedged_async(ep, method, send, retryable, deadline, block, tried)
+            if ok:
+                return out
+            last = out
+        if isinstance(last, BaseException):
+            raise last
+        return last
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(urls):
+    # один пул (и одна статистика узлов) на набор адресов в процессе: sync-клиент индексатора
+    # и async-клиенты эндпоинтов видят одно и то же здоровье узлов
+    key = tuple(urls)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = RPCPool(list(urls))
+        return _pools[key]
+
+
+def _child_kwargs(pool, kwargs):
+    # один узел — прежние повторы web3 при обрыве; несколько — повторяет пул, уже на другом узле
+    return kwargs if len(pool.endpoints) == 1 else {**kwargs, "exception_retry_configuration": None}
+
+
+class PooledHTTPProvider(Web3.HTTPProvider):
+    """HTTPProvider поверх RPCPool: у каждого узла свой HTTPProvider, запрос и batch целиком
+    уходят на узел, выбранный пулом."""
+
+    def __init__(self, urls, **kwargs):
+        urls = [urls] if isinstance(urls, str) else list(urls)
+        super().__init__(urls[0], **kwargs)
+        self.pool = get_pool(urls)
+        kw = _child_kwargs(self.pool, kwargs)
+        self._nodes = {e: Web3.HTTPProvider(e.url, **kw) for e in self.pool.endpoints}
+
+    def _refresh(self):
+        self.make_request("eth_blockNumber", [])
+
+    def make_request(self, method, params):
+        return self.pool.call(method, lambda e: self._nodes[e].make_request(method, params),
+                              min_block(method, params), refresh=self._refresh)
+
+    def make_batch_request(self, batch_requests):
+        blocks = [b for b in (min_block(m, p) for m, p in batch_requests) if b is not None]
+        return self.pool.call("batch", lambda e: self._nodes[e].make_batch_request(batch_requests),
+                              max(blocks, default=None), lambda r: _batch_retryable(batch_requests, r),
+                              self._refresh)
+
+
+class AsyncPooledHTTPProvider(AsyncWeb3.AsyncHTTPProvider):
+    def __init__(self, urls, **kwargs):
+        urls = [urls] if isinstance(urls, str) else list(urls)
+        super().__init__(urls[0], **kwargs)
+        self.pool = get_pool(urls)
+        kw = _child_kwargs(self.pool, kwargs)
+        self._nodes = {e: AsyncWeb3.AsyncHTTPProvider(e.url, **kw) for e in self.pool.endpoints}
+
+    async def cache_async_session(self, session):
+        for p in self._nodes.values():
+            await p.cache_async_session(session)
+        return session
+
+    async def _refresh(self):
+        await self.make_request("eth_blockNumber", [])
+
+    async def make_request(self, method, params):
+        return await self.pool.call_async(method, lambda e: self._nodes[e].make_request(method, params),
+                                          min_block(method, params), refresh=self._refresh)
+
+    async def make_batch_request(self, batch_requests):
+        blocks = [b for b in (min_block(m, p) for m, p in batch_requests) if b is not None]
+        return await self.pool.call_async("batch", lambda e: self._nodes[e].make_batch_request(batch_requests),
+                                          max(blocks, default=None), lambda r: _batch_retryable(batch_requests, r),
+                                          self._refresh)
+
+    async def disconnect(self):
+        for p in self._nodes.values():
+            await p.disconnect()
@@ -0,0 +1,535 @@
+# storage.py
+# Состояние индекса, которое читают API: токены с курсорами, holders и meta. TokenIndexer
+# пишет и читает его только через Storage, поэтому оно может жить не в SQLite-файле индекса:
+# с PostgreSQL несколько реплик API читают одно состояние, а пишет его один индексатор.
+# Журнал отката, блоки, история балансов и переводы остаются в SQLite индексатора.
+import queue
+import threading
+from bisect import bisect_right
+from contextlib import contextmanager
+
+from config import SQL_CHUNK, SQLITE_READ_POOL
+
+ZERO_U256 = bytes(32)
+
+
+class NotWriter(RuntimeError):
+    # состояние в хранилище уже ведёт другой индексатор
+    pass
+
+
+# uint256 хранится как 32 байта big-endian: BLOB-ы сравниваются memcmp-ом,
+# поэтому порядок байтов совпадает с числовым и индекс по balance сортирует верно.
+def _u256(v):
+    return int(v).to_bytes(32, "big")
+
+
+def _from_u256(b):
+    return int.from_bytes(b, "big")
+
+
+_POW10 = [10 ** i for i in range(79)]
+
+
+def magnitude(v):
+    # десятичный порядок v > 0: 10**k <= v < 10**(k+1) -> k (корзина holder_stats)
+    return bisect_right(_POW10, v) - 1
+
+
+def stats_delta(changes):
+    # [(старый баланс, новый)] -> {корзина: [Δдержателей, Δсуммы]}; нулевой баланс — не держатель
+    out = {}
+    for old, new in changes:
+        if old == new:
+            continue
+        if old > 0:
+            d = out.setdefault(magnitude(old), [0, 0])
+            d[0] -= 1
+            d[1] -= old
+        if new > 0:
+            d = out.setdefault(magnitude(new), [0, 0])
+            d[0] += 1
+            d[1] += new
+    return out
+
+
+class Storage:
+    """Интерфейс хранилища состояния. Балансы — int, адреса — 0x… в нижнем регистре.
+
+    Записи идут в открытую транзакцию писателя и видны читателям после commit();
+    чтения (checkpoint, top, balances, holder_chunks, get_meta(shared=True)) — из
+    отдельных соединений и писателя не ждут.
+    """
+
+    def claim_writer(self):
+        # True — этот процесс единственный писатель хранилища (SQLite-файл пишет один процесс)
+        return True
+
+    def token(self, address):
+        # -> (id, decimals, symbol) или None
+        raise NotImplementedError
+
+    def add_token(self, address, symbol, decimals):
+        # -> id
+        raise NotImplementedError
+
+    def checkpoints(self, token_ids):
+        # курсоры писателя: {token_id: last_block | None}
+        raise NotImplementedError
+
+    def checkpoint(self, token_id):
+        raise NotImplementedError
+
+    def set_checkpoints(self, token_ids, block):
+        raise NotImplementedError
+
+    def rewind_checkpoints(self, block):
+        # курсоры дальше block -> block (откат реорга)
+        raise NotImplementedError
+
+    def get_meta(self, key, shared=False):
+        raise NotImplementedError
+
+    def set_meta(self, key, value):
+        raise NotImplementedError
+
+    def holder_state(self, token_id, addresses, with_tx=False):
+        # для писателя: {адрес: баланс} или {адрес: (баланс, last_tx_block, last_tx_ts)}
+        raise NotImplementedError
+
+    def apply_balances(self, token_id, rows):
+        # rows: [(адрес, баланс, last_tx_block, last_tx_ts)] — итог пачки переводов, upsert
+        raise NotImplementedError
+
+    def delete_holders(self, token_id, addresses):
+        raise NotImplementedError
+
+    def nonzero_balances(self, token_id):
+        # для писателя (снимки): [(адрес, баланс)] с балансом > 0
+        raise NotImplementedError
+
+    def top(self, token_id, n, with_ts=False):
+        # n старших ненулевых балансов по убыванию: [(адрес, баланс[, last_tx_ts])]
+        raise NotImplementedError
+
+    def balances(self, token_id, addresses):
+        # {адрес: баланс} для встретившихся адресов
+        raise NotImplementedError
+
+    def holder_chunks(self, token_id, min_raw=None, max_raw=None, chunk=None):
+        # ненулевые балансы по убыванию, списками по chunk: [(адрес, баланс, last_tx_block, last_tx_ts)]
+        raise NotImplementedError
+
+    def holder_stats(self, token_id):
+        # {корзина: (держателей, сумма балансов)} — не больше 78 строк, без прохода по holders
+        raise NotImplementedError
+
+    def update_holder_stats(self, token_id, changes):
+        # changes: [(старый баланс, новый)] адресов, записанных в holders этой же транзакцией
+        delta = stats_delta(changes)
+        if delta:
+            self._add_holder_stats(token_id, delta)
+
+    def rebuild_holder_stats(self, token_id):
+        # полный пересчёт по holders (миграция, проверка)
+        self._add_holder_stats(token_id, stats_delta((0, b) for _, b in self.nonzero_balances(token_id)), True)
+
+    def _add_holder_stats(self, token_id, delta, replace=False):
+        raise NotImplementedError
+
+    def commit(self):
+        raise NotImplementedError
+
+    def rollback(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SQLiteStorage(Storage):
+    """Состояние в той же SQLite-БД, что и весь индекс (таблицы создаёт и мигрирует TokenIndexer).
+
+    conn — соединение-писатель индексатора: записи попадают в его транзакцию вместе с
+    журналом и историей; reader — пул read-only соединений индексатора.
+    """
+
+    def __init__(self, conn, reader):
+        self.conn = conn
+        self._reader = reader
+
+    def token(self, address):
+        row = self.conn.execute("SELECT id, decimals, symbol FROM tokens WHERE address = ?", (address,)).fetchone()
+        return tuple(row) if row else None
+
+    def add_token(self, address, symbol, decimals):
+        return self.conn.execute("INSERT INTO tokens(address, symbol, decimals) VALUES (?, ?, ?)",
+                                 (address, symbol, decimals)).lastrowid
+
+    def checkpoints(self, token_ids):
+        q = f"SELECT id, last_block FROM tokens WHERE id IN ({','.join('?' * len(token_ids))})"
+        return dict(self.conn.execute(q, list(token_ids)))
+
+    def checkpoint(self, token_id):
+        with self._reader() as conn:
+            return conn.execute("SELECT last_block FROM tokens WHERE id=?", (token_id,)).fetchone()[0]
+
+    def set_checkpoints(self, token_ids, block):
+        self.conn.executemany("UPDATE tokens SET last_block=? WHERE id=?", ((block, t) for t in token_ids))
+
+    def rewind_checkpoints(self, block):
+        self.conn.execute("UPDATE tokens SET last_block = ? WHERE last_block > ?", (block, block))
+
+    def get_meta(self, key, shared=False):
+        if shared:
+            with self._reader() as conn:
+                row = conn.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        else:
+            row = self.conn.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.conn.execute(
+            "INSERT INTO meta(key,value) VALUES(?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+            (key, str(value))
+        )
+
+    def holder_state(self, token_id, addresses, with_tx=False):
+        cols = "address, balance, last_tx_block, last_tx_ts" if with_tx else "address, balance"
+        out = {}
+        for i in range(0, len(addresses), SQL_CHUNK):
+            chunk = addresses[i:i + SQL_CHUNK]
+            q = f"SELECT {cols} FROM holders WHERE token_id = ? AND address IN ({','.join('?' * len(chunk))})"
+            for row in self.conn.execute(q, (token_id, *chunk)):
+                out[row[0]] = (_from_u256(row[1]), *row[2:]) if with_tx else _from_u256(row[1])
+        return out
+
+    def apply_balances(self, token_id, rows):
+        self.conn.executemany(
+            "INSERT INTO holders(token_id, address, balance, last_tx_block, last_tx_ts) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(token_id, address) DO UPDATE SET balance=excluded.balance, "
+            "last_tx_block=excluded.last_tx_block, last_tx_ts=excluded.last_tx_ts",
+            ((token_id, a, _u256(b), blk, ts) for a, b, blk, ts in rows)
+        )
+
+    def delete_holders(self, token_id, addresses):
+        self.conn.executemany("DELETE FROM holders WHERE token_id=? AND address=?",
+                              ((token_id, a) for a in addresses))
+
+    def nonzero_balances(self, token_id):
+        return ((a, _from_u256(b)) for a, b in self.conn.execute(
+            "SELECT address, balance FROM holders WHERE token_id = ? AND balance > ?", (token_id, ZERO_U256)))
+
+    def top(self, token_id, n, with_ts=False):
+        # обратный проход по holders_balance_idx: читается ровно n строк
+        cols = "address, balance, last_tx_ts" if with_ts else "address, balance"
+        with self._reader() as conn:
+            rows = conn.execute(
+                f"SELECT {cols} FROM holders WHERE token_id = ? AND balance > ? ORDER BY balance DESC LIMIT ?",
+                (token_id, ZERO_U256, n)
+            ).fetchall()
+        return [(r[0], _from_u256(r[1]), *r[2:]) for r in rows]
+
+    def balances(self, token_id, addresses):
+        out = {}
+        with self._reader() as conn:
+            for i in range(0, len(addresses), SQL_CHUNK):
+                chunk = addresses[i:i + SQL_CHUNK]
+                rows = conn.execute(
+                    f"SELECT address, balance FROM holders WHERE token_id = ? "
+                    f"AND address IN ({','.join('?' * len(chunk))})",
+                    (token_id, *chunk)
+                ).fetchall()
+                out.update((a, _from_u256(b)) for a, b in rows)
+        return out
+
+    def holder_chunks(self, token_id, min_raw=None, max_raw=None, chunk=None):
+        # фильтры — в SQL: BLOB-балансы сравниваются как числа, это диапазон по holders_balance_idx
+        where, params = ["token_id = ?", "balance > ?"], [token_id, ZERO_U256]
+        if min_raw is not None:
+            where.append("balance >= ?")
+            params.append(_u256(min_raw))
+        if max_raw is not None:
+            where.append("balance <= ?")
+            params.append(_u256(max_raw))
+        with self._reader() as conn:
+            cur = conn.execute(f"SELECT address, balance, last_tx_block, last_tx_ts FROM holders "
+                               f"WHERE {' AND '.join(where)} ORDER BY balance DESC", params)
+            try:
+                while True:
+                    rows = cur.fetchmany(chunk)
+                    if not rows:
+                        return
+                    yield [(a, _from_u256(b), blk, ts) for a, b, blk, ts in rows]
+            finally:
+                cur.close()  # недочитанный курсор держит транзакцию чтения, а с ней и чекпойнт WAL
+
+    def holder_stats(self, token_id):
+        with self._reader() as conn:
+            return {k: (n, _from_u256(b)) for k, n, b in conn.execute(
+                "SELECT bucket, holders, balance FROM holder_stats WHERE token_id = ?", (token_id,))}
+
+    def _add_holder_stats(self, token_id, delta, replace=False):
+        # суммы — uint256, складывать их в SQL нельзя: корзины читаются и пишутся целиком
+        if replace:
+            self.conn.execute("DELETE FROM holder_stats WHERE token_id = ?", (token_id,))
+        cur = {k: [n, _from_u256(b)] for k, n, b in self.conn.execute(
+            "SELECT bucket, holders, balance FROM holder_stats WHERE token_id = ?", (token_id,))}
+        for k, (dn, ds) in delta.items():
+            c = cur.setdefault(k, [0, 0])
+            c[0] += dn
+            c[1] += ds
+        self.conn.executemany("DELETE FROM holder_stats WHERE token_id = ? AND bucket = ?",
+                              ((token_id, k) for k in delta if cur[k][0] <= 0))
+        self.conn.executemany(
+            "INSERT INTO holder_stats(token_id, bucket, holders, balance) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(token_id, bucket) DO UPDATE SET holders=excluded.holders, balance=excluded.balance",
+            ((token_id, k, cur[k][0], _u256(cur[k][1])) for k in delta if cur[k][0] > 0))
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+
+WRITER_LOCK = 0x65726332_30696478  # ключ advisory lock писателя: "erc20idx"
+
+
+class PostgresStorage(Storage):
+    """Состояние в PostgreSQL: балансы — NUMERIC(78,0), top-N — по B-tree (token_id, balance DESC),
+    пачки балансов — через COPY во временную таблицу и один INSERT … ON CONFLICT.
+
+    Писатель — одно соединение с транзакцией до commit(); читатели — пул соединений в
+    autocommit, как read-only пул SQLite.
+    """
+
+    def __init__(self, url, read_pool=SQLITE_READ_POOL):
+        try:
+            import psycopg
+            from psycopg.types.numeric import IntLoader
+        except ImportError:
+            raise RuntimeError("для PostgreSQL нужен psycopg: pip install 'psycopg[binary]'")
+        self._psycopg = psycopg
+        self._int_loader = IntLoader
+        self.url = url
+        self._writer = False
+        self.conn = self._connect()
+        self._create_tables()
+        self._readers = queue.LifoQueue()
+        self._read_slots = threading.BoundedSemaphore(read_pool)
+
+    def _connect(self, autocommit=False):
+        conn = self._psycopg.connect(self.url, autocommit=autocommit)
+        # NUMERIC(78,0) — целые: сразу int, без Decimal
+        conn.adapters.register_loader("numeric", self._int_loader)
+        return conn
+
+    def _create_tables(self):
+        cur = self.conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS tokens (
+                id SERIAL PRIMARY KEY,
+                address TEXT NOT NULL UNIQUE,
+                symbol TEXT,
+                decimals INTEGER NOT NULL,
+                last_block BIGINT
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS holders (
+                token_id INTEGER NOT NULL,
+                address TEXT NOT NULL,
+                balance NUMERIC(78,0) NOT NULL,
+                last_tx_block BIGINT,
+                last_tx_ts BIGINT,
+                PRIMARY KEY (token_id, address)
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS holders_balance_idx ON holders (token_id, balance DESC)")
+        new_stats = cur.execute("SELECT to_regclass('holder_stats')").fetchone()[0] is None
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS holder_stats (
+                token_id INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                holders BIGINT NOT NULL,
+                balance NUMERIC(78,0) NOT NULL,
+                PRIMARY KEY (token_id, bucket)
+            )
+        """)
+        if new_stats:
+            # хранилище, заполненное до holder_stats: корзина — число цифр баланса минус один
+            cur.execute("INSERT INTO holder_stats SELECT token_id, length(balance::text) - 1, count(*), sum(balance) "
+                        "FROM holders WHERE balance > 0 GROUP BY 1, 2")
+        self.conn.commit()
+        # приёмник COPY: у каждого соединения свой, строки уходят в holders тем же запросом
+        cur.execute("""
+            CREATE TEMP TABLE holders_in (
+                token_id INTEGER, address TEXT, balance NUMERIC(78,0), last_tx_block BIGINT, last_tx_ts BIGINT
+            )
+        """)
+        self.conn.commit()
+
+    def claim_writer(self):
+        # Реплики с BACKGROUND_INDEX делят одно хранилище, а holder_stats и балансы пишутся
+        # дельтами от прочитанного состояния: пишет только владелец сессионного advisory lock.
+        # Блокировка держится соединением-писателем, через него же идут все записи: оборвалось
+        # соединение — вместе с блокировкой пропала и незакоммиченная транзакция, и запись
+        # подхватывает следующая реплика.
+        if not self._writer:
+            self._writer = self.conn.execute("SELECT pg_try_advisory_lock(%s)", (WRITER_LOCK,)).fetchone()[0]
+            if not self._writer:
+                self.conn.rollback()
+        return self._writer
+
+    @contextmanager
+    def _reader(self):
+        with self._read_slots:
+            try:
+                conn = self._readers.get_nowait()
+            except queue.Empty:
+                conn = self._connect(autocommit=True)
+            try:
+                yield conn
+            finally:
+                if not conn.broken:  # оборванное соединение (рестарт сервера) в пул не возвращается
+                    self._readers.put(conn)
+
+    def token(self, address):
+        row = self.conn.execute("SELECT id, decimals, symbol FROM tokens WHERE address = %s", (address,)).fetchone()
+        return tuple(row) if row else None
+
+    def add_token(self, address, symbol, decimals):
+        # реплики регистрируют токены одновременно — выигрывает первая, остальные получают её id
+        self.conn.execute("INSERT INTO tokens(address, symbol, decimals) VALUES (%s, %s, %s) "
+                          "ON CONFLICT (address) DO NOTHING", (address, symbol, decimals))
+        return self.token(address)[0]
+
+    def checkpoints(self, token_ids):
+        return dict(self.conn.execute("SELECT id, last_block FROM tokens WHERE id = ANY(%s)", (list(token_ids),)))
+
+    def checkpoint(self, token_id):
+        with self._reader() as conn:
+            return conn.execute("SELECT last_block FROM tokens WHERE id = %s", (token_id,)).fetchone()[0]
+
+    def set_checkpoints(self, token_ids, block):
+        self.conn.execute("UPDATE tokens SET last_block = %s WHERE id = ANY(%s)", (block, list(token_ids)))
+
+    def rewind_checkpoints(self, block):
+        self.conn.execute("UPDATE tokens SET last_block = %s WHERE last_block > %s", (block, block))
+
+    def get_meta(self, key, shared=False):
+        if shared:
+            with self._reader() as conn:
+                row = conn.execute("SELECT value FROM meta WHERE key = %s", (key,)).fetchone()
+        else:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = %s", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.conn.execute("INSERT INTO meta(key, value) VALUES (%s, %s) "
+                          "ON CONFLICT (key) DO UPDATE SET value = excluded.value", (key, str(value)))
+
+    def holder_state(self, token_id, addresses, with_tx=False):
+        cols = "address, balance, last_tx_block, last_tx_ts" if with_tx else "address, balance"
+        rows = self.conn.execute(f"SELECT {cols} FROM holders WHERE token_id = %s AND address = ANY(%s)",
+                                 (token_id, list(addresses)))
+        return {r[0]: tuple(r[1:]) if with_tx else r[1] for r in rows}
+
+    def apply_balances(self, token_id, rows):
+        cur = self.conn.cursor()
+        with cur.copy("COPY holders_in (token_id, address, balance, last_tx_block, last_tx_ts) FROM STDIN") as cp:
+            for a, b, blk, ts in rows:
+                cp.write_row((token_id, a, b, blk, ts))
+        cur.execute("""
+            WITH batch AS (DELETE FROM holders_in RETURNING *)
+            INSERT INTO holders(token_id, address, balance, last_tx_block, last_tx_ts)
+            SELECT token_id, address, balance, last_tx_block, last_tx_ts FROM batch
+            ON CONFLICT (token_id, address) DO UPDATE SET balance = excluded.balance,
+                last_tx_block = excluded.last_tx_block, last_tx_ts = excluded.last_tx_ts
+        """)
+
+    def delete_holders(self, token_id, addresses):
+        self.conn.execute("DELETE FROM holders WHERE token_id = %s AND address = ANY(%s)",
+                          (token_id, list(addresses)))
+
+    def nonzero_balances(self, token_id):
+        return self.conn.execute("SELECT address, balance FROM holders WHERE token_id = %s AND balance > 0",
+                                 (token_id,))
+
+    def top(self, token_id, n, with_ts=False):
+        cols = "address, balance, last_tx_ts" if with_ts else "address, balance"
+        with self._reader() as conn:
+            return [tuple(r) for r in conn.execute(
+                f"SELECT {cols} FROM holders WHERE token_id = %s AND balance > 0 ORDER BY balance DESC LIMIT %s",
+                (token_id, n))]
+
+    def balances(self, token_id, addresses):
+        with self._reader() as conn:
+            return dict(conn.execute("SELECT address, balance FROM holders WHERE token_id = %s AND address = ANY(%s)",
+                                     (token_id, list(addresses))))
+
+    def holder_chunks(self, token_id, min_raw=None, max_raw=None, chunk=None):
+        where, params = ["token_id = %s", "balance > 0"], [token_id]
+        if min_raw is not None:
+            where.append("balance >= %s")
+            params.append(min_raw)
+        if max_raw is not None:
+            where.append("balance <= %s")
+            params.append(max_raw)
+        with self._reader() as conn:
+            # именованный (серверный) курсор: строки приходят по chunk, а не все сразу
+            with conn.transaction(), conn.cursor(name="holder_chunks") as cur:
+                cur.execute(f"SELECT address, balance, last_tx_block, last_tx_ts FROM holders "
+                            f"WHERE {' AND '.join(where)} ORDER BY balance DESC", params)
+                while True:
+                    rows = cur.fetchmany(chunk)
+                    if not rows:
+                        return
+                    yield [tuple(r) for r in rows]
+
+    def holder_stats(self, token_id):
+        with self._reader() as conn:
+            return {k: (n, b) for k, n, b in conn.execute(
+                "SELECT bucket, holders, balance FROM holder_stats WHERE token_id = %s", (token_id,))}
+
+    def _add_holder_stats(self, token_id, delta, replace=False):
+        if replace:
+            self.conn.execute("DELETE FROM holder_stats WHERE token_id = %s", (token_id,))
+        cur = self.conn.cursor()
+        cur.executemany(
+            "INSERT INTO holder_stats(token_id, bucket, holders, balance) VALUES (%s, %s, %s, %s) "
+            "ON CONFLICT (token_id, bucket) DO UPDATE SET holders = holder_stats.holders + excluded.holders, "
+            "balance = holder_stats.balance + excluded.balance",
+            [(token_id, k, dn, ds) for k, (dn, ds) in delta.items()])
+        cur.execute("DELETE FROM holder_stats WHERE token_id = %s AND holders <= 0", (token_id,))
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        self.conn.close()
+
+
+def open_storage(url, conn, reader):
+    # url пустой — состояние в SQLite индекса (conn/reader — его писатель и пул читателей)
+    if not url:
+        return SQLiteStorage(conn, reader)
+    if url.startswith(("postgresql://", "postgres://")):
+        return PostgresStorage(url)
+    raise ValueError(f"неизвестное хранилище: {url}")
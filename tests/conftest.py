@@ -0,0 +1,57 @@
+# Общие фикстуры тестов: модули репозитория и bench/ в sys.path, mock-узлы RPC в этом же процессе.
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "bench")]
+
+import pytest
+
+from config import TOKEN_ADDRESS
+from mock_rpc import Chain, MockNode, serve
+
+
+@pytest.fixture
+def rpc():
+    # rpc(chain, **MockNode kwargs) -> (node, url); узлы останавливаются после теста
+    servers = []
+
+    def start(chain, **kw):
+        node = MockNode(chain, **kw)
+        srv, url = serve(node)
+        servers.append(srv)
+        return node, url
+
+    yield start
+    for srv in servers:
+        srv.shutdown()
+        srv.server_close()
+
+
+@pytest.fixture
+def chain():
+    return Chain(TOKEN_ADDRESS, 1_000_300, start_block=1_000_000, max_per_block=4, holders=50)
+
+
+@pytest.fixture(scope="session")
+def pg_server(tmp_path_factory):
+    # локальный PostgreSQL (pgserver); без него и без psycopg тесты хранилища пропускаются
+    pgserver = pytest.importorskip("pgserver")
+    pytest.importorskip("psycopg")
+    srv = pgserver.get_server(str(tmp_path_factory.mktemp("pg")), cleanup_mode="stop")
+    yield srv
+    srv.cleanup()
+
+
+@pytest.fixture
+def pg_url(pg_server, request):
+    # своя база на тест
+    import psycopg
+
+    name = "t_" + "".join(c if c.isalnum() else "_" for c in request.node.name.lower())[:50]
+    base = pg_server.get_uri()
+    with psycopg.connect(base, autocommit=True) as conn:
+        conn.execute(f"DROP DATABASE IF EXISTS {name}")
+        conn.execute(f"CREATE DATABASE {name}")
+    path, _, query = base.partition("?")
+    return f"{path.rsplit('/', 1)[0]}/{name}?{query}"
@@ -0,0 +1,258 @@
+import csv
+import io
+import json
+import sys
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+import export
+from cache import TopCache
+
+
+@pytest.fixture
+def client(rpc, chain, tmp_path, monkeypatch):
+    _, url = rpc(chain)
+    monkeypatch.setattr(app, "RPC_URLS", [url])
+    monkeypatch.setattr(app, "DB_PATH", str(tmp_path / "app.db"))
+    monkeypatch.setattr(app, "TOKENS", [app.TOKEN_ADDRESS])
+    monkeypatch.setattr(app, "STORAGE_URL", None)
+    monkeypatch.setattr(app, "ARCHIVE_DIR", None)
+    monkeypatch.setenv("BACKGROUND_INDEX", "0")
+    for name in ("cli", "acli", "indexer", "follower", "startup_error"):
+        monkeypatch.setattr(app, name, None)
+    monkeypatch.setattr(app, "token_clients", {})
+    monkeypatch.setattr(app, "top_cache", TopCache(app.TOP_CACHE_MAX_N))
+    with TestClient(app.app) as c:
+        deadline = time.monotonic() + 10
+        while app.indexer is None:
+            assert time.monotonic() < deadline, app.startup_error
+            time.sleep(0.02)
+        yield c
+
+
+def test_index_conf_zero_reaches_head(client, chain):
+    r = client.post("/index", json={"start": chain.head - 50, "conf": 0})
+    assert r.status_code == 200, r.text
+    assert app.indexer._get_last_block() == chain.head
+
+
+def test_index_default_conf_stays_behind_head(client, chain):
+    r = client.post("/index", json={"start": chain.head - 50})
+    assert r.status_code == 200, r.text
+    assert app.indexer._get_last_block() == chain.head - app.CONFIRMATIONS
+
+
+def transfer_pages(client, **params):
+    # все страницы /get_transfers по next_cursor
+    out, cursor, size = [], None, params["limit"]
+    while True:
+        r = client.get("/get_transfers", params={**params, **({"cursor": cursor} if cursor else {})})
+        assert r.status_code == 200, r.text
+        body = r.json()
+        assert len(body["transfers"]) <= size
+        out.extend((t["block"], t["log_index"], t["tx_hash"], t["from"].lower(), t["to"].lower(),
+                    int(t["value_raw"]), t["direction"]) for t in body["transfers"])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return out
+
+
+def test_get_transfers_keyset_pages(client, chain):
+    assert client.post("/index", json={"start": chain.start_block, "conf": 0}).status_code == 200
+    logs = [(int(lg["blockNumber"], 16), int(lg["logIndex"], 16), lg["transactionHash"],
+             "0x" + lg["topics"][1][-40:], "0x" + lg["topics"][2][-40:], int(lg["data"], 16))
+            for lg in chain.logs(chain.start_block, chain.head)]
+    # адрес, который и отправляет, и получает, в том числе сам себе
+    addr = next(f for _, _, _, f, t, _ in logs if f == t)
+
+    def want(lo, hi):
+        return [(*r, "self" if r[3] == r[4] else "out" if r[3] == addr else "in")
+                for r in logs if addr in (r[3], r[4]) and lo <= r[0] <= hi]
+
+    everything = want(chain.start_block, chain.head)
+    assert {d for *_, d in everything} == {"in", "out", "self"}
+    assert transfer_pages(client, address=addr, limit=7, order="asc") == everything
+    assert transfer_pages(client, address=addr, limit=7, order="desc") == everything[::-1]
+    lo, hi = chain.start_block + 50, chain.head - 60
+    assert transfer_pages(client, address=addr, limit=5, order="asc", from_block=lo, to_block=hi) == want(lo, hi)
+    assert transfer_pages(client, address=addr, limit=5, order="desc", from_block=lo, to_block=hi) == want(lo, hi)[::-1]
+    # ровно одна страница: next_cursor нет
+    r = client.get("/get_transfers", params={"address": addr, "limit": len(everything) + 1}).json()
+    assert len(r["transfers"]) == len(everything) and r["next_cursor"] is None
+    assert client.get("/get_transfers", params={"address": addr, "cursor": "x"}).status_code == 400
+
+
+def count_top(monkeypatch):
+    # размеры, с которыми эндпоинты считали топ по индексу
+    sizes = []
+    get_top = app.indexer.get_top
+    monkeypatch.setattr(app.indexer, "get_top", lambda n, **kw: (sizes.append(n), get_top(n, **kw))[1])
+    return sizes
+
+
+def test_top_cache_etag_and_slices(client, chain, monkeypatch):
+    chain.head -= 40
+    assert client.post("/index", json={"start": chain.start_block, "conf": 0}).status_code == 200
+    sizes = count_top(monkeypatch)
+
+    r = client.get("/get_top", params={"n": 20})
+    etag, top = r.headers["etag"], r.json()["top"]
+    assert len(top) == 20 and sizes == [20]
+    for tag in (etag, etag.removeprefix("W/"), f'"other", {etag}'):
+        r = client.get("/get_top", params={"n": 20}, headers={"If-None-Match": tag})
+        assert r.status_code == 304 and r.headers["etag"] == etag and not r.content
+    # меньший n — срез уже посчитанного топа
+    r = client.get("/get_top", params={"n": 5})
+    assert r.json()["top"] == top[-5:] and sizes == [20]
+    assert r.headers["etag"] != etag
+
+    # новое окно: топ считается заново, прежний ETag не подходит
+    chain.head += 40
+    assert client.post("/index", json={"conf": 0}).status_code == 200
+    r = client.get("/get_top", params={"n": 20}, headers={"If-None-Match": etag})
+    assert r.status_code == 200 and r.headers["etag"] != etag and sizes == [20, 20]
+
+    # реорг: курсор возвращается на тот же блок, но поколение индексатора другое
+    etag, last, generation = r.headers["etag"], app.indexer._get_last_block(), app.indexer.generation
+    chain.reorg(5)
+    assert client.post("/index", json={"conf": 0}).status_code == 200
+    assert app.indexer._get_last_block() == last and app.indexer.generation > generation
+    r = client.get("/get_top", params={"n": 20}, headers={"If-None-Match": etag})
+    assert r.status_code == 200 and r.headers["etag"] != etag and sizes == [20, 20, 20]
+
+
+def test_top_above_cache_limit_bypasses_cache(client, chain, monkeypatch):
+    monkeypatch.setattr(app, "top_cache", TopCache(10))
+    assert client.post("/index", json={"start": chain.start_block, "conf": 0}).status_code == 200
+    sizes = count_top(monkeypatch)
+    for _ in range(2):
+        r = client.get("/get_top", params={"n": 30})
+        assert r.status_code == 200 and len(r.json()["top"]) == 30 and "etag" in r.headers
+    assert sizes == [30, 30]
+    assert app.top_cache.stats()["keys"] == 0
+    client.get("/get_top", params={"n": 10})
+    client.get("/get_top", params={"n": 10})
+    assert sizes == [30, 30, 10] and app.top_cache.stats()["keys"] == 1
+
+
+def ndjson(r):
+    assert r.status_code == 200, r.text
+    return [json.loads(line) for line in r.text.splitlines()]
+
+
+def test_export_holders_round_trip(client, chain):
+    assert client.post("/index", json={"start": chain.start_block, "conf": 0}).status_code == 200
+    want = [(a, str(b)) for a, b in sorted(app.indexer._top_rows(10 ** 9, app.indexer.token_id))]
+    top = sorted((a.lower(), b) for a, b in app.indexer.get_top(10 ** 9))
+    assert [a for a, _ in top] == [a for a, _ in want]
+    assert [b for _, b in top] == pytest.approx([int(b) / 10 ** 18 for _, b in want])
+
+    got = ndjson(client.get("/export/holders", params={"format": "ndjson"}))
+    assert sorted((r["address"].lower(), r["balance_raw"]) for r in got if r["balance_raw"] != "0") == want
+    assert all(r["balance"] == export.decimal_str(int(r["balance_raw"]), 18) for r in got)
+    r = client.get("/export/holders", params={"format": "csv"})
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/csv")
+    assert [{k: v for k, v in row.items()} for row in csv.DictReader(io.StringIO(r.text))] == [
+        {k: "" if v is None else str(v) for k, v in row.items()} for row in got]
+
+    # фильтры — в единицах токена, границы включительно
+    raws = sorted(int(b) for _, b in want)
+    lo, hi = raws[len(raws) // 4], raws[3 * len(raws) // 4]
+    got = ndjson(client.get("/export/holders", params={"min_balance": export.decimal_str(lo, 18),
+                                                       "max_balance": export.decimal_str(hi, 18)}))
+    assert sorted(int(r["balance_raw"]) for r in got) == [b for b in raws if lo <= b <= hi]
+    assert client.get("/export/holders", params={"min_balance": "abc"}).status_code == 400
+
+
+def test_export_transfers_round_trip(client, chain):
+    assert client.post("/index", json={"start": chain.start_block, "conf": 0}).status_code == 200
+    lo, hi = chain.start_block + 40, chain.head - 40
+    got = ndjson(client.get("/export/transfers", params={"from_block": lo, "to_block": hi}))
+    assert [(r["block_number"], r["log_index"]) for r in got] == [
+        (int(lg["blockNumber"], 16), int(lg["logIndex"], 16)) for lg in chain.logs(lo, hi)]
+    for addr in {r["from"] for r in got[:5]}:
+        rows, _ = app.indexer.get_transfers(addr, lo, hi, limit=10 ** 6, order="asc")
+        assert [(r["block_number"], r["log_index"], r["tx_hash"], r["from"], r["to"], int(r["value_raw"]), r["ts"])
+                for r in got if addr in (r["from"], r["to"])] == rows
+
+    r = client.get("/export/transfers", params={"format": "csv", "from_block": lo, "to_block": hi})
+    assert r.status_code == 200
+    assert list(csv.DictReader(io.StringIO(r.text))) == [{k: str(v) for k, v in row.items()} for row in got]
+
+
+def test_export_streams_in_chunks(client, chain):
+    assert client.post("/index", json={"start": chain.start_block, "conf": 0}).status_code == 200
+    idx = app.indexer
+    with idx._reader() as conn:
+        chunks = list(export.transfer_chunks(conn, idx.token_id, 18, chunk=7))
+        parts = list(export.stream("ndjson", export.TRANSFER_COLUMNS,
+                                   export.transfer_chunks(conn, idx.token_id, 18, chunk=7)))
+    total = sum(map(len, chunks))
+    assert total > 30 and all(len(c) <= 7 for c in chunks)
+    assert len(parts) == len(chunks) and sum(p.count(b"\n") for p in parts) == total
+
+
+def test_export_parquet_without_pyarrow(client, monkeypatch):
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    for path in ("/export/holders", "/export/transfers"):
+        r = client.get(path, params={"format": "parquet"})
+        assert r.status_code == 400 and "pyarrow" in r.json()["detail"]
+
+
+class StubRPC:
+    # голова и балансы «узла» задаёт тест; адреса и формат — у настоящего клиента
+    def __init__(self, real, head):
+        self.real, self.block, self.calls = real, head, []
+
+    def __getattr__(self, name):
+        return getattr(self.real, name)
+
+    async def head(self):
+        return self.block
+
+    async def get_balance(self, address, with_token):
+        self.calls.append(address)
+        return 777
+
+    async def get_balance_batch(self, addresses, with_token=False):
+        self.calls.extend(addresses)
+        return [777] * len(addresses)
+
+
+def test_balance_source_auto(client, chain, monkeypatch):
+    assert client.post("/index", json={"start": chain.start_block, "conf": 0}).status_code == 200
+    last = app.indexer._get_last_block()
+    addr, raw = app.indexer._top_rows(1, app.indexer.token_id)[0]
+    absent = "0x" + "12" * 20
+    monkeypatch.setattr(app, "INDEX_MAX_LAG", 10)
+    stub = StubRPC(app.acli, last + 10)
+    monkeypatch.setattr(app, "acli", stub)
+
+    def balance(a, **kw):
+        r = client.get("/get_balance", params={"address": a, "human": 0, **kw})
+        assert r.status_code == 200, r.text
+        return r.json()
+
+    def batch(**kw):
+        r = client.post("/get_balance_batch", json={"addresses": [addr, absent, "bad"], **kw})
+        assert r.status_code == 200, r.text
+        return r.json()
+
+    # индекс отстаёт не больше INDEX_MAX_LAG: holders, блок индекса; нет в holders — 0
+    assert balance(addr) == {"balance": raw, "block": last, "source": "index"}
+    assert balance(absent) == {"balance": 0, "block": last, "source": "index"}
+    assert batch() == {"balances": [raw, 0, {"error": "Некорректный адрес: bad"}], "block": last, "source": "index"}
+    assert stub.calls == []
+
+    # отстаёт больше — balanceOf с узла на его голове
+    stub.block = last + 11
+    assert balance(addr) == {"balance": 777, "block": last + 11, "source": "rpc"}
+    assert batch() == {"balances": [777] * 3, "block": last + 11, "source": "rpc"}
+    assert len(stub.calls) == 4
+    # source=index отвечает из holders при любом отставании, source=rpc — всегда с узла
+    assert balance(absent, source="index") == {"balance": 0, "block": last, "source": "index"}
+    stub.block = last
+    assert balance(addr, source="rpc")["source"] == "rpc"
@@ -0,0 +1,69 @@
+import pytest
+
+from config import ERC20_ABI, TOKEN_ADDRESS
+from ps_client import TokenIndexer
+from token_client import TokenClient
+
+
+def indexer(url, tmp_path, name):
+    return TokenIndexer(TokenClient([url], TOKEN_ADDRESS, ERC20_ABI), str(tmp_path / name))
+
+
+def transfers(idx):
+    return idx.conn.execute("SELECT block_number, log_index, tx_hash, value FROM transfers ORDER BY 1, 2").fetchall()
+
+
+def state(idx):
+    return sorted(idx._top_rows(10 ** 9, idx.token_id)), idx.storage.holder_stats(idx.token_id), idx._get_last_block()
+
+
+def test_resume_after_shard_past_a_gap(rpc, chain, tmp_path):
+    _, url = rpc(chain)
+    s = chain.start_block
+    ref = indexer(url, tmp_path, "ref.db")
+    ref.index_transfers(start_block=s, confirmations=0)
+    want_transfers = transfers(ref)
+    ref.close()
+    # те же шарды в том же порядке без обрыва: балансы упираются в ноль, и итог зависит от порядка
+    ref = indexer(url, tmp_path, "ordered.db")
+    ref.backfill(start_block=s, end_block=s + 49, shard_size=50, workers=1, confirmations=0)
+    ref.backfill(start_block=s + 100, end_block=s + 149, shard_size=50, workers=1, confirmations=0)
+    ref.backfill(shard_size=50, workers=1, confirmations=0)
+    want = state(ref)
+    ref.close()
+    assert want[-1] == chain.head
+
+    idx = indexer(url, tmp_path, "backfill.db")
+    fetched = []
+    fetch = idx._fetch_shard
+
+    def fetch_shard(a, b, *args):
+        if stop is not None and a >= stop:
+            raise ConnectionError("узел пропал")
+        fetched.append((a, b))
+        return fetch(a, b, *args)
+
+    idx._fetch_shard = fetch_shard
+    try:
+        stop = None
+        idx.backfill(start_block=s, end_block=s + 49, shard_size=50, workers=1, confirmations=0)
+        assert idx._get_last_block() == s + 49
+
+        # шард после разрыва: записан, но курсор за него не уходит; прогон прерван на следующем
+        stop = s + 150
+        with pytest.raises(ConnectionError):
+            idx.backfill(start_block=s + 100, shard_size=50, workers=1, confirmations=0)
+        assert idx._get_last_block() == s + 49
+        assert idx.conn.execute("SELECT start_block, end_block FROM backfill_shards ORDER BY 1").fetchall() == [
+            (s, s + 49), (s + 100, s + 149)]
+
+        # продолжение с курсора: пройденный шард не запрашивается и не применяется второй раз,
+        # курсор переходит через него, как только разрыв закрыт
+        stop, fetched[:] = None, []
+        idx.backfill(shard_size=50, workers=1, confirmations=0)
+        assert (s + 100, s + 149) not in fetched
+        assert fetched == [(s + 50, s + 99)] + [(b, min(b + 49, chain.head)) for b in range(s + 150, chain.head + 1, 50)]
+        assert transfers(idx) == want_transfers
+        assert state(idx) == want
+    finally:
+        idx.close()
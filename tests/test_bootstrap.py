@@ -0,0 +1,67 @@
+from fake_etherscan import FakeEtherscan, serve, synthetic_rows
+from mock_rpc import Chain
+
+from config import CONFIRMATIONS, ERC20_ABI, TOKEN_ADDRESS
+from ps_client import TokenIndexer
+from token_client import TokenClient
+
+
+def test_bootstrap_behind_cursor_keeps_it(rpc, chain, tmp_path):
+    _, url = rpc(chain)
+    safe_head = chain.head - CONFIRMATIONS
+    srv, es_url = serve(FakeEtherscan(synthetic_rows(chain, chain.start_block, safe_head), rate=1000))
+    try:
+        idx = TokenIndexer(TokenClient([url], TOKEN_ADDRESS, ERC20_ABI), str(tmp_path / "boot.db"))
+        idx.index_transfers(start_block=chain.start_block + 100, confirmations=0)
+        assert idx._get_last_block() == chain.head
+        count = idx.conn.execute("SELECT COUNT(*) FROM transfers").fetchone()[0]
+
+        # bootstrap с начала: дописывает блоки до start индекса, курсор остаётся на голове
+        idx.first_from_polygonscan("test", start_block=chain.start_block, span=50, rate=1000, base_url=es_url)
+        assert idx._get_last_block() == chain.head
+        added = idx.conn.execute("SELECT COUNT(*) FROM transfers WHERE block_number < ?",
+                                 (chain.start_block + 100,)).fetchone()[0]
+        assert added and idx.conn.execute("SELECT COUNT(*) FROM transfers").fetchone()[0] == count + added
+        idx.close()
+    finally:
+        srv.shutdown()
+        srv.server_close()
+
+
+def state(idx, token):
+    tid = idx.token_info(token)[0]
+    count = idx.conn.execute("SELECT COUNT(*) FROM transfers WHERE token_id = ?", (tid,)).fetchone()[0]
+    return sorted(idx._top_rows(10 ** 9, tid)), idx.storage.holder_stats(tid), count
+
+
+def test_bootstrap_without_log_index_next_to_indexed_token(rpc, tmp_path):
+    # два токена, по два перевода в транзакции; у строк tokentx нет logIndex, а transactionIndex
+    # совпадает с logIndex переводов другого токена в том же блоке
+    chain = Chain(TOKEN_ADDRESS, 1_000_300, start_block=1_000_000, max_per_block=4, holders=50, tokens=1)
+    a, b = chain.tokens
+    _, url = rpc(chain)
+    safe_head = chain.head - CONFIRMATIONS
+    rows = synthetic_rows(chain, chain.start_block, safe_head, token=b, log_index=False)
+    srv, es_url = serve(FakeEtherscan(rows, rate=1000))
+    try:
+        ref = TokenIndexer(TokenClient([url], a, ERC20_ABI), str(tmp_path / "ref.db"), tokens=[b])
+        ref.index_transfers(start_block=chain.start_block, confirmations=0)
+        want = state(ref, a), state(ref, b)
+        assert want[0][2] and want[1][2]
+
+        # b — bootstrap, затем a — с узла по тем же блокам (b догоняет только хвост)
+        idx = TokenIndexer(TokenClient([url], a, ERC20_ABI), str(tmp_path / "boot.db"), tokens=[b])
+        idx.first_from_polygonscan("test", start_block=chain.start_block, span=50, offset=100, rate=1000,
+                                   base_url=es_url, token=b)
+        idx.index_transfers(start_block=chain.start_block, confirmations=0)
+        assert (state(idx, a), state(idx, b)) == want
+        idx.close()
+
+        # и наоборот: bootstrap поверх переводов, уже прочитанных с узла, ничего не добавляет
+        ref.first_from_polygonscan("test", start_block=chain.start_block, span=50, offset=100, rate=1000,
+                                   base_url=es_url, token=b)
+        assert (state(ref, a), state(ref, b)) == want
+        ref.close()
+    finally:
+        srv.shutdown()
+        srv.server_close()
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from mock_ws import start
+
+from config import ERC20_ABI, TOKEN_ADDRESS
+from follower import StreamFollower
+from ps_client import TokenIndexer
+from token_client import TokenClient
+
+
+def test_catch_up_does_not_block_event_loop():
+    # apply_block не принял блок — догонка идёт в пуле потоков, цикл событий тем временем живёт
+    ran = threading.Event()
+
+    def index_transfers(**kw):
+        time.sleep(0.5)
+        ran.set()
+
+    idx = SimpleNamespace(apply_block=lambda header, logs: False, index_transfers=index_transfers)
+    f = StreamFollower(idx, "ws://unused", confirmations=0, settle=0)
+    f._heads[10] = ({"hash": "0x0a", "number": hex(10)}, time.monotonic() - 1)
+
+    async def main():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        t = asyncio.create_task(tick())
+        await f._flush()
+        t.cancel()
+        return ticks
+
+    assert asyncio.run(main()) >= 10
+    assert ran.is_set() and not f._heads
+
+
+def events(idx):
+    return idx.conn.execute(
+        "SELECT t.block_number, t.log_index, t.tx_hash, fa.address, ta.address, t.value FROM transfers t "
+        "JOIN addresses fa ON fa.id = t.from_id JOIN addresses ta ON ta.id = t.to_id ORDER BY 1, 2").fetchall()
+
+
+def test_stream_reorg_catches_up(tmp_path):
+    ws_node, http_url, ws_url = start(head=1_000_000, block_time=0.2)
+    ws_node.pause()
+    start_block = ws_node.chain.head - 20
+    idx = TokenIndexer(TokenClient(http_url, TOKEN_ADDRESS, ERC20_ABI), str(tmp_path / "stream.db"))
+    f = StreamFollower(idx, ws_url, start_block=start_block, confirmations=0, settle=0.1)
+    f.start()
+    try:
+        deadline = time.monotonic() + 20
+        while f.last_block is None or f.last_block < ws_node.chain.head:
+            assert time.monotonic() < deadline, f.last_error
+            time.sleep(0.05)
+        ws_node.resume()
+        time.sleep(1)
+        ws_node.reorg(3)  # другая ветка: apply_block откажет, блоки перечитает догонка
+        time.sleep(1)
+        ws_node.pause()
+        head = ws_node.chain.head
+        while f.last_block < head:
+            assert time.monotonic() < deadline, f.last_error
+            time.sleep(0.05)
+    finally:
+        f.stop()
+
+    ref = TokenIndexer(TokenClient(http_url, TOKEN_ADDRESS, ERC20_ABI), str(tmp_path / "ref.db"))
+    ref.index_transfers(start_block=start_block, confirmations=0)
+    assert idx._get_last_block() == ref._get_last_block() == head
+    assert events(idx) == events(ref)
+    idx.close()
+    ref.close()
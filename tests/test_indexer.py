@@ -0,0 +1,179 @@
+import random
+
+from common import offline_client
+
+import ps_client
+from config import ZERO
+from ps_client import TokenIndexer
+from storage import _from_u256
+
+A, B, C = ("0x" + c * 40 for c in "abc")
+
+
+def transfer(frm, to, value, block, li=0):
+    return frm, to, value, block, 1_600_000_000 + 2 * block, "0x%064x" % (block * 1000 + li), li
+
+
+def apply(path, windows):
+    idx = TokenIndexer(offline_client(), path)
+    for page in windows:
+        idx._apply_transfers(page)
+        idx._set_last_block(page[-1][3])
+    holders = sorted(idx._top_rows(10 ** 9, idx.token_id))
+    history = idx.conn.execute("SELECT block_number, address, balance FROM balance_history ORDER BY 1, 2").fetchall()
+    stats = idx.storage.holder_stats(idx.token_id)
+    idx.close()
+    return holders, history, stats
+
+
+def test_overdraft_clamped_per_transfer(tmp_path):
+    # у A 5, он отправляет 10 (баланс не уходит ниже нуля), потом получает 3: итог 3, а не 0
+    events = [transfer(ZERO, A, 5, 1), transfer(A, B, 10, 2), transfer(C, A, 3, 3)]
+    holders, history, _ = apply(str(tmp_path / "one.db"), [events])
+    assert dict(holders) == {A: 3, B: 10}
+    assert [(b, int.from_bytes(v, "big")) for b, a, v in history if a == A] == [(1, 5), (2, 0), (3, 3)]
+
+
+def test_result_does_not_depend_on_windows(tmp_path):
+    # случайные переводы между немногими адресами: балансы то и дело упираются в ноль
+    rnd = random.Random(3)
+    addrs = ["0x%040x" % i for i in range(1, 9)]
+    events = [transfer(ZERO, a, 100, 1, i) for i, a in enumerate(addrs)]
+    for blk in range(2, 200):
+        for li in range(3):
+            f, t = rnd.sample(addrs, 2)
+            events.append(transfer(f, t, rnd.randrange(1, 150), blk, li))
+
+    whole = apply(str(tmp_path / "whole.db"), [events])
+    by_block = {}
+    for e in events:
+        by_block.setdefault(e[3], []).append(e)
+    assert apply(str(tmp_path / "blocks.db"), list(by_block.values())) == whole
+    windows = [events[i:i + 37] for i in range(0, len(events), 37)]
+    assert apply(str(tmp_path / "windows.db"), windows) == whole
+
+
+def replay(events, at_block):
+    # балансы после блока at_block по одному переводу, с нулём снизу
+    bal = {}
+    for f, t, v, blk, *_ in events:
+        if blk > at_block:
+            break
+        if f != ZERO:
+            bal[f] = max(0, bal.get(f, 0) - v)
+        bal[t] = bal.get(t, 0) + v
+    return sorted((a, b) for a, b in bal.items() if b > 0)
+
+
+def snapshot_policy(monkeypatch):
+    # снимок раз в 10 блоков, три последних — все, старше — первый из каждых 40 блоков
+    monkeypatch.setattr(ps_client, "SNAPSHOT_INTERVAL", 10)
+    monkeypatch.setattr(ps_client, "SNAPSHOT_KEEP", 3)
+    monkeypatch.setattr(ps_client, "SNAPSHOT_THIN", 4)
+
+
+def test_snapshot_retention(tmp_path, monkeypatch):
+    snapshot_policy(monkeypatch)
+    rnd = random.Random(5)
+    addrs = ["0x%040x" % i for i in range(1, 30)]
+    events = [transfer(ZERO, a, 1000, 1, i) for i, a in enumerate(addrs)]
+    for blk in range(2, 101):
+        f, t = rnd.sample(addrs, 2)
+        events.append(transfer(f, t, rnd.randrange(1, 700), blk))
+
+    idx = TokenIndexer(offline_client(), str(tmp_path / "snap.db"))
+    try:
+        for b in sorted({e[3] for e in events}):
+            idx._apply_transfers([e for e in events if e[3] == b])
+            idx._set_last_block(b)
+        # снимки на 1, 11, …, 91 — остались три последних и первые из 0..39 и 40..79
+        assert [b for (b,) in idx.conn.execute("SELECT block_number FROM snapshots ORDER BY 1")] == [1, 41, 71, 81, 91]
+        assert idx.conn.execute("SELECT DISTINCT block_number FROM snapshot_balances ORDER BY 1").fetchall() == [
+            (1,), (41,), (71,), (81,), (91,)]
+        # at_block между прореженными снимками дочитывает историю от ближайшего
+        for at in (1, 5, 40, 70, 75, 91, 100):
+            assert sorted((a, _from_u256(b)) for a, b in idx._top_rows_at(100, at, idx.token_id)) == replay(events, at)
+    finally:
+        idx.close()
+
+
+def test_old_at_block_reads_bounded_history(tmp_path, monkeypatch):
+    # at_block далеко позади: по истории проверяются только адреса, менявшиеся после
+    # ближайшего прореженного снимка, а не за всю историю токена
+    snapshot_policy(monkeypatch)
+    rnd = random.Random(7)
+    addrs = ["0x%040x" % i for i in range(1, 2000)]
+    events = [transfer(ZERO, a, 10 ** 6, 1, i) for i, a in enumerate(addrs)]
+    for blk in range(2, 401):
+        for li in range(3):
+            f, t = rnd.sample(addrs, 2)
+            events.append(transfer(f, t, rnd.randrange(1, 10 ** 6), blk, li))
+
+    idx = TokenIndexer(offline_client(), str(tmp_path / "old.db"))
+    try:
+        by_block = {}
+        for e in events:
+            by_block.setdefault(e[3], []).append(e)
+        for b, page in by_block.items():
+            idx._apply_transfers(page)
+            idx._set_last_block(b)
+        snaps = [b for (b,) in idx.conn.execute("SELECT block_number FROM snapshots ORDER BY 1")]
+        assert snaps == [1, 41, 81, 121, 161, 201, 241, 281, 321, 361, 371, 381, 391]
+
+        seeks = []
+        balance_at = TokenIndexer._balance_at
+        monkeypatch.setattr(TokenIndexer, "_balance_at", staticmethod(
+            lambda conn, tid, a, at: (seeks.append(a), balance_at(conn, tid, a, at))[1]))
+        for at in (60, 150, 239):
+            seeks.clear()
+            got = sorted((a, _from_u256(b)) for a, b in idx._top_rows_at(10, at, idx.token_id))
+            assert got == sorted(sorted(replay(events, at), key=lambda r: -r[1])[:10])
+            snap = max(s for s in snaps if s <= at)
+            assert at - snap < 40
+            changed = {a for f, t, _, blk, *_ in events if snap < blk <= at for a in (f, t)}
+            assert len(seeks) <= len(changed) < len(addrs) / 2
+    finally:
+        idx.close()
+
+
+def test_no_snapshots_outside_retention(tmp_path, monkeypatch):
+    # backfill далеко от головы: пишутся только снимки, которые останутся после прореживания
+    snapshot_policy(monkeypatch)
+    idx = TokenIndexer(offline_client(), str(tmp_path / "far.db"))
+    try:
+        taken, snapshot = [], idx._snapshot
+        idx._snapshot = lambda b, t: (taken.append(b), snapshot(b, t))
+        idx.storage.set_meta("head_block", 100)
+        for blk in range(1, 101):
+            idx._apply_transfers([transfer(ZERO, A, 1, blk)])
+            idx._set_last_block(blk)
+        assert taken == [1, 40, 71, 81, 91]
+        assert [b for (b,) in idx.conn.execute("SELECT block_number FROM snapshots ORDER BY 1")] == taken
+    finally:
+        idx.close()
+
+
+def test_transfers_of_one_tx_without_log_index(tmp_path):
+    # строки tokentx без logIndex: три перевода одной транзакции, два из них одинаковые
+    tx = "0x" + "77" * 32
+    logs = [transfer(ZERO, A, 100, 5, 0), (A, B, 10, 5, 1_600_000_010, tx, 3), (A, B, 10, 5, 1_600_000_010, tx, 4),
+            (A, C, 1, 5, 1_600_000_010, tx, 6)]
+    rows = [{"blockNumber": str(blk), "timeStamp": str(ts), "hash": h, "from": f, "to": t, "value": str(v),
+             "transactionIndex": str(i)} for i, (f, t, v, blk, ts, h, _) in enumerate(logs)]
+    rows[2]["transactionIndex"] = rows[3]["transactionIndex"] = "1"
+    scan = ps_client._number_scan_rows([ps_client._etherscan_transfer(r) for r in rows])
+    assert len({t[6] for t in scan}) == 4
+
+    idx = TokenIndexer(offline_client(), str(tmp_path / "tx.db"))
+    try:
+        assert idx._apply_transfers(scan) == 4
+        idx._set_last_block(5)
+        want = sorted(idx._top_rows(10, idx.token_id))
+        assert dict(want) == {A: 79, B: 20, C: 1}
+        # те же переводы с узла (настоящие logIndex) и повтор bootstrap ничего не добавляют
+        assert idx._apply_transfers(logs) == 0
+        assert idx._apply_transfers(scan) == 0
+        assert sorted(idx._top_rows(10, idx.token_id)) == want
+        assert idx.conn.execute("SELECT COUNT(*) FROM transfers").fetchone()[0] == 4
+    finally:
+        idx.close()
@@ -0,0 +1,95 @@
+import sqlite3
+
+from common import offline_client
+
+from config import ZERO
+from ps_client import SCHEMA_VERSION, TokenIndexer
+
+HOLDERS = [
+    ("0xAb5801a7D398351b8bE11C439e05C5B3259aeC9B", 10 ** 18 * 5, 100, 1_600_000_200),
+    ("0x00000000219ab540356cBB839Cbe05303d7705Fa", 123, 110, 1_600_000_220),
+    ("0x000000000000000000000000000000000000dEaD", 0, 90, 1_600_000_180),
+]
+EVENTS = [("0x" + f"{i:064x}", b, i, 1_600_000_000 + 2 * b) for i, b in enumerate((90, 100, 110))]
+
+
+def v1_db(path):
+    # БД первой версии: holders с десятичными строками, meta и events, без blocks
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE holders (address TEXT PRIMARY KEY, balance TEXT NOT NULL, last_tx_block INTEGER, last_tx_ts INTEGER);
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE events (event_id TEXT PRIMARY KEY, block_number INTEGER, tx_hash TEXT, log_index INTEGER, ts INTEGER);
+    """)
+    conn.executemany("INSERT INTO holders VALUES (?, ?, ?, ?)", [(a, str(b), blk, ts) for a, b, blk, ts in HOLDERS])
+    conn.execute("INSERT INTO meta VALUES ('last_scanned_block', '120')")
+    conn.executemany("INSERT INTO events VALUES (?, ?, ?, ?, ?)",
+                     [(f"{h}:{i}", b, h, i, ts) for h, b, i, ts in EVENTS])
+    conn.commit()
+    conn.close()
+
+
+def test_upgrade_v1_to_current(tmp_path):
+    path = str(tmp_path / "v1.db")
+    v1_db(path)
+    idx = TokenIndexer(offline_client(), path)
+    try:
+        assert int(idx._get_meta("schema_version")) == SCHEMA_VERSION
+        assert idx._get_last_block() == 120
+        assert idx._get_meta("history_from") == "120"
+        assert idx._get_meta("transfers_from") == "121"
+
+        want = sorted((a.lower(), b) for a, b, *_ in HOLDERS if b)
+        assert sorted(idx._top_rows(10, idx.token_id)) == want
+        assert idx.storage.holder_stats(idx.token_id) == {18: (1, 5 * 10 ** 18), 2: (1, 123)}
+
+        assert idx.conn.execute("SELECT number, ts FROM blocks ORDER BY 1").fetchall() == [
+            (b, ts) for _, b, _, ts in EVENTS]
+        assert idx.conn.execute("SELECT block_number, log_index, tx_hash, from_id, token_id FROM transfers "
+                                "ORDER BY 1").fetchall() == [
+            (b, i, bytes.fromhex(h[2:]), None, 1) for h, b, i, _ in EVENTS]
+        assert idx.conn.execute("SELECT COUNT(*) FROM balance_history WHERE block_number = 120").fetchone()[0] == 3
+    finally:
+        idx.close()
+
+    # повторное открытие — без миграций и без потерь
+    idx = TokenIndexer(offline_client(), path)
+    try:
+        assert idx._get_last_block() == 120
+        assert sorted(idx._top_rows(10, idx.token_id)) == want
+    finally:
+        idx.close()
+
+
+def test_upgrade_v8_transfers_key(tmp_path):
+    # v8: PK transfers (block_number, log_index) общий для всех токенов
+    path = str(tmp_path / "v8.db")
+    idx = TokenIndexer(offline_client(), path)
+    idx._apply_transfers([(ZERO, "0x" + "a" * 40, 5, 100, 1_600_000_200, "0x" + "01" * 32, 3)])
+    idx._set_last_block(100)
+    want = idx.conn.execute("SELECT * FROM transfers").fetchall()
+    idx.close()
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        DROP INDEX transfers_from_idx;
+        DROP INDEX transfers_to_idx;
+        ALTER TABLE transfers RENAME TO t;
+        CREATE TABLE transfers (block_number INTEGER NOT NULL, log_index INTEGER NOT NULL, tx_hash BLOB NOT NULL,
+            from_id INTEGER, to_id INTEGER, value BLOB, token_id INTEGER NOT NULL,
+            PRIMARY KEY (block_number, log_index)) WITHOUT ROWID;
+        INSERT INTO transfers SELECT * FROM t;
+        DROP TABLE t;
+        CREATE INDEX transfers_from_idx ON transfers(token_id, from_id, block_number);
+        CREATE INDEX transfers_to_idx ON transfers(token_id, to_id, block_number);
+        UPDATE meta SET value = '8' WHERE key = 'schema_version';
+    """)
+    conn.close()
+
+    idx = TokenIndexer(offline_client(), path)
+    try:
+        assert int(idx._get_meta("schema_version")) == SCHEMA_VERSION
+        pk = sorted((r[5], r[1]) for r in idx.conn.execute("PRAGMA table_info(transfers)") if r[5])
+        assert [c for _, c in pk] == ["token_id", "block_number", "log_index"]
+        assert idx.conn.execute("SELECT * FROM transfers").fetchall() == want
+    finally:
+        idx.close()
@@ -0,0 +1,149 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+import pytest
+
+import metrics
+from config import ERC20_ABI, RPC_HEDGE_MIN_SAMPLES, TOKEN_ADDRESS
+from ps_client import TokenIndexer
+from rpc_pool import BehindHead, RPCPool
+from token_client import TokenClient
+
+HEAD = 1_000_000
+LOGS = {"jsonrpc": "2.0", "id": 1, "result": []}
+
+
+def pool(*labels, heads=None, latency=None):
+    # пул без сети: узлы a, b, … с заданными головами; у каждого уже есть замеры eth_getLogs,
+    # так что дубль уходит через RPC_HEDGE_MIN_DELAY
+    p = RPCPool(list(labels))
+    for i, e in enumerate(p.endpoints):
+        e.head = (heads or {}).get(e.label, HEAD)
+        e.latency = (latency or {}).get(e.label, 0.001 * (i + 1))
+        e._samples["eth_getLogs"] = deque([0.001] * RPC_HEDGE_MIN_SAMPLES)
+    return p
+
+
+def sender(slow=(), fail=()):
+    # send(endpoint): медленные узлы отвечают через 0.5s, сбойные — исключением
+    calls = []
+
+    def send(e):
+        calls.append(e.label)
+        if e.label in fail:
+            raise ConnectionError(f"{e.label}: 503")
+        if e.label in slow:
+            time.sleep(0.5)
+        return {**LOGS, "node": e.label}
+    return send, calls
+
+
+def count(m, *key):
+    return m._values.get(key, 0)
+
+
+def test_failover_to_next_node():
+    p = pool("a", "b")
+    send, calls = sender(fail={"a"})
+    before = count(metrics.RPC_FAILOVERS)
+    assert p.call("eth_getLogs", send, HEAD)["node"] == "b"
+    assert calls == ["a", "b"]
+    assert count(metrics.RPC_FAILOVERS) == before + 1
+
+
+def test_hedge_wins_on_slow_node():
+    p = pool("a", "b")
+    send, calls = sender(slow={"a"})
+    won = count(metrics.RPC_HEDGES, "won")
+    t0 = time.perf_counter()
+    assert p.call("eth_getLogs", send, HEAD)["node"] == "b"
+    assert time.perf_counter() - t0 < 0.4
+    assert count(metrics.RPC_HEDGES, "won") == won + 1
+
+
+def test_no_hedge_onto_lagging_node():
+    # медленный узел с головой и быстрый, отставший на 500 блоков: дубль на отстающий отдал бы []
+    p = pool("slow", "lagging", heads={"lagging": HEAD - 500})
+    send, calls = sender(slow={"slow"})
+    assert p.call("eth_getLogs", send, HEAD)["node"] == "slow"
+    assert calls == ["slow"]
+
+
+def test_no_failover_onto_lagging_node():
+    p = pool("a", "lagging", heads={"lagging": HEAD - 500})
+    send, calls = sender(fail={"a"})
+    with pytest.raises(ConnectionError):
+        p.call("eth_getLogs", send, HEAD)
+    assert calls == ["a"]
+    # глубже головы отстающего узла он годится
+    assert p.call("eth_getLogs", send, HEAD - 600)["node"] == "lagging"
+
+
+def test_unknown_head_waits_for_known():
+    # голова узла ещё не пришла: он может оказаться отстающим, запросы к блоку — узлам с головой
+    p = pool("a", "new", heads={"new": None})
+    send, calls = sender(slow={"a"})
+    assert p.call("eth_getLogs", send, HEAD - 10_000)["node"] == "a"
+    assert calls == ["a"]
+    assert p.call("eth_blockNumber", send)["node"] in ("a", "new")
+
+
+def test_busy_node_is_awaited_not_replaced_by_lagging():
+    p = pool("a", "lagging", heads={"lagging": HEAD - 500})
+    a = p.endpoints[0]
+    a.inflight = a.max_inflight
+    assert p.acquire(HEAD, block_wait=False) is None
+    threading.Timer(0.2, p.release, [a]).start()
+    assert p.acquire(HEAD) is a
+
+
+def test_block_nobody_has_seen():
+    p = pool("a", "b", heads={"a": HEAD - 1, "b": HEAD - 5})
+    send, calls = sender()
+    with pytest.raises(BehindHead):
+        p.call("eth_getLogs", send, HEAD)
+    assert calls == []
+
+    def refresh():
+        # голова a догоняет блок со второго опроса
+        refreshes.append(1)
+        if len(refreshes) == 2:
+            p.endpoints[0].head = HEAD
+
+    refreshes = []
+    assert p.call("eth_getLogs", send, HEAD, refresh=refresh)["node"] == "a"
+    assert len(refreshes) == 2
+
+
+def test_async_hedge_skips_lagging_node():
+    p = pool("slow", "lagging", heads={"lagging": HEAD - 500})
+
+    async def send(e):
+        if e.label == "slow":
+            await asyncio.sleep(0.3)
+        return {**LOGS, "node": e.label}
+
+    assert asyncio.run(p.call_async("eth_getLogs", send, HEAD))["node"] == "slow"
+
+
+def index(urls, start, head, tmp_path, name):
+    idx = TokenIndexer(TokenClient(urls, TOKEN_ADDRESS, ERC20_ABI), str(tmp_path / name))
+    for _ in range(10):
+        # голову мог назвать отстающий узел — тогда догоняем следующим проходом
+        idx.index_transfers(start_block=start, batch_size=20, confirmations=0)
+        if (idx._get_last_block() or 0) >= head:
+            break
+    rows = sorted(idx._top_rows(10 ** 9, idx.token_id)), idx._get_last_block()
+    idx.close()
+    return rows
+
+
+def test_index_through_slow_and_lagging_nodes(rpc, chain, tmp_path):
+    _, healthy = rpc(chain)
+    _, slow = rpc(chain, slow_rate=0.3, slow=0.2)
+    _, lagging = rpc(chain, lag=500)
+    ref = index([healthy], chain.start_block, chain.head, tmp_path, "ref.db")
+    assert ref[0] and ref[1] == chain.head
+    assert index([slow, lagging], chain.start_block, chain.head, tmp_path, "pool.db") == ref
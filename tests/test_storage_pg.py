@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+from config import ERC20_ABI, TOKEN_ADDRESS
+from ps_client import TokenIndexer
+from storage import NotWriter, PostgresStorage
+from token_client import TokenClient
+
+
+def indexer(url, tmp_path, name, storage_url=None):
+    return TokenIndexer(TokenClient([url], TOKEN_ADDRESS, ERC20_ABI), str(tmp_path / name), storage_url=storage_url)
+
+
+def state(idx):
+    return sorted(idx._top_rows(10 ** 9, idx.token_id)), idx.storage.holder_stats(idx.token_id), idx._get_last_block()
+
+
+def claim(storage):
+    # сессия прежнего писателя закрыта, но сервер снимает её блокировку не мгновенно
+    deadline = time.monotonic() + 5
+    while not storage.claim_writer():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def test_single_writer_lock(pg_url):
+    a, b = PostgresStorage(pg_url), PostgresStorage(pg_url)
+    try:
+        assert a.claim_writer() and a.claim_writer()
+        assert not b.claim_writer()
+        a.close()
+        claim(b)
+    finally:
+        b.close()
+
+
+def test_replicas_do_not_apply_twice(rpc, chain, tmp_path, pg_url):
+    _, url = rpc(chain)
+    ref = indexer(url, tmp_path, "ref.db")
+    ref.index_transfers(start_block=chain.start_block, batch_size=50, confirmations=0)
+    want = state(ref)
+
+    # две реплики с BACKGROUND_INDEX над одним хранилищем: пишет только первая
+    one = indexer(url, tmp_path, "one.db", pg_url)
+    two = indexer(url, tmp_path, "two.db", pg_url)
+    try:
+        one.index_transfers(start_block=chain.start_block, batch_size=50, confirmations=0)
+        with pytest.raises(NotWriter):
+            two.index_transfers(start_block=chain.start_block, batch_size=50, confirmations=0)
+        assert state(two) == state(one) == want
+
+        one.close()
+        one = None
+        # писатель ушёл: вторая продолжает с курсора хранилища, ничего не применяя повторно
+        claim(two.storage)
+        chain.head += 40
+        two.index_transfers(start_block=chain.start_block, batch_size=50, confirmations=0)
+        ref.index_transfers(start_block=chain.start_block, batch_size=50, confirmations=0)
+        assert two._get_last_block() == chain.head
+        assert state(two) == state(ref)
+    finally:
+        ref.close()
+        if one is not None:
+            one.close()
+        two.close()
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from config import ERC20_ABI, MULTICALL3_ADDRESS, TOKEN_ADDRESS
+from token_client import AsyncTokenClient, TokenClient
+
+BAD = "0x1234"
+
+
+def balances_sync(url, addrs, **kw):
+    return TokenClient([url], TOKEN_ADDRESS, ERC20_ABI, **kw).get_balance_batch(addrs)
+
+
+def balances_async(url, addrs, **kw):
+    async def run():
+        c = await AsyncTokenClient([url], TOKEN_ADDRESS, ERC20_ABI, **kw).connect()
+        try:
+            return await c.get_balance_batch(addrs)
+        finally:
+            await c.close()
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("balances", [balances_sync, balances_async], ids=["sync", "async"])
+@pytest.mark.parametrize("multicall, batch, path", [
+    (True, True, "aggregate3"),
+    (False, True, "batch"),
+    (False, False, "single"),
+])
+def test_balance_batch_errors_per_address(rpc, chain, balances, multicall, batch, path):
+    # невалидный адрес и откатившийся balanceOf получают свою ошибку, соседи — баланс;
+    # без aggregate3 — JSON-RPC batch, без batch — по одному eth_call
+    addrs = [chain.holder(i) for i in range(6)]
+    reverting = addrs[2]
+    node, url = rpc(chain, reverts=[reverting], multicall=multicall, batch=batch)
+    got = balances(url, addrs[:2] + [BAD] + addrs[2:], multicall_address=MULTICALL3_ADDRESS, chunk_size=100)
+
+    assert got[2] == {"error": f"Некорректный адрес: {BAD}"}
+    assert list(got[3]) == ["error"]
+    assert got[:2] + got[4:] == [chain.balance_of(a) for a in addrs if a != reverting]
+
+    # aggregate3 отдаёт отказ одного вызова в его слоте; batch с откатом внутри целиком
+    # повторяется по одному, как и отклонённый узлом
+    n = len(addrs)
+    assert node.calls.get("batch", 0) == {"aggregate3": 0, "batch": 1, "single": 1}[path]
+    assert node.calls.get("eth_call", 0) == {"aggregate3": 1, "batch": 1 + n + n, "single": 1 + n}[path]
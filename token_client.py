@@ -1,56 +1,451 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
+import aiohttp
+from eth_abi import decode, encode
 from web3.middleware.proof_of_authority import ExtraDataToPOAMiddleware
-from web3 import Web3
+from web3 import AsyncWeb3, Web3
 
-class TokenClient:
-    def __init__(self, url, token_address, abi):
-        self.w3 = Web3(Web3.HTTPProvider(url))
-        self.w3.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
+import metrics
+from cache import MISS, BlockCache
+from config import (BALANCE_BATCH_CHUNK, BALANCE_BATCH_WORKERS, HTTP_POOL_SIZE, HTTP_TIMEOUT,
+                    BALANCE_CACHE_SIZE, CACHE_MAX_STALE_BLOCKS, HEAD_TTL)
+from rpc_pool import AsyncPooledHTTPProvider, PooledHTTPProvider
 
-        if not self.w3.is_connected():
-            raise ConnectionError("Ошибка доступа к RPC")
+BALANCE_OF_SELECTOR = bytes.fromhex("70a08231")       # balanceOf(address)
+AGGREGATE3_SELECTOR = bytes.fromhex("82ad56cb")       # Multicall3.aggregate3((address,bool,bytes)[])
+
+
+def _balance_of_data(addr):
+    return BALANCE_OF_SELECTOR + bytes(12) + bytes.fromhex(addr[2:])
+
+
+def _aggregate3_data(token, addrs):
+    # calldata собираем напрямую через eth_abi: обёртки контракта web3 на тысячах
+    # вложенных вызовов стоят дороже самого запроса к узлу
+    calls = [(token, True, _balance_of_data(a)) for a in addrs]
+    return AGGREGATE3_SELECTOR + encode(["(address,bool,bytes)[]"], [calls])
+
+
+def _call_params(to, data, block="latest"):
+    return [{"to": to, "data": "0x" + data.hex()}, block if isinstance(block, str) else hex(block)]
+
+
+def _call_result(resp):
+    if "error" in resp:
+        raise ValueError(resp["error"].get("message", str(resp["error"])))
+    return bytes.fromhex(resp["result"][2:])
+
+
+def _uint256(data):
+    if len(data) < 32:
+        raise ValueError("balanceOf вернул пустой ответ")
+    return int.from_bytes(data[:32], "big")
+
+
+def _outcome(resp):
+    return "error" if isinstance(resp, dict) and "error" in resp else "ok"
+
+
+def _count_batch(batch_requests, resp):
+    # ошибка всего batch приходит одним объектом — она достаётся каждому запросу
+    resps = resp if isinstance(resp, list) else [resp] * len(batch_requests)
+    for (method, _), r in zip(batch_requests, resps):
+        metrics.RPC_REQUESTS.inc(method=method, outcome=_outcome(r))
+
+
+class _MeteredHTTPProvider(PooledHTTPProvider):
+    # каждый запрос — в rpc_requests_total / rpc_request_seconds (вместе с повторами и дублями пула;
+    # попытки по узлам — в rpc_endpoint_*)
+
+    def make_request(self, method, params):
+        t0 = time.perf_counter()
+        try:
+            resp = super().make_request(method, params)
+        except Exception:
+            metrics.RPC_REQUESTS.inc(method=method, outcome="exception")
+            raise
+        finally:
+            metrics.RPC_SECONDS.observe(time.perf_counter() - t0, method=method)
+        metrics.RPC_REQUESTS.inc(method=method, outcome=_outcome(resp))
+        return resp
+
+    def make_batch_request(self, batch_requests):
+        t0 = time.perf_counter()
+        try:
+            resp = super().make_batch_request(batch_requests)
+        except Exception:
+            for method, _ in batch_requests:
+                metrics.RPC_REQUESTS.inc(method=method, outcome="exception")
+            raise
+        finally:
+            metrics.RPC_SECONDS.observe(time.perf_counter() - t0, method="batch")
+        _count_batch(batch_requests, resp)
+        return resp
+
+
+class _MeteredAsyncHTTPProvider(AsyncPooledHTTPProvider):
+
+    async def make_request(self, method, params):
+        t0 = time.perf_counter()
+        try:
+            resp = await super().make_request(method, params)
+        except Exception:
+            metrics.RPC_REQUESTS.inc(method=method, outcome="exception")
+            raise
+        finally:
+            metrics.RPC_SECONDS.observe(time.perf_counter() - t0, method=method)
+        metrics.RPC_REQUESTS.inc(method=method, outcome=_outcome(resp))
+        return resp
+
+    async def make_batch_request(self, batch_requests):
+        t0 = time.perf_counter()
+        try:
+            resp = await super().make_batch_request(batch_requests)
+        except Exception:
+            for method, _ in batch_requests:
+                metrics.RPC_REQUESTS.inc(method=method, outcome="exception")
+            raise
+        finally:
+            metrics.RPC_SECONDS.observe(time.perf_counter() - t0, method="batch")
+        _count_batch(batch_requests, resp)
+        return resp
+
+
+def _aggregate3_balances(raw):
+    (res,) = decode(["(bool,bytes)[]"], raw)
+    out = []
+    for ok, data in res:
+        if ok and len(data) >= 32:
+            out.append(int.from_bytes(data[:32], "big"))
+        else:
+            out.append({"error": "balanceOf завершился ошибкой"})
+    return out
 
-        self.contract = self.w3.eth.contract(
-            address=self.w3.to_checksum_address(token_address),
-            abi=abi
-        )
-        self.address = self._to_checksum(token_address)
-        self.decimals = self.contract.functions.decimals().call()
-        self.symbol = self.contract.functions.symbol().call()
+
+class _BaseTokenClient:
+    # Общее для sync/async клиентов: адреса, форматирование, кэши, раскладка batch-ответа.
+
+    def _init_cache(self, cache_size, max_stale_blocks):
+        # name/symbol/decimals неизменны и кэшируются навсегда; balanceOf и totalSupply —
+        # по номеру блока, с LRU-вытеснением
+        self.name = None
+        self.balances = BlockCache(cache_size, max_stale_blocks)
+        self.supply = BlockCache(1, max_stale_blocks)
+        self._head = None
+        self._head_at = 0.0
+        self.head_hits = 0
+        self.head_misses = 0
+
+    def _cached_head(self):
+        if self._head is not None and time.monotonic() - self._head_at < HEAD_TTL:
+            self.head_hits += 1
+            return self._head
+        self.head_misses += 1
+        return None
+
+    def _set_head(self, head):
+        self._head, self._head_at = head, time.monotonic()
+        return head
+
+    def cache_stats(self):
+        return {
+            "balances": self.balances.stats(),
+            "total_supply": self.supply.stats(),
+            "head": {"block": self._head, "ttl_s": HEAD_TTL,
+                     "hits": self.head_hits, "misses": self.head_misses},
+        }
 
     def _to_checksum(self, addr):
         try:
-            return self.w3.to_checksum_address(addr)
+            return Web3.to_checksum_address(addr)
         except Exception:
             raise ValueError(f"Некорректный адрес: {addr}")
 
-    def get_balance(self, address, with_token):
-        raw = self.contract.functions.balanceOf(
-            self.w3.to_checksum_address(address)
-        ).call()
-        if not with_token:
-            return raw
+    def _fmt(self, raw):
         human = Decimal(raw) / Decimal(10 ** self.decimals)
         return f"{human.normalize()} {self.symbol}"
 
-    def get_balance_batch(self, addresses):
-        return [self.get_balance(a, False) for a in addresses]
+    def _split_batch(self, addresses, head):
+        # Ошибки невалидных адресов и попадания в кэш сразу ложатся в out;
+        # остальное — чанками [(позиция, checksum-адрес), ...] в сеть.
+        out = [None] * len(addresses)
+        misses = []
+        for i, a in enumerate(addresses):
+            try:
+                a = self._to_checksum(a)
+            except ValueError as e:
+                out[i] = {"error": str(e)}
+                continue
+            v = self.balances.get(a, head)
+            if v is MISS:
+                misses.append((i, a))
+            else:
+                out[i] = v
+        return out, [misses[i:i + self.chunk_size] for i in range(0, len(misses), self.chunk_size)]
 
-    def get_token_info(self):
+    def _merge_batch(self, out, chunks, results, head, with_token):
+        for chunk, res in zip(chunks, results):
+            for (i, a), r in zip(chunk, res):
+                out[i] = r
+                if not isinstance(r, dict):
+                    self.balances.put(a, head, r)
+        if with_token:
+            out = [r if isinstance(r, dict) else self._fmt(r) for r in out]
+        return out
+
+    def _info(self, total_supply):
         info = {
             "address": self.address,
             "symbol": self.symbol,
             "decimals": self.decimals,
         }
-        try:
-            total_supply = int(self.contract.functions.totalSupply().call())
+        if total_supply is not None:
             info["totalSupply_raw"] = str(total_supply)
             info["totalSupply_human"] = str(Decimal(total_supply) / Decimal(10 ** self.decimals))
+        if self.name is not None:
+            info["name"] = self.name
+        return info
+
+
+class TokenClient(_BaseTokenClient):
+    """Sync-клиент токена. Конструктор сеть не трогает: decimals/symbol читаются с RPC при
+    первом обращении, если не переданы (например, из реестра токенов индекса).
+
+    url — адрес узла или список адресов: тогда запросы распределяет пул (rpc_pool.py).
+    """
+
+    def __init__(self, url, token_address, abi, multicall_address=None,
+                 chunk_size=BALANCE_BATCH_CHUNK, batch_workers=BALANCE_BATCH_WORKERS,
+                 cache_size=BALANCE_CACHE_SIZE, max_stale_blocks=CACHE_MAX_STALE_BLOCKS,
+                 decimals=None, symbol=None):
+        # cache_allowed_requests: web3 кэширует eth_chainId, а не дёргает его на каждый eth_call
+        self.w3 = Web3(_MeteredHTTPProvider(url, cache_allowed_requests=True))
+        self.w3.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
+
+        self.contract = self.w3.eth.contract(
+            address=self.w3.to_checksum_address(token_address),
+            abi=abi
+        )
+        self.address = self._to_checksum(token_address)
+        self._decimals = decimals
+        self._symbol = symbol
+
+        self.multicall = self._to_checksum(multicall_address) if multicall_address else None
+        self.chunk_size = chunk_size
+        self.batch_workers = batch_workers
+        self._init_cache(cache_size, max_stale_blocks)
+
+    @property
+    def decimals(self):
+        if self._decimals is None:
+            self._decimals = self.contract.functions.decimals().call()
+        return self._decimals
+
+    @property
+    def symbol(self):
+        if self._symbol is None:
+            self._symbol = self.contract.functions.symbol().call()
+        return self._symbol
+
+    def head(self):
+        head = self._cached_head()
+        return head if head is not None else self._set_head(self.w3.eth.block_number)
+
+    def _call(self, to, data, block="latest"):
+        # eth_call мимо форматтеров и валидаторов web3: на горячем пути они съедают больше CPU,
+        # чем сам запрос к узлу
+        return _call_result(self.w3.provider.make_request("eth_call", _call_params(to, data, block)))
+
+    def get_balance(self, address, with_token):
+        addr = self._to_checksum(address)
+        head = self.head()
+        raw = self.balances.get(addr, head)
+        if raw is MISS:
+            raw = _uint256(self._call(self.address, _balance_of_data(addr), head))
+            self.balances.put(addr, head, raw)
+        if not with_token:
+            return raw
+        return self._fmt(raw)
+
+    def get_balance_batch(self, addresses, with_token=False):
+        # Ответ в порядке addresses: баланс либо {"error": ...} для конкретного адреса —
+        # один плохой адрес не роняет весь запрос. Все адреса читаются на одном блоке.
+        head = self.head()
+        out, chunks = self._split_batch(addresses, head)
+        if len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=self.batch_workers) as pool:
+                results = list(pool.map(lambda c: self._balances_chunk(c, head), chunks))
+        else:
+            results = [self._balances_chunk(c, head) for c in chunks]
+        return self._merge_batch(out, chunks, results, head, with_token)
+
+    def _balances_chunk(self, chunk, head):
+        addrs = [a for _, a in chunk]
+        if self.multicall is not None:
+            try:
+                return self._balances_multicall(addrs, head)
+            except Exception as e:
+                print(f"[balances] aggregate3 не прошёл ({e}), пробую JSON-RPC batch")
+        try:
+            return self._balances_rpc_batch(addrs, head)
         except Exception:
-            pass
+            # batch целиком отклонён — по одному, чтобы ошибка досталась только своему адресу
+            out = []
+            for a in addrs:
+                try:
+                    out.append(_uint256(self._call(self.address, _balance_of_data(a), head)))
+                except Exception as e:
+                    out.append({"error": str(e)})
+            return out
+
+    def _balances_multicall(self, addrs, head):
+        return _aggregate3_balances(self._call(self.multicall, _aggregate3_data(self.address, addrs), head))
+
+    def _balances_rpc_batch(self, addrs, head):
+        with self.w3.batch_requests() as batch:
+            for a in addrs:
+                batch.add(self.contract.functions.balanceOf(a).call(block_identifier=head))
+            return [int(r) for r in batch.execute()]
+
+    def get_token_info(self):
+        head = self.head()
+        total_supply = self.supply.get("totalSupply", head)
+        if total_supply is MISS:
+            try:
+                total_supply = int(self.contract.functions.totalSupply().call(block_identifier=head))
+                self.supply.put("totalSupply", head, total_supply)
+            except Exception:
+                total_supply = None
+        if self.name is None:
+            try:
+                self.name = self.contract.functions.name().call()
+            except Exception:
+                pass
+        return self._info(total_supply)
+
+
+class AsyncTokenClient(_BaseTokenClient):
+    """Асинхронный вариант TokenClient поверх AsyncWeb3 для async-эндпоинтов.
+
+    Все запросы идут через одну aiohttp-сессию с пулом соединений (HTTP_POOL_SIZE), её
+    создаёт connect(). Ни конструктор, ни connect() к узлу не обращаются: decimals/symbol,
+    если не переданы, читаются при первом запросе, которому они нужны.
+    """
+
+    def __init__(self, url, token_address, abi, multicall_address=None,
+                 chunk_size=BALANCE_BATCH_CHUNK, batch_workers=BALANCE_BATCH_WORKERS,
+                 pool_size=HTTP_POOL_SIZE, cache_size=BALANCE_CACHE_SIZE,
+                 max_stale_blocks=CACHE_MAX_STALE_BLOCKS, decimals=None, symbol=None):
+        self.w3 = AsyncWeb3(_MeteredAsyncHTTPProvider(url, cache_allowed_requests=True))
+        self.w3.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
+        self.contract = self.w3.eth.contract(
+            address=Web3.to_checksum_address(token_address),
+            abi=abi
+        )
+        self.address = self._to_checksum(token_address)
+        self.decimals = decimals
+        self.symbol = symbol
+        self.multicall = self._to_checksum(multicall_address) if multicall_address else None
+        self.chunk_size = chunk_size
+        self.batch_workers = batch_workers
+        self.pool_size = pool_size
+        self._session = None
+        self._init_cache(cache_size, max_stale_blocks)
+        self._head_lock = asyncio.Lock()
+
+    async def connect(self):
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+        )
+        await self.w3.provider.cache_async_session(self._session)
+        return self
+
+    async def load_metadata(self):
+        if self.decimals is None:
+            self.decimals = await self.contract.functions.decimals().call()
+        if self.symbol is None:
+            self.symbol = await self.contract.functions.symbol().call()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _call(self, to, data, block="latest"):
+        return _call_result(await self.w3.provider.make_request("eth_call", _call_params(to, data, block)))
+
+    async def head(self):
+        head = self._cached_head()
+        if head is not None:
+            return head
+        async with self._head_lock:  # один запрос головы на всех ждущих
+            head = self._head if time.monotonic() - self._head_at < HEAD_TTL else None
+            return head if head is not None else self._set_head(await self.w3.eth.block_number)
+
+    async def get_balance(self, address, with_token):
+        addr = self._to_checksum(address)
+        head = await self.head()
+        raw = self.balances.get(addr, head)
+        if raw is MISS:
+            raw = _uint256(await self._call(self.address, _balance_of_data(addr), head))
+            self.balances.put(addr, head, raw)
+        if not with_token:
+            return raw
+        await self.load_metadata()
+        return self._fmt(raw)
+
+    async def get_balance_batch(self, addresses, with_token=False):
+        if with_token:
+            await self.load_metadata()
+        head = await self.head()
+        out, chunks = self._split_batch(addresses, head)
+        sem = asyncio.Semaphore(self.batch_workers)
+
+        async def run(chunk):
+            async with sem:
+                return await self._balances_chunk(chunk, head)
+
+        results = await asyncio.gather(*(run(c) for c in chunks))
+        return self._merge_batch(out, chunks, results, head, with_token)
+
+    async def _balances_chunk(self, chunk, head):
+        addrs = [a for _, a in chunk]
+        if self.multicall is not None:
+            try:
+                return _aggregate3_balances(
+                    await self._call(self.multicall, _aggregate3_data(self.address, addrs), head))
+            except Exception as e:
+                print(f"[balances] aggregate3 не прошёл ({e}), пробую JSON-RPC batch")
         try:
-            name = self.contract.functions.name().call()
-            info["name"] = name
+            async with self.w3.batch_requests() as batch:
+                for a in addrs:
+                    batch.add(self.contract.functions.balanceOf(a).call(block_identifier=head))
+                return [int(r) for r in await batch.async_execute()]
         except Exception:
-            pass
-        return info
\ No newline at end of file
+            out = []
+            for a in addrs:
+                try:
+                    out.append(_uint256(await self._call(self.address, _balance_of_data(a), head)))
+                except Exception as e:
+                    out.append({"error": str(e)})
+            return out
+
+    async def get_token_info(self):
+        await self.load_metadata()
+        head = await self.head()
+        total_supply = self.supply.get("totalSupply", head)
+        if total_supply is MISS:
+            try:
+                total_supply = int(await self.contract.functions.totalSupply().call(block_identifier=head))
+                self.supply.put("totalSupply", head, total_supply)
+            except Exception:
+                total_supply = None
+        if self.name is None:
+            try:
+                self.name = await self.contract.functions.name().call()
+            except Exception:
+                pass
+        return self._info(total_supply)